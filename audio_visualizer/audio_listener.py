@@ -7,14 +7,31 @@ Supports user-defined low-threshold and intensity parameters instead of history-
 
 import argparse
 import json
+import mmap
 import numpy as np
-import sounddevice as sd
 import paho.mqtt.client as mqtt
 import time
 import sys
-import queue
+import math
+import os
+import struct
+import threading
+import wave
+import zlib
 from collections import deque
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Iterator
+
+# Shared Python modules of the listeners live next to this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "python_common"))
+from mqtt_publisher import CoalescingPublisher, NullMqttClient
+
+# sounddevice needs the PortAudio library, which is only required for live capture
+# (file, synthetic and benchmark modes work without it)
+try:
+    import sounddevice as sd
+except (ImportError, OSError) as e:
+    sd = None
+    SOUNDDEVICE_IMPORT_ERROR = e
 
 # Try to import new MQTT API, fall back to old if not available
 try:
@@ -24,8 +41,23 @@ except ImportError:
     MQTT_API_V2_AVAILABLE = False
 
 # Audio settings
+# CHUNK_SIZE is also the reference frame length that all per-frame time constants
+# (AGC decay, history lengths) were tuned for
 CHUNK_SIZE = 1024
 SAMPLE_RATE = 44100
+# Upper bound for audio waiting between the input callback and the analysis loop,
+# older blocks are dropped when analysis falls further behind than this
+MAX_BUFFERED_SECONDS = 0.5
+# Backlogs up to this many blocks are read as views into the ring buffer, larger ones are copied
+# because the callback keeps writing (into the oldest slots) while the batch is being analysed
+ZERO_COPY_BLOCKS = 4
+
+# Capture profiles. low-power captures at the first of LOW_POWER_SAMPLE_RATES the device accepts,
+# uses a shorter FFT with the same duration and skips analysis during silence (see process_blocks)
+CAPTURE_PROFILES = ('default', 'low-power')
+LOW_POWER_SAMPLE_RATES = (22050, 16000)
+LOW_POWER_FFT_SIZE = 512
+LOW_POWER_SILENCE_GATE = 2.0  # Seconds below low_threshold before falling back to the RMS-only path
 
 # Frequency band definitions (Hz)
 FREQUENCY_BANDS = {
@@ -37,15 +69,1260 @@ FREQUENCY_BANDS = {
     'highs': (4000, 8000),
     'presence': (8000, 16000)
 }
+BAND_NAMES = list(FREQUENCY_BANDS.keys())
+
+# Multi-rate analysis: bands that end at or below DECIMATED_MAX_FREQ are measured on a low-passed
+# copy of the signal decimated to about DECIMATED_RATE, where a short FFT has fine bin spacing
+# (256 points at 2756 Hz give 10.8 Hz bins instead of 43 Hz at 44.1 kHz / 1024)
+DECIMATED_RATE = 2756.0
+DECIMATED_MAX_FREQ = 250.0
+DEFAULT_BASS_FFT_SIZE = 256
+
+# Filterbank mode (--bands N): N triangular bars spaced on a log or mel scale replace the named bands
+FILTERBANK_SCALES = ('log', 'mel')
+FILTERBANK_MIN_FREQ = 40.0
+FILTERBANK_MAX_FREQ = 16000.0
+MAX_FILTERBANK_BARS = 254  # The binary format counts intensity plus bars in one uint8
+
+# Wire formats for the data topic. JSON is the default, the binary formats are a fixed
+# little endian layout (36 bytes for binary, 44 for binary16):
+#   header: version (uint8), flags (uint8), value count (uint8), tempo confidence (uint8, 0-255),
+#           sequence number (uint32), capture timestamp (float64, unix seconds),
+#           capture to publish latency (float32, milliseconds), tempo (float32, BPM, 0 when unknown),
+#           next predicted beat relative to the capture timestamp (float32, milliseconds, NaN when unknown)
+#   values: intensity followed by the bands in BAND_NAMES order (or the filterbank bars when
+#           BINARY_FLAG_BARS is set), quantized to uint8 (0-255) or uint16 (0-65535) when
+#           BINARY_FLAG_WIDE is set
+DATA_FORMATS = ('json', 'binary', 'binary16')
+BINARY_FORMAT_VERSION = 3
+BINARY_HEADER = struct.Struct('<BBBBIdfff')
+BINARY_FLAG_BEAT = 0x01
+BINARY_FLAG_WIDE = 0x02
+BINARY_FLAG_BARS = 0x04
+BINARY_FLAG_CHANNELS = 0x08
+# Multi-channel frames (--channels N, BINARY_FLAG_CHANNELS) append after the values: channel count (uint8),
+# per-channel beat bitmask (uint8), then intensity and bands of every channel, then the stereo balance
+# (-1 left to 1 right, mapped to 0-1) and width, all quantized like the values
+MAX_CHANNELS = 8
+
+# Shared memory output (--shm-path): the newest binary frame in a memory-mapped file, guarded by a
+# sequence counter that is odd while a frame is being written (seqlock). Header layout:
+# magic, layout version, reserved, capacity, sequence, payload length, payload crc32
+SHM_MAGIC = b'PAVF'
+SHM_LAYOUT_VERSION = 1
+SHM_HEADER = struct.Struct('<4sHHIIII')
+SHM_SEQUENCE_OFFSET = 12
+SHM_CAPACITY = 8192
+DEFAULT_SHM_PATH = "/dev/shm/protogen-audio"
+
+# Frame log (--record / --replay): a header followed by fixed-size records, see recording_dtype.
+# Header: magic, layout version, flags (RECORD_FLAG_BARS), values per row, channels, record size
+RECORD_MAGIC = b'PAVR'
+RECORD_LAYOUT_VERSION = 1
+RECORD_HEADER = struct.Struct('<4sHHHHI')
+RECORD_FLAG_BARS = 0x01
+RECORD_BEAT = 0x01
+RECORD_PUBLISHED = 0x02
+
+# Publish gating defaults: values are compared after quantization to the published range (0.0-1.0)
+DEFAULT_DEADBAND = 0.01
+DEFAULT_MAX_PUBLISH_RATE = 50.0
+DEFAULT_MIN_PUBLISH_RATE = 10.0
+DEFAULT_KEYFRAME_MS = 1000
+
+# Instrumentation stats, published periodically while enabled
+DEFAULT_STATS_TOPIC = "protogen/audio-visualizer/stats"
+DEFAULT_STATS_INTERVAL = 5.0
+
+# Config topic keys that reconfigure the stream in place, mapped to their attribute names
+STREAM_CONFIG_KEYS = {'sampleRate': 'sample_rate', 'blockSize': 'hop_size', 'fftSize': 'fft_size'}
+
+# Beat detection settings (spectral flux onsets feeding an autocorrelation tempo estimator)
+ONSET_BANDS = 24                # Log spaced sub-bands the flux is computed on (40 Hz - 16 kHz)
+ONSET_WINDOW_SECONDS = 1.0      # Rolling statistics of the flux that onsets must stand out from
+ONSET_THRESHOLD_STD = 1.5       # Onsets exceed the rolling mean by this many standard deviations
+ONSET_MIN_FLUX = 0.01           # Mean log-magnitude increase per bin, ignores hiss and mic hum
+ONSET_REFRACTORY_SECONDS = 0.1  # Minimum spacing of two onsets
+TEMPO_MIN_BPM = 60.0
+TEMPO_MAX_BPM = 200.0
+TEMPO_PRIOR_BPM = 120.0         # Centre of the log-gaussian tempo prior that resolves octave ambiguity
+TEMPO_DECAY_SECONDS = 4.0       # Memory of the onset envelope autocorrelation
+
+
+def supported_sample_rate(device_index: Optional[int], candidates, channels: int = 1) -> int:
+    """First of candidates the input device accepts with this many channels, SAMPLE_RATE when it accepts none of them"""
+    if sd is None:
+        return candidates[0]
+    for sample_rate in candidates:
+        try:
+            sd.check_input_settings(device=device_index, channels=channels, samplerate=sample_rate)
+            return sample_rate
+        except Exception:
+            pass
+    return SAMPLE_RATE
+
+
+def analysis_window(block_size: int) -> np.ndarray:
+    """Hamming window normalized to the coherent gain of the CHUNK_SIZE reference window, so band
+    energies (and therefore low_threshold) keep the same scale regardless of the FFT size"""
+    window = np.hamming(block_size)
+    return window * (np.sum(np.hamming(CHUNK_SIZE)) / np.sum(window))
+
+
+class BandEngine:
+    """Precomputed FFT window and per-band bin ranges for a fixed block size.
+
+    Building the window and the band masks is more expensive than the FFT itself on a Pi,
+    so everything that only depends on the block size and sample rate is done once here.
+    """
+
+    def __init__(self, block_size: int, sample_rate: int, bands: Dict[str, tuple] = FREQUENCY_BANDS):
+        self.block_size = block_size
+        self.sample_rate = sample_rate
+        self.band_names = list(bands.keys())
+        self.band_count = len(self.band_names)
+        self.window = analysis_window(block_size)
+
+        # Band edges are inclusive on both ends, and the rfft bins are sorted, so every band
+        # maps to one contiguous [start, stop) slice of the magnitude spectrum
+        freqs = np.fft.rfftfreq(block_size, 1.0 / sample_rate)
+        edges = np.array(list(bands.values()), dtype=np.float64)
+        self.starts = np.searchsorted(freqs, edges[:, 0], side='left')
+        self.stops = np.searchsorted(freqs, edges[:, 1], side='right')
+        self.counts = np.maximum(self.stops - self.starts, 0)
+        self._safe_counts = np.maximum(self.counts, 1)
+
+    def magnitude(self, audio_data: np.ndarray) -> np.ndarray:
+        """Windowed rfft magnitude of one frame, or of every row of a (frames, block_size) batch"""
+        return np.abs(np.fft.rfft(audio_data * self.window, axis=-1))
+
+    def band_means(self, magnitude: np.ndarray) -> np.ndarray:
+        """Mean magnitude of every band in one pass (along the last axis), empty bands are 0.0"""
+        cumsum = np.zeros(magnitude.shape[:-1] + (magnitude.shape[-1] + 1,))
+        np.cumsum(magnitude, axis=-1, out=cumsum[..., 1:])
+        sums = cumsum[..., self.stops] - cumsum[..., self.starts]
+        return np.where(self.counts > 0, sums / self._safe_counts, 0.0)
+
+
+class FilterbankEngine(BandEngine):
+    """Triangular filterbank with `count` bars spaced evenly on a log or mel frequency scale.
+
+    The weights are built once as a banded matrix over the bins the bars cover, so every frame
+    (or batch of frames) costs one matrix multiply. Each bar is a weighted mean of its bins, which
+    keeps the values on the same scale as the named bands.
+    """
+
+    def __init__(self, block_size: int, sample_rate: int, count: int, scale: str = 'log',
+                 min_freq: float = FILTERBANK_MIN_FREQ, max_freq: float = FILTERBANK_MAX_FREQ):
+        self.block_size = block_size
+        self.sample_rate = sample_rate
+        self.scale = scale
+        self.band_count = count
+        self.band_names = [f"bar_{i}" for i in range(count)]
+        self.window = analysis_window(block_size)
+
+        # count + 2 points: every bar rises from the previous point to its own and falls to the next
+        max_freq = min(max_freq, sample_rate / 2.0)
+        if scale == 'mel':
+            mels = np.linspace(self.hz_to_mel(min_freq), self.hz_to_mel(max_freq), count + 2)
+            points = 700.0 * (10.0 ** (mels / 2595.0) - 1.0)
+        elif scale == 'log':
+            points = np.geomspace(min_freq, max_freq, count + 2)
+        else:
+            raise ValueError(f"Unknown filterbank scale: {scale}")
+        self.centers = points[1:-1]
+
+        freqs = np.fft.rfftfreq(block_size, 1.0 / sample_rate)
+        lower, center, upper = points[:-2, np.newaxis], points[1:-1, np.newaxis], points[2:, np.newaxis]
+        weights = np.maximum(0.0, np.minimum((freqs - lower) / (center - lower), (upper - freqs) / (upper - center)))
+        # Low bars can be narrower than the bin spacing and miss every bin, they use the nearest one
+        empty = weights.sum(axis=1) == 0.0
+        weights[empty, np.abs(freqs - self.centers[empty, np.newaxis]).argmin(axis=1)] = 1.0
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        # Only the bins between the first and last non-zero weight take part in the multiply
+        used = np.flatnonzero(weights.any(axis=0))
+        self.start, self.stop = int(used[0]), int(used[-1]) + 1
+        self.weights = np.ascontiguousarray(weights[:, self.start:self.stop].T)
+
+    @staticmethod
+    def hz_to_mel(freq: float) -> float:
+        return 2595.0 * math.log10(1.0 + freq / 700.0)
+
+    def band_means(self, magnitude: np.ndarray) -> np.ndarray:
+        """Weighted mean magnitude of every bar (along the last axis)"""
+        return magnitude[..., self.start:self.stop] @ self.weights
+
+
+class DecimatedBandAnalyzer:
+    """Band energies of the lowest bands from a low-passed and decimated copy of the signal.
+
+    A windowed-sinc FIR low-pass is evaluated only at every `factor`-th sample, so decimating
+    costs about taps / factor multiplies per input sample. The decimated samples get their own
+    sliding window and FFT, which resolves the sub-bass bands for a fraction of the cost of a
+    full-rate FFT of the same duration.
+    """
+
+    def __init__(self, sample_rate: int, bands: Dict[str, tuple], fft_size: int = DEFAULT_BASS_FFT_SIZE,
+                 reference_fft_size: int = CHUNK_SIZE, target_rate: float = DECIMATED_RATE):
+        self.factor = max(1, int(round(sample_rate / target_rate)))
+        self.rate = sample_rate / self.factor
+        self.fft_size = fft_size
+        self.band_engine = BandEngine(fft_size, self.rate, bands)
+
+        # Pass the bands, reject everything that would alias into them (above rate - highest band
+        # edge), the cutoff sits in the middle of that transition at the decimated Nyquist frequency
+        max_freq = max(high for _, high in bands.values())
+        transition = max(self.rate - 2.0 * max_freq, 1.0) / sample_rate
+        taps = int(math.ceil(5.0 / transition)) | 1
+        n = np.arange(taps) - (taps - 1) / 2.0
+        kernel = np.sinc(n / self.factor) * np.hamming(taps)
+        self.taps = (kernel / np.sum(kernel)).astype(np.float32)
+
+        self._history = None  # Last taps - 1 input samples (per channel), created with the first batch
+        self._phase = 0  # Offset of the next output sample into the history + new samples
+        self.window = None
+        # Bins are 'reference bin width / own bin width' times narrower, scale the band means so a
+        # tone reads about the same as on the full-rate FFT and low_threshold keeps its meaning
+        self.scale = (sample_rate / reference_fft_size) / (self.rate / fft_size)
+        # With only a few bands a (bins, bands) averaging matrix is cheaper than the cumsum in band_means
+        engine = self.band_engine
+        self.stop = int(np.max(engine.stops))
+        self.weights = np.zeros((self.stop, engine.band_count))
+        for i, (start, stop) in enumerate(zip(engine.starts, engine.stops)):
+            if stop > start:
+                self.weights[start:stop, i] = self.scale / (stop - start)
+
+    def process(self, blocks: np.ndarray) -> np.ndarray:
+        """Band means for every block of a (blocks, [channels,] hop_size) batch, shape (blocks, [channels,] bands)"""
+        channels = blocks.shape[1:-1]
+        if self._history is None or self._history.shape[:-1] != channels:
+            self._history = np.zeros(channels + (len(self.taps) - 1,), dtype=np.float32)
+            self.window = SampleRingBuffer(self.fft_size, channels[0] if channels else 1)
+        phase = self._phase
+        new_samples = len(blocks) * blocks.shape[-1]
+        samples = np.concatenate((self._history, join_blocks(blocks)), axis=-1)
+        # Only the FIR outputs at every factor-th sample are computed, as strided windows into samples
+        count = (samples.shape[-1] - len(self.taps) - phase) // self.factor + 1
+        step = samples.strides[-1]
+        windows = np.lib.stride_tricks.as_strided(samples[..., phase:], channels + (count, len(self.taps)),
+                                                  samples.strides[:-1] + (step * self.factor, step))
+        decimated = windows @ self.taps
+        # Output j ends at new sample phase + j * factor, carry the remainder over to the next batch
+        self._phase = phase + count * self.factor - new_samples
+        self._history = samples[..., new_samples:]
+
+        if len(blocks) == 1:
+            self.window.push(decimated)
+            frames = self.window.view()[np.newaxis]
+        else:
+            # Number of new decimated samples available at the end of every block
+            ends = np.arange(1, len(blocks) + 1) * blocks.shape[-1] - 1
+            available = np.clip((ends - phase) // self.factor + 1, 0, count)
+            combined = np.concatenate((self.window.view(), decimated), axis=-1)
+            self.window.push(decimated)
+            frames = np.lib.stride_tricks.sliding_window_view(combined, self.fft_size, axis=-1)[..., available, :]
+            frames = np.moveaxis(frames, -2, 0)
+        return self.band_engine.magnitude(frames)[..., :self.stop] @ self.weights
+
+
+def follow_ceiling(ceiling, values: np.ndarray, decay: float, floor: float = 0.005):
+    """Run the instant-attack / slow-decay ceiling follower over a batch of frames (axis 0).
+
+    One step is c = max(x, floor, c * decay + x * (1 - decay)). Affine maps with a positive slope
+    distribute over max, so K steps unroll to
+        c_K = decay^K * (S_K + max(c_0, max_j(decay^-j * max(x_j, floor) - S_j)))
+    with S_k = sum_{i<=k} decay^-i * (1 - decay) * x_i, which needs no loop over the frames.
+    """
+    k = np.arange(1, len(values) + 1).reshape((-1,) + (1,) * (values.ndim - 1))
+    growth = decay ** -k
+    s = np.cumsum(growth * (1.0 - decay) * values, axis=0)
+    w = np.maximum(ceiling, np.max(growth * np.maximum(values, floor) - s, axis=0))
+    return decay ** len(values) * (s[-1] + w)
+
+
+class SampleRingBuffer:
+    """Sliding window over the most recent samples.
+
+    Every sample is written twice (at i and i + size) so the newest `size` samples are always
+    available as one contiguous view without copying or shifting the buffer. With channels > 1
+    every channel is a row and blocks are (channels, samples).
+    """
+
+    def __init__(self, size: int, channels: int = 1):
+        self.size = size
+        self._data = np.zeros((size * 2,) if channels == 1 else (channels, size * 2), dtype=np.float32)
+        self._pos = 0
+
+    def push(self, block: np.ndarray):
+        """Append a block of samples (along the last axis), dropping the oldest ones"""
+        if block.shape[-1] > self.size:
+            block = block[..., -self.size:]
+        n = block.shape[-1]
+        first = min(n, self.size - self._pos)
+        self._data[..., self._pos:self._pos + first] = block[..., :first]
+        self._data[..., self._pos + self.size:self._pos + self.size + first] = block[..., :first]
+        if first < n:
+            self._data[..., :n - first] = block[..., first:]
+            self._data[..., self.size:self.size + n - first] = block[..., first:]
+        self._pos = (self._pos + n) % self.size
+
+    def view(self) -> np.ndarray:
+        """The newest `size` samples, oldest first (view into the buffer, valid until the next push)"""
+        return self._data[..., self._pos:self._pos + self.size]
+
+
+def join_blocks(blocks: np.ndarray) -> np.ndarray:
+    """Concatenate a (blocks, ..., block_size) batch into one (..., blocks * block_size) signal per channel"""
+    return np.moveaxis(blocks, 0, -2).reshape(blocks.shape[1:-1] + (-1,))
+
+
+class RunningStats:
+    """Mean and variance over the last `size` values in O(1) per value.
+
+    Values are kept in a preallocated ring array next to running sums of x and x^2, which are
+    updated as values enter and leave the window. The sums are rebuilt from the ring once per
+    wrap-around so floating point drift can not build up.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.count = 0
+        self._values = np.zeros(self.size)
+        self._pos = 0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._since_resync = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        if not self.count:
+            return 0.0
+        mean = self._sum / self.count
+        return math.sqrt(max(0.0, self._sum_sq / self.count - mean * mean))
+
+    def extend(self, values) -> np.ndarray:
+        """Append a batch of values and return the window mean right after each of them"""
+        values = np.asarray(values, dtype=np.float64)
+        k = len(values)
+        if k == 0:
+            return values
+
+        # Value pushed out of the window by every new value (zero while the window is still filling)
+        steps = np.arange(k)
+        evicted = np.where(steps < self.size, self._values[(self._pos + steps) % self.size],
+                           values[np.maximum(steps - self.size, 0)])
+        evicted[steps < self.size - self.count] = 0.0
+        counts = np.minimum(self.size, self.count + steps + 1)
+        means = (self._sum + np.cumsum(values) - np.cumsum(evicted)) / counts
+
+        self._sum += float(np.sum(values) - np.sum(evicted))
+        self._sum_sq += float(np.dot(values, values) - np.dot(evicted, evicted))
+
+        # Store the newest values in the ring
+        tail = values[-self.size:]
+        idx = (self._pos + np.arange(k - len(tail), k)) % self.size
+        self._values[idx] = tail
+        self._pos = (self._pos + k) % self.size
+        self.count = int(counts[-1])
+
+        self._since_resync += k
+        if self._since_resync >= self.size:
+            self._since_resync = 0
+            self._sum = float(np.sum(self._values))
+            self._sum_sq = float(np.dot(self._values, self._values))
+        return means
+
+    def values(self) -> np.ndarray:
+        """The values in the window, oldest first"""
+        if self.count < self.size:
+            return self._values[:self.count].copy()
+        return np.roll(self._values, -self._pos)
+
+    def resampled(self, size: int, ratio: float = 1.0) -> 'RunningStats':
+        """Copy with a new window size, the history is stretched by ratio (new / old frame rate)
+        so it keeps covering the same time span"""
+        stats = RunningStats(size)
+        values = self.values()
+        if len(values) > 1 and ratio != 1.0:
+            count = max(1, int(round(len(values) * ratio)))
+            values = np.interp(np.linspace(0, len(values) - 1, count), np.arange(len(values)), values)
+        stats.extend(values[-stats.size:])
+        return stats
+
+
+class OnsetDetector:
+    """Spectral flux onset detector.
+
+    The flux of a frame is the mean increase of the log-compressed magnitude over the previous
+    frame across ONSET_BANDS log spaced sub-bands, so vocals, snares and synths trigger just like
+    kick drums while broadband noise averages out within each sub-band. A frame is an onset when
+    its flux exceeds the rolling mean by ONSET_THRESHOLD_STD standard deviations, with a refractory
+    period so one hit does not trigger several overlapping frames.
+    """
+
+    def __init__(self, frame_rate: float, block_size: int, sample_rate: int):
+        self.frame_rate = frame_rate
+        edges = np.geomspace(40.0, min(16000.0, sample_rate / 2.0), ONSET_BANDS + 1)
+        self.band_engine = BandEngine(block_size, sample_rate,
+                                      {i: (edges[i], edges[i + 1]) for i in range(ONSET_BANDS)})
+        # Bands too narrow for the bin spacing of small FFTs stay empty and are left out
+        self._used = self.band_engine.counts > 0
+        self.flux_stats = RunningStats(max(2, int(round(ONSET_WINDOW_SECONDS * frame_rate))))
+        self.refractory_frames = max(1, int(round(ONSET_REFRACTORY_SECONDS * frame_rate)))
+        self._previous = None
+        self._frames_since_onset = self.refractory_frames
+
+    def process(self, magnitude: np.ndarray, gate: np.ndarray):
+        """Return (novelty envelope, onset flags) for a (frames, bins) batch of magnitudes.
+
+        gate marks the frames loud enough (above the noise floor) to count as onsets.
+        """
+        log_magnitude = np.log1p(10.0 * self.band_engine.band_means(magnitude)[:, self._used])
+        if self._previous is None:
+            self._previous = log_magnitude[0]
+        previous = np.vstack((self._previous[np.newaxis], log_magnitude[:-1]))
+        flux = np.mean(np.maximum(log_magnitude - previous, 0.0), axis=-1)
+        self._previous = log_magnitude[-1].copy()
+
+        means = self.flux_stats.extend(flux)
+        novelty = np.maximum(flux - means, 0.0)
+        # The spread changes slowly, the one after the batch is close enough for every frame in it
+        threshold = means + ONSET_THRESHOLD_STD * self.flux_stats.std
+        candidates = gate & (flux > ONSET_MIN_FLUX) & (flux > threshold)
+
+        # Refractory period, only a handful of frames per batch so walking the candidates is cheap
+        onsets = np.zeros(len(flux), dtype=bool)
+        last = -self._frames_since_onset
+        for i in np.flatnonzero(candidates):
+            if i - last >= self.refractory_frames:
+                onsets[i] = True
+                last = i
+        self._frames_since_onset = len(flux) - last
+        return novelty, onsets
+
+    def resampled(self, frame_rate: float, block_size: int, sample_rate: int) -> 'OnsetDetector':
+        """Detector for new frame sizes or rates that keeps the flux statistics"""
+        detector = OnsetDetector(frame_rate, block_size, sample_rate)
+        detector.flux_stats = self.flux_stats.resampled(detector.flux_stats.size, frame_rate / self.frame_rate)
+        return detector
+
+
+class TempoEstimator:
+    """Tempo and beat phase from the autocorrelation of the onset novelty envelope.
+
+    The autocorrelation over the lags of TEMPO_MIN_BPM..TEMPO_MAX_BPM is updated incrementally with
+    an exponential forgetting factor, so every frame costs O(lags) instead of a full
+    autocorrelation. A periodic envelope correlates just as well at twice its period, so every
+    candidate lag is scored together with its double to settle on the fundamental beat. Onsets
+    that land close to the predicted beat pull the beat phase towards them.
+    """
+
+    def __init__(self, frame_rate: float):
+        self.frame_rate = frame_rate
+        self.min_lag = max(1, int(math.floor(60.0 * frame_rate / TEMPO_MAX_BPM)))
+        self.max_lag = max(self.min_lag + 2, int(math.ceil(60.0 * frame_rate / TEMPO_MIN_BPM)))
+        self.lags = np.arange(self.min_lag, self.max_lag + 1)
+        # The autocorrelation is tracked up to twice the longest beat period for the harmonic score
+        self._acf_lags = np.arange(self.min_lag, 2 * self.max_lag + 1)
+        self._decay = math.exp(-1.0 / (TEMPO_DECAY_SECONDS * frame_rate))
+        self._history = np.zeros(2 * self.max_lag)
+        self._acf = np.zeros(len(self._acf_lags))
+        self._energy = 0.0
+        # Log-gaussian prior (one octave standard deviation) to prefer the tempo people tap along to
+        self._prior = np.exp(-0.5 * np.log2(60.0 * frame_rate / self.lags / TEMPO_PRIOR_BPM) ** 2)
+
+        self.bpm = 0.0
+        self.confidence = 0.0
+        self.last_beat_time: Optional[float] = None
+
+    @property
+    def period(self) -> float:
+        return 60.0 / self.bpm if self.bpm > 0.0 else 0.0
+
+    def update(self, novelty: np.ndarray, onset_times: np.ndarray):
+        """Add a batch of novelty values and the capture times of the onsets among them"""
+        k = len(novelty)
+        combined = np.concatenate((self._history, novelty))
+        positions = np.arange(len(self._history), len(combined))
+        weights = self._decay ** np.arange(k - 1, -1, -1) * novelty
+        self._acf = self._acf * self._decay ** k + weights @ combined[positions[:, np.newaxis] - self._acf_lags]
+        self._energy = self._energy * self._decay ** k + float(weights @ novelty)
+        self._history = combined[-len(self._history):]
+
+        if self._energy > 1e-9:
+            self._estimate()
+        for onset_time in onset_times:
+            self._align_phase(float(onset_time))
+
+    def _estimate(self):
+        # Beat periods are rarely a whole number of frames, so the peak is spread over neighbouring
+        # lags. Summing each lag with its neighbours keeps that from favouring the double period.
+        smoothed = np.convolve(self._acf, np.ones(3), mode='same')
+        score = (smoothed[:len(self.lags)] + 0.5 * smoothed[2 * self.lags - self.min_lag]) * self._prior
+        i = int(np.argmax(score))
+        lag = float(self.lags[i])
+        if i > 0:
+            # Centroid of the three lags around the peak for sub-frame resolution
+            a, b, c = self._acf[i - 1], self._acf[i], self._acf[i + 1]
+            if a + b + c > 0.0:
+                lag += (c - a) / (a + b + c)
+        self.bpm = 60.0 * self.frame_rate / lag
+        self.confidence = float(np.clip(smoothed[i] / self._energy, 0.0, 1.0))
+
+    def _align_phase(self, onset_time: float):
+        period = self.period
+        if self.last_beat_time is None or period <= 0.0:
+            self.last_beat_time = onset_time
+            return
+        beats = round((onset_time - self.last_beat_time) / period)
+        error = onset_time - (self.last_beat_time + beats * period)
+        if abs(error) < 0.25 * period:
+            self.last_beat_time = onset_time - 0.5 * error
+        elif onset_time - self.last_beat_time > 2.0 * period:
+            # Lost the beat for a while, lock onto the new onset
+            self.last_beat_time = onset_time
+
+    def resampled(self, frame_rate: float) -> 'TempoEstimator':
+        """Estimator for a new frame rate that keeps the tempo, the beat phase and the
+        autocorrelation and novelty history, interpolated onto the new lag grid"""
+        estimator = TempoEstimator(frame_rate)
+        # Both sums grow with the number of frames per second
+        ratio = frame_rate / self.frame_rate
+        estimator._acf = ratio * np.interp(estimator._acf_lags / frame_rate, self._acf_lags / self.frame_rate,
+                                           self._acf, left=0.0, right=0.0)
+        estimator._energy = ratio * self._energy
+        estimator._history = np.interp(np.arange(-len(estimator._history), 0) / frame_rate,
+                                       np.arange(-len(self._history), 0) / self.frame_rate, self._history, left=0.0)
+        estimator.bpm = self.bpm
+        estimator.confidence = self.confidence
+        estimator.last_beat_time = self.last_beat_time
+        return estimator
+
+    def next_beat(self, now: float) -> Optional[float]:
+        """Predicted time of the next beat after now, None while the tempo is unknown"""
+        period = self.period
+        if self.last_beat_time is None or period <= 0.0:
+            return None
+        return self.last_beat_time + max(1, math.ceil((now - self.last_beat_time) / period)) * period
+
+
+class AudioBlockBuffer:
+    """Preallocated single-producer/single-consumer FIFO of fixed-size audio blocks.
+
+    The sounddevice callback writes each block with a single copy into a preallocated slot and
+    never blocks or allocates. The reader gets views straight into the slots. When the reader
+    falls more than `capacity - 1` blocks behind, the oldest blocks are dropped (and counted)
+    so the latency between capture and analysis stays bounded.
+
+    Only the writer advances `_write_count` and only the reader advances `_read_count`,
+    so no lock is needed between the two threads.
+    """
+
+    def __init__(self, capacity: int, block_size: int, channels: int = 1):
+        self.capacity = max(2, capacity)
+        self.block_size = block_size
+        self.channels = channels
+        # Multi-channel blocks are stored channel-major, (channels, block_size) per slot
+        shape = (self.capacity, block_size) if channels == 1 else (self.capacity, channels, block_size)
+        self._data = np.zeros(shape, dtype=np.float32)
+        self._capture_times = np.zeros(self.capacity)
+        self._write_count = 0
+        self._read_count = 0
+        self._data_ready = threading.Event()
+
+        # Overrun statistics
+        self.dropped_blocks = 0
+        self.overruns = 0
+
+    def write(self, samples: np.ndarray, capture_time: float = 0.0):
+        """Copy one block and the wall clock time of its first sample into the next slot (writer thread only).
+
+        Short blocks are zero padded. Multi-channel buffers take (frames, channels) samples, missing
+        channels repeat the last one the input has (so a mono input still fills a stereo buffer).
+        """
+        slot = self._write_count % self.capacity
+        self._capture_times[slot] = capture_time
+        n = min(len(samples), self.block_size)
+        if self.channels == 1:
+            self._data[slot, :n] = samples[:n]
+        else:
+            available = min(samples.shape[1], self.channels)
+            self._data[slot, :available, :n] = samples[:n, :available].T
+            if available < self.channels:
+                self._data[slot, available:, :n] = self._data[slot, available - 1, :n]
+        if n < self.block_size:
+            self._data[slot, ..., n:] = 0.0
+        self._write_count += 1
+        self._data_ready.set()
+
+    def pending(self) -> int:
+        """Number of blocks waiting to be read, capped at what is still readable"""
+        return min(self._write_count - self._read_count, self.capacity - 1)
+
+    def read_all(self, timeout: float):
+        """Return every unread block as a (blocks, [channels,] block_size) array with their capture times,
+        or None if nothing arrived within timeout.
+
+        Up to ZERO_COPY_BLOCKS blocks are returned as a zero-copy view into the buffer (only a
+        wrap-around forces a copy), they stay valid until the writer wraps around so they should be
+        consumed before the next read. A larger catch-up backlog reaches close to the write position
+        and is copied, so the writer can't overwrite it while it's analysed.
+        """
+        if self._write_count == self._read_count:
+            self._data_ready.clear()
+            if self._write_count == self._read_count:
+                self._data_ready.wait(timeout)
+            if self._write_count == self._read_count:
+                return None
+
+        # Drop oldest: the slot at the write position may be mid-write, so at most capacity - 1 are readable
+        write_count = self._write_count
+        behind = write_count - self._read_count - (self.capacity - 1)
+        if behind > 0:
+            self._read_count += behind
+            self.dropped_blocks += behind
+            self.overruns += 1
+
+        start = self._read_count % self.capacity
+        end = start + write_count - self._read_count
+        self._read_count = write_count
+        if end <= self.capacity:
+            if end - start > ZERO_COPY_BLOCKS:
+                return self._data[start:end].copy(), self._capture_times[start:end].copy()
+            return self._data[start:end], self._capture_times[start:end]
+        wrap = end - self.capacity
+        return (np.concatenate((self._data[start:], self._data[:wrap])),
+                np.concatenate((self._capture_times[start:], self._capture_times[:wrap])))
+
+
+class ChannelFrame:
+    """Per-channel results of a multi-channel frame, published next to the mid (mono mix) values"""
+
+    def __init__(self, intensities: np.ndarray, bands: np.ndarray, beats: np.ndarray, balance: float, width: float):
+        self.intensities = intensities
+        self.bands = bands
+        self.beats = beats
+        # Stereo image of the first two channels: balance from -1 (left) to 1 (right), width is the
+        # share of the side signal (0 for mono content, 1 for fully out of phase channels)
+        self.balance = balance
+        self.width = width
+
+    @classmethod
+    def silent(cls, channels: int, band_count: int) -> 'ChannelFrame':
+        return cls(np.zeros(channels), np.zeros((channels, band_count)), np.zeros(channels, dtype=bool), 0.0, 0.0)
+
+
+def quantize_values(values: np.ndarray, wide: bool) -> np.ndarray:
+    """Scale 0.0-1.0 values to uint8, or little endian uint16 when wide"""
+    values = np.clip(values, 0.0, 1.0)
+    if wide:
+        return np.round(values * 65535.0).astype('<u2')
+    return np.round(values * 255.0).astype(np.uint8)
+
+
+def encode_binary_frame(sequence: int, timestamp: float, latency_ms: float, intensity: float,
+                        band_values: np.ndarray, beat: bool, wide: bool = False, bpm: float = 0.0,
+                        confidence: float = 0.0, next_beat_ms: float = math.nan, bars: bool = False,
+                        channels: Optional['ChannelFrame'] = None) -> bytes:
+    """Pack one frame in the fixed binary layout described at DATA_FORMATS"""
+    quantized = quantize_values(np.concatenate(([intensity], band_values)), wide)
+    flags = (BINARY_FLAG_BEAT if beat else 0) | (BINARY_FLAG_WIDE if wide else 0) | (BINARY_FLAG_BARS if bars else 0)
+    payload = quantized.tobytes()
+    if channels is not None:
+        flags |= BINARY_FLAG_CHANNELS
+        extra = np.concatenate((np.column_stack((channels.intensities, channels.bands)).ravel(),
+                                [(channels.balance + 1.0) / 2.0, channels.width]))
+        beat_mask = sum(1 << i for i, channel_beat in enumerate(channels.beats) if channel_beat)
+        payload += struct.pack('<BB', len(channels.beats), beat_mask) + quantize_values(extra, wide).tobytes()
+    header = BINARY_HEADER.pack(BINARY_FORMAT_VERSION, flags, len(quantized), int(round(min(max(confidence, 0.0), 1.0) * 255.0)),
+                                sequence & 0xFFFFFFFF, timestamp, latency_ms, bpm, next_beat_ms)
+    return header + payload
+
+
+def json_band_values(band_values: np.ndarray, bars: bool = False):
+    """Bars as a list, the named bands keyed by name"""
+    rounded = np.round(band_values, 3).tolist()
+    return rounded if bars else dict(zip(BAND_NAMES, rounded))
+
+
+def encode_json_frame(timestamp: float, latency_ms: float, intensity: float, band_values: np.ndarray,
+                      beat: bool, bpm: float = 0.0, confidence: float = 0.0, next_beat: Optional[float] = None,
+                      bars: bool = False, channels: Optional['ChannelFrame'] = None) -> str:
+    """Build the JSON frame documented in the readme, next_beat is absolute (unix seconds)"""
+    band_key = 'bars' if bars else 'bands'
+    message = {
+        'timestamp': float(timestamp),
+        'latency': round(latency_ms, 1),
+        'intensity': round(intensity, 3),
+        band_key: json_band_values(band_values, bars),
+        'beat': bool(beat),
+        'bpm': round(bpm, 1),
+        'confidence': round(confidence, 2),
+        'nextBeat': round(next_beat, 3) if next_beat is not None else None
+    }
+    if channels is not None:
+        message['channels'] = [{
+            'intensity': round(float(channels.intensities[i]), 3),
+            band_key: json_band_values(channels.bands[i], bars),
+            'beat': bool(channels.beats[i])
+        } for i in range(len(channels.intensities))]
+        message['balance'] = round(channels.balance, 3)
+        message['width'] = round(channels.width, 3)
+    return json.dumps(message)
+
+
+class PublishGate:
+    """Decides which analysed frames are worth publishing.
+
+    - a change of the beat flag (either edge) is always published immediately
+    - changes larger than the per-field deadband are published at up to max_rate
+    - smaller drifts are still published, but at no more than min_rate
+    - a keyframe is published every keyframe_interval even when nothing changed,
+      so late subscribers get a full frame and consumers can tell the listener is alive
+
+    Fields are intensity followed by the bands in BAND_NAMES order (or the filterbank bars). Multi-channel
+    frames pass one such row per channel, the deadbands apply to every row.
+    """
+
+    def __init__(self, deadbands: np.ndarray, max_rate: float, min_rate: float, keyframe_interval: float):
+        self.deadbands = deadbands
+        self.min_interval = 1.0 / max_rate
+        self.drift_interval = 1.0 / min_rate
+        self.keyframe_interval = keyframe_interval
+        self._last_values = None
+        self._last_beat = False
+        self._last_time = None
+
+        self.published = 0
+        self.suppressed = 0
+
+    def should_publish(self, now: float, values: np.ndarray, beat: bool) -> bool:
+        """Check a frame against the last published one, and remember it if it should be published"""
+        if self._last_time is None or beat != self._last_beat or values.shape != self._last_values.shape:
+            publish = True
+        else:
+            elapsed = now - self._last_time
+            if elapsed >= self.keyframe_interval:
+                publish = True
+            elif elapsed < self.min_interval:
+                publish = False
+            else:
+                delta = np.abs(values - self._last_values)
+                publish = bool(np.any(delta >= self.deadbands)) or (elapsed >= self.drift_interval and bool(np.any(delta > 0.0)))
+
+        if publish:
+            self._last_values = np.array(values, dtype=np.float64)
+            self._last_beat = beat
+            self._last_time = now
+            self.published += 1
+        else:
+            self.suppressed += 1
+        return publish
+
+
+def parse_deadbands(value: str, band_count: int = len(BAND_NAMES)) -> np.ndarray:
+    """Parse --deadband: one value for every field, or intensity followed by one value per band"""
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) == 1:
+        return np.full(band_count + 1, parts[0])
+    if len(parts) != band_count + 1:
+        raise ValueError(f"expected 1 or {band_count + 1} comma separated values")
+    return np.array(parts)
+
+
+class StageProfiler:
+    """Latency histograms of the stages of the processing pipeline.
+
+    Call start() before a frame, then lap(stage) after each stage; every lap records the time
+    since the previous one in a log-spaced histogram (8 buckets per octave from 1 us), so memory
+    stays fixed however long it runs and percentiles are accurate to about 9%.
+    """
+
+    BUCKETS_PER_OCTAVE = 8
+    BUCKET_COUNT = 8 * 24
+    MIN_SECONDS = 1e-6
+
+    def __init__(self):
+        self.stages: Dict[str, list] = {}
+        self._last = time.perf_counter()
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.record(stage, now - self._last)
+        self._last = now
+
+    def record(self, stage: str, seconds: float):
+        entry = self.stages.get(stage)
+        if entry is None:
+            # [histogram, count, total seconds, max seconds]
+            entry = self.stages[stage] = [[0] * self.BUCKET_COUNT, 0, 0.0, 0.0]
+        bucket = 0
+        if seconds > self.MIN_SECONDS:
+            bucket = min(self.BUCKET_COUNT - 1, int(math.log2(seconds / self.MIN_SECONDS) * self.BUCKETS_PER_OCTAVE))
+        entry[0][bucket] += 1
+        entry[1] += 1
+        entry[2] += seconds
+        if seconds > entry[3]:
+            entry[3] = seconds
+
+    def reset(self):
+        self.stages = {}
+
+    def percentiles(self, q=(50, 95, 99)) -> Dict[str, np.ndarray]:
+        """Percentiles of every stage in seconds (geometric centre of the matching bucket)"""
+        result = {}
+        for stage, (histogram, count, _, _) in self.stages.items():
+            cumulative = np.cumsum(histogram)
+            buckets = np.searchsorted(cumulative, np.array(q) / 100.0 * count)
+            result[stage] = self.MIN_SECONDS * 2.0 ** ((buckets + 0.5) / self.BUCKETS_PER_OCTAVE)
+        return result
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per-stage count, mean, percentiles and max in microseconds"""
+        percentiles = self.percentiles()
+        result = {}
+        for stage, (_, count, total, maximum) in self.stages.items():
+            p50, p95, p99 = percentiles[stage] * 1e6
+            result[stage] = {
+                'count': count,
+                'mean_us': round(total / count * 1e6, 1),
+                'p50_us': round(p50, 1),
+                'p95_us': round(p95, 1),
+                'p99_us': round(p99, 1),
+                'max_us': round(maximum * 1e6, 1),
+            }
+        return result
+
+
+class AudioSource:
+    """Base class of the audio inputs.
+
+    Sources deliver (frames, channels) float32 blocks to a callback with the signature of the
+    sounddevice InputStream callback, so every source feeds the same audio_callback.
+    """
+
+    def __init__(self, sample_rate: int, block_size: int):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+
+    def start(self, callback):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class SoundDeviceSource(AudioSource):
+    """Live capture through a sounddevice InputStream"""
+
+    def __init__(self, device_index: Optional[int], sample_rate: int, block_size: int, channels: int = 1):
+        super().__init__(sample_rate, block_size)
+        self.device_index = device_index
+        self.channels = channels
+        self.stream = None
+
+    def start(self, callback):
+        if sd is None:
+            raise RuntimeError(f"sounddevice is not available: {SOUNDDEVICE_IMPORT_ERROR}")
+        # Print chosen device details
+        device_info = sd.query_devices(self.device_index, 'input')
+        print(f"Opening audio stream on device {self.device_index if self.device_index is not None else 'Default'}: {device_info['name']}")
+
+        self.stream = sd.InputStream(
+            device=self.device_index,
+            channels=self.channels,
+            samplerate=self.sample_rate,
+            blocksize=self.block_size,
+            callback=callback
+        )
+        self.stream.start()
+        print("Audio stream started successfully (sounddevice mode)")
+
+    def stop(self):
+        if self.stream:
+            stream = self.stream
+            self.stream = None
+            stream.stop()
+            stream.close()
+
+
+class GeneratedSource(AudioSource):
+    """Source backed by a block generator instead of an audio device.
+
+    blocks() can be iterated directly (benchmark mode), start() plays the blocks into the
+    callback from a background thread paced to real time.
+    """
+
+    def __init__(self, sample_rate: int, block_size: int):
+        super().__init__(sample_rate, block_size)
+        self._thread = None
+        self._running = False
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        raise NotImplementedError
+
+    def start(self, callback):
+        self._running = True
+        self._thread = threading.Thread(target=self._play, args=(callback,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _play(self, callback):
+        interval = self.block_size / self.sample_rate
+        next_time = time.monotonic()
+        for block in self.blocks():
+            if not self._running:
+                break
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            callback(block, len(block), None, None)
+
+
+class FileSource(GeneratedSource):
+    """Audio read from a WAV file, or from headerless PCM (s16le or f32le) at SAMPLE_RATE"""
+
+    def __init__(self, path: str, block_size: int, loop: bool = False, raw_format: str = 's16le'):
+        self.path = path
+        self.loop = loop
+        self.raw_format = raw_format
+        self.is_wav = path.lower().endswith('.wav')
+        sample_rate = SAMPLE_RATE
+        if self.is_wav:
+            with wave.open(path, 'rb') as wav:
+                sample_rate = wav.getframerate()
+        super().__init__(sample_rate, block_size)
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        while True:
+            if self.is_wav:
+                yield from self._wav_blocks()
+            else:
+                yield from self._raw_blocks()
+            if not self.loop:
+                return
+
+    def _wav_blocks(self) -> Iterator[np.ndarray]:
+        with wave.open(self.path, 'rb') as wav:
+            channels = wav.getnchannels()
+            width = wav.getsampwidth()
+            while True:
+                data = wav.readframes(self.block_size)
+                if not data:
+                    return
+                yield self._pad(pcm_to_float(data, width).reshape(-1, channels))
+
+    def _raw_blocks(self) -> Iterator[np.ndarray]:
+        width = 4 if self.raw_format == 'f32le' else 2
+        with open(self.path, 'rb') as f:
+            while True:
+                data = f.read(self.block_size * width)
+                if len(data) < width:
+                    return
+                data = data[:len(data) - len(data) % width]
+                if self.raw_format == 'f32le':
+                    samples = np.frombuffer(data, dtype='<f4')
+                else:
+                    samples = pcm_to_float(data, width)
+                yield self._pad(samples.reshape(-1, 1))
+
+    def _pad(self, block: np.ndarray) -> np.ndarray:
+        if len(block) == self.block_size:
+            return block
+        return np.vstack((block, np.zeros((self.block_size - len(block), block.shape[1]), dtype=np.float32)))
+
+
+class SyntheticSource(GeneratedSource):
+    """Deterministic endless test signal: a kick drum at `bpm`, a bass line, a chord and some noise.
+
+    With several channels the kick is panned towards the first and the chord towards the last one.
+    """
+
+    def __init__(self, sample_rate: int, block_size: int, bpm: float = 120.0, seed: int = 0, channels: int = 1):
+        super().__init__(sample_rate, block_size)
+        self.bpm = bpm
+        self.seed = seed
+        self.channels = channels
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        rng = np.random.default_rng(self.seed)
+        beat_samples = self.sample_rate * 60.0 / self.bpm
+        bar_samples = beat_samples * 4
+        position = 0
+        while True:
+            n = position + np.arange(self.block_size)
+            t = n / self.sample_rate
+            since_beat = (n % beat_samples) / self.sample_rate
+            kick = np.exp(-since_beat * 18.0) * np.sin(2 * np.pi * (50.0 + 80.0 * np.exp(-since_beat * 30.0)) * since_beat)
+            bass_freq = np.where((n // bar_samples) % 2 == 0, 55.0, 73.4)
+            bass = 0.3 * np.sin(2 * np.pi * bass_freq * t)
+            chord = 0.05 * (np.sin(2 * np.pi * 440.0 * t) + np.sin(2 * np.pi * 554.4 * t) + np.sin(2 * np.pi * 659.3 * t))
+            noise = 0.02 * rng.standard_normal(self.block_size)
+            position += self.block_size
+            if self.channels == 1:
+                block = 0.6 * kick + bass + chord + noise
+                yield block.astype(np.float32).reshape(-1, 1)
+            else:
+                pan = np.linspace(0.0, 1.0, self.channels)
+                block = (np.outer(kick, 0.6 * (1.0 - 0.6 * pan)) + np.outer(chord, 0.4 + 1.2 * pan)
+                         + (bass + noise)[:, np.newaxis])
+                yield block.astype(np.float32)
+
+
+def pcm_to_float(data: bytes, width: int) -> np.ndarray:
+    """Convert little endian integer PCM (8-bit unsigned, 16/24/32-bit signed) to float32 in [-1, 1)"""
+    if width == 1:
+        return (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    if width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        samples = raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16)
+        samples = np.where(samples >= 1 << 23, samples - (1 << 24), samples)
+        return samples.astype(np.float32) / float(1 << 23)
+    dtype = {2: '<i2', 4: '<i4'}.get(width)
+    if dtype is None:
+        raise ValueError(f"Unsupported sample width: {width} bytes")
+    return np.frombuffer(data, dtype=dtype).astype(np.float32) / float(1 << (8 * width - 1))
+
+
+class SharedFrameSink:
+    """Local output channel: keeps the newest binary frame in a memory-mapped file.
+
+    Readers on the same machine map the file and read the frame without a broker hop. The
+    sequence counter is incremented before and after every write, so a reader that sees an odd
+    or changed sequence (or a crc32 mismatch) raced the writer and retries.
+    """
+
+    def __init__(self, path: str, capacity: int = SHM_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self.sequence = 0
+        self.frames = 0
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, SHM_HEADER.size + capacity)
+            self._map = mmap.mmap(fd, SHM_HEADER.size + capacity)
+        finally:
+            os.close(fd)
+        SHM_HEADER.pack_into(self._map, 0, SHM_MAGIC, SHM_LAYOUT_VERSION, 0, capacity, 0, 0, 0)
+
+    def write(self, payload: bytes):
+        """Replace the current frame, readers never block the writer"""
+        if len(payload) > self.capacity:
+            raise ValueError(f"frame of {len(payload)} bytes exceeds the shared memory capacity of {self.capacity}")
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        struct.pack_into('<I', self._map, SHM_SEQUENCE_OFFSET, self.sequence)
+        self._map[SHM_HEADER.size:SHM_HEADER.size + len(payload)] = payload
+        struct.pack_into('<II', self._map, SHM_SEQUENCE_OFFSET + 4, len(payload), zlib.crc32(payload))
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        struct.pack_into('<I', self._map, SHM_SEQUENCE_OFFSET, self.sequence)
+        self.frames += 1
+
+    def close(self):
+        # The file stays behind with the last frame, readers can tell it is stale from its timestamp
+        self._map.close()
+
+
+class SharedFrameReader:
+    """Reads the newest frame written by a SharedFrameSink, for local Python consumers"""
+
+    def __init__(self, path: str = DEFAULT_SHM_PATH, retries: int = 100):
+        self.retries = retries
+        self._last_sequence = None
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = SHM_HEADER.unpack_from(self._map, 0)[:2]
+        if magic != SHM_MAGIC or version != SHM_LAYOUT_VERSION:
+            raise ValueError(f"{path} is not a version {SHM_LAYOUT_VERSION} audio frame file")
+
+    def read(self, only_new: bool = True) -> Optional[bytes]:
+        """Return the newest frame, or None if there is none yet (or nothing new with only_new).
+
+        Raises TimeoutError if the writer kept the frame busy for all retries.
+        """
+        for attempt in range(self.retries):
+            if attempt:
+                # Let the writer finish its frame
+                time.sleep(0)
+            sequence, length, crc = struct.unpack_from('<III', self._map, SHM_SEQUENCE_OFFSET)
+            if sequence & 1:
+                continue
+            payload = self._map[SHM_HEADER.size:SHM_HEADER.size + length]
+            if struct.unpack_from('<I', self._map, SHM_SEQUENCE_OFFSET)[0] != sequence or zlib.crc32(payload) != crc:
+                continue
+            if length == 0 or (only_new and sequence == self._last_sequence):
+                return None
+            self._last_sequence = sequence
+            return payload
+        raise TimeoutError("shared memory frame kept changing while reading")
 
-# Beat detection settings
-BEAT_HISTORY_SIZE = 15
-BEAT_THRESHOLD_MULTIPLIER = 1.35
+    def close(self):
+        self._map.close()
+
+
+def recording_dtype(value_count: int, channels: int = 1) -> np.dtype:
+    """Record layout of a frame log, every record has the same size so the log can be memory-mapped.
+
+    Values are unquantized (intensity first), next_beat is relative to the timestamp in milliseconds
+    (NaN when unknown) and flags hold RECORD_BEAT and RECORD_PUBLISHED (the publish gate let it through).
+    """
+    fields = [('timestamp', '<f8'), ('latency', '<f4'), ('bpm', '<f4'), ('next_beat', '<f4'),
+              ('confidence', '<f4'), ('flags', 'u1'), ('channel_beats', 'u1'), ('reserved', '<u2'),
+              ('values', '<f4', (value_count,))]
+    if channels > 1:
+        fields += [('channel_values', '<f4', (channels, value_count)), ('balance', '<f4'), ('width', '<f4')]
+    return np.dtype(fields)
+
+
+class FrameRecorder:
+    """Appends every analysed frame to a frame log, published or not"""
+
+    def __init__(self, path: str, value_count: int, channels: int = 1, bars: bool = False):
+        self.path = path
+        self.dtype = recording_dtype(value_count, channels)
+        self.frames = 0
+        header = RECORD_HEADER.pack(RECORD_MAGIC, RECORD_LAYOUT_VERSION, RECORD_FLAG_BARS if bars else 0,
+                                    value_count, channels, self.dtype.itemsize)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # Continue an existing log of the same layout, e.g. after the listener restarted
+            with open(path, 'rb') as f:
+                if f.read(RECORD_HEADER.size) != header:
+                    raise ValueError(f"{path} holds a frame log with a different layout")
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(header)
+        self._record = np.zeros((), dtype=self.dtype)
+
+    def write(self, timestamp: float, latency_ms: float, intensity: float, band_values: np.ndarray, beat: bool,
+              bpm: float, confidence: float, next_beat_ms: float, published: bool,
+              channels: Optional[ChannelFrame] = None):
+        record = self._record
+        record['timestamp'] = timestamp
+        record['latency'] = latency_ms
+        record['bpm'] = bpm
+        record['next_beat'] = next_beat_ms
+        record['confidence'] = confidence
+        record['flags'] = (RECORD_BEAT if beat else 0) | (RECORD_PUBLISHED if published else 0)
+        record['values'][0] = intensity
+        record['values'][1:] = band_values
+        if channels is not None:
+            record['channel_beats'] = sum(1 << i for i, channel_beat in enumerate(channels.beats) if channel_beat)
+            record['channel_values'][:, 0] = channels.intensities
+            record['channel_values'][:, 1:] = channels.bands
+            record['balance'] = channels.balance
+            record['width'] = channels.width
+        self._file.write(record.tobytes())
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+
+
+def load_recording(path: str):
+    """Map a frame log, returns (value count, channels, bars, records)"""
+    with open(path, 'rb') as f:
+        header = f.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        raise ValueError(f"{path} is not a frame log")
+    magic, version, flags, value_count, channels, record_size = RECORD_HEADER.unpack(header)
+    if magic != RECORD_MAGIC or version != RECORD_LAYOUT_VERSION:
+        raise ValueError(f"{path} is not a version {RECORD_LAYOUT_VERSION} frame log")
+    dtype = recording_dtype(value_count, channels)
+    if dtype.itemsize != record_size:
+        raise ValueError(f"{path} has records of {record_size} bytes, expected {dtype.itemsize}")
+    # A record cut short by a crash is ignored
+    count = (os.path.getsize(path) - RECORD_HEADER.size) // record_size
+    records = np.memmap(path, dtype=dtype, mode='r', offset=RECORD_HEADER.size, shape=(count,)) if count else \
+        np.zeros(0, dtype=dtype)
+    return value_count, channels, bool(flags & RECORD_FLAG_BARS), records
+
+
+def replay_recording(path: str, publisher: CoalescingPublisher, topic: str, data_format: str, speed: float = 1.0,
+                     all_frames: bool = False, loop: bool = False):
+    """Republish a frame log with its original timing divided by speed (0 publishes as fast as possible).
+
+    Only the frames the publish gate let through are replayed unless all_frames is set. Timestamps are
+    shifted so the first frame is stamped with the time the replay started.
+    """
+    value_count, channel_count, bars, records = load_recording(path)
+    if not all_frames:
+        records = records[(records['flags'] & RECORD_PUBLISHED) != 0]
+    if len(records) == 0:
+        print(f"{path} has no frames to replay")
+        return
+    print(f"Replaying {len(records)} frames ({records['timestamp'][-1] - records['timestamp'][0]:.1f} s) "
+          f"from {path} at {'full' if speed <= 0 else f'{speed:g}x'} speed")
+    sequence = 0
+    while True:
+        started = time.time()
+        first = float(records['timestamp'][0])
+        for record in records:
+            offset = float(record['timestamp']) - first
+            if speed > 0:
+                delay = started + offset / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            timestamp = started + offset
+            values = record['values'].astype(np.float64)
+            next_beat_ms = float(record['next_beat'])
+            channels = None
+            if channel_count > 1:
+                channel_values = record['channel_values'].astype(np.float64)
+                channels = ChannelFrame(channel_values[:, 0], channel_values[:, 1:],
+                                        np.array([bool(record['channel_beats'] & (1 << i)) for i in range(channel_count)]),
+                                        float(record['balance']), float(record['width']))
+            beat = bool(record['flags'] & RECORD_BEAT)
+            if data_format == 'json':
+                next_beat = None if math.isnan(next_beat_ms) else timestamp + next_beat_ms / 1000.0
+                payload = encode_json_frame(timestamp, float(record['latency']), values[0], values[1:], beat,
+                                            float(record['bpm']), float(record['confidence']), next_beat, bars, channels)
+            else:
+                sequence += 1
+                payload = encode_binary_frame(sequence, timestamp, float(record['latency']), values[0], values[1:],
+                                              beat, wide=data_format == 'binary16', bpm=float(record['bpm']),
+                                              confidence=float(record['confidence']), next_beat_ms=next_beat_ms,
+                                              bars=bars, channels=channels)
+            publisher.publish(topic, payload)
+        if not loop:
+            break
+    stats = publisher.stats()
+    print(f"Replay done: {stats['published']} published, {stats['coalesced']} coalesced")
+
+
+def create_mqtt_client():
+    """MQTT client using API v2 if available to avoid the deprecation warning"""
+    if MQTT_API_V2_AVAILABLE:
+        return mqtt.Client(CallbackAPIVersion.VERSION2)
+    return mqtt.Client()
 
 
 class AudioVisualizer:
     def __init__(self, device_index: Optional[int], low_threshold: float, intensity: float,
-                 mqtt_host: str, mqtt_port: int, mqtt_topic: str, mqtt_config_topic: str):
+                 mqtt_host: str, mqtt_port: int, mqtt_topic: str, mqtt_config_topic: str,
+                 fft_size: int = CHUNK_SIZE, hop_size: int = CHUNK_SIZE, data_format: str = 'json',
+                 publish_gate: Optional[PublishGate] = None, source: Optional[AudioSource] = None,
+                 stats_topic: str = DEFAULT_STATS_TOPIC, stats_interval: float = DEFAULT_STATS_INTERVAL,
+                 stats_enabled: bool = False, bands: Optional[int] = None, scale: str = 'log',
+                 bass_fft_size: int = DEFAULT_BASS_FFT_SIZE, sample_rate: int = SAMPLE_RATE,
+                 profile: str = 'default', silence_gate: float = 0.0, channels: int = 1,
+                 shm_sink: Optional[SharedFrameSink] = None, recorder: Optional[FrameRecorder] = None):
         self.device_index = device_index
         self.low_threshold = low_threshold
         self.intensity = intensity
@@ -53,339 +1330,720 @@ class AudioVisualizer:
         self.mqtt_port = mqtt_port
         self.mqtt_topic = mqtt_topic
         self.mqtt_config_topic = mqtt_config_topic
+        # Optional local output, receives every frame (not only the published ones) in the binary format
+        self.shm_sink = shm_sink
+        # Optional frame log of every analysed frame (--record)
+        self.recorder = recorder
         
         # Audio components
-        self.stream = None
-        self.audio_queue = queue.Queue()
+        # The stream delivers hop_size blocks, every block is analysed together with the
+        # preceding samples as one fft_size frame (overlapping STFT when hop_size < fft_size)
+        # The audio source defaults to live capture from device_index at sample_rate
+        self.fft_size = fft_size
+        self.hop_size = hop_size
+        self.source = source
+        self.sample_rate = source.sample_rate if source is not None else sample_rate
+        self.profile = profile
+        # With several channels every channel is analysed, together with their mid (mono mix) in one
+        # batched pass. The mid is row 0 of the analysis and drives the main output, tempo and AGC vibe.
+        self.channels = channels
+        self.audio_buffer = AudioBlockBuffer(math.ceil(MAX_BUFFERED_SECONDS * self.sample_rate / hop_size), hop_size,
+                                             channels)
+        self.sample_window = SampleRingBuffer(fft_size, self.analysis_rows)
+        # bands selects filterbank mode with that many bars on the given scale instead of the named bands
+        self.bar_count = bands
+        self.bar_scale = scale
+        self.band_engine = self.create_band_engine(fft_size)
+        nyquist = self.sample_rate / 2.0
+        clipped = [name for name, (low, high) in FREQUENCY_BANDS.items() if high > nyquist]
+        if clipped and not bands:
+            print(f"Bands above the Nyquist frequency ({nyquist:.0f} Hz) are cut off or stay at 0: {', '.join(clipped)}")
+        # The lowest named bands come from the decimated multi-rate path unless bass_fft_size is 0
+        self.bass_fft_size = bass_fft_size
+        self.bass_analyzer, self._bass_band_indices = self.create_bass_analyzer()
+
+        # Time source for timestamps, beat windows and publish gating. Benchmark mode replaces
+        # it with the sample clock so results do not depend on how fast the machine is.
+        self.clock = time.time
+        # Optional StageProfiler, None keeps the hot path free of timing calls. It is enabled with
+        # stats_enabled (or live through the config topic) and summarized on stats_topic.
+        self.profiler: Optional[StageProfiler] = StageProfiler() if stats_enabled else None
+        self.stats_topic = stats_topic
+        self.stats_interval = stats_interval
+        self._last_stats_time = time.monotonic()
+
+        # Callback status counters (PortAudio reports overflows through the status flags)
+        self.callback_status_count = 0
+        self.input_overflows = 0
+
+        # Capture to publish latency of every published frame, summarized in the stats
+        self.latency_stats = StageProfiler()
+
+        # Per-frame constants were tuned for one frame every CHUNK_SIZE samples at SAMPLE_RATE, rescale
+        # them so the AGC and history windows keep the same duration at other hop sizes and rates
+        self.frame_scale = (hop_size / self.sample_rate) / (CHUNK_SIZE / SAMPLE_RATE)
+        self._agc_decay = 0.995 ** self.frame_scale
+        self._band_decay = 0.994 ** self.frame_scale
         
-        # MQTT client (use API v2 if available to avoid deprecation warning)
-        if MQTT_API_V2_AVAILABLE:
-            self.mqtt_client = mqtt.Client(CallbackAPIVersion.VERSION2)
-        else:
-            self.mqtt_client = mqtt.Client()
+        # MQTT client
+        self.mqtt_client = create_mqtt_client()
         self.mqtt_client.on_connect = self.on_mqtt_connect
+        self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
         self.mqtt_client.on_message = self.on_mqtt_message
-        self.mqtt_connected = False
+        # Frames and stats are coalesced per topic, so a slow or reconnecting broker gets the newest
+        # frame instead of a backlog of stale ones
+        self.publisher = CoalescingPublisher(self.mqtt_client)
         
-        # Beat tracking (short rolling window for transient spike detection only)
-        self.bass_history = deque(maxlen=BEAT_HISTORY_SIZE)
+        # Beat tracking: spectral flux onsets and the tempo estimated from them
+        self.onset_detector = OnsetDetector(self.sample_rate / hop_size, fft_size, self.sample_rate)
+        self.tempo = TempoEstimator(self.sample_rate / hop_size)
+        self.channel_onset_detectors = [OnsetDetector(self.sample_rate / hop_size, fft_size, self.sample_rate)
+                                        for _ in range(channels if channels > 1 else 0)]
         
         # Current settings
         self.enabled = True
         
-        # Performance tracking
-        self.last_publish_time = 0
-        self.publish_interval = 0.02  # Max publish rate ~50 Hz
+        # Change suppression and rate limiting of published frames
+        if publish_gate is None:
+            publish_gate = PublishGate(np.full(self.band_engine.band_count + 1, DEFAULT_DEADBAND), DEFAULT_MAX_PUBLISH_RATE,
+                                       DEFAULT_MIN_PUBLISH_RATE, DEFAULT_KEYFRAME_MS / 1000.0)
+        self.publish_gate = publish_gate
+        self._silent_frame = np.zeros(self.band_engine.band_count)
+        self._silent_channels = ChannelFrame.silent(channels, self.band_engine.band_count) if channels > 1 else None
+
+        # Silence gate: after silence_gate seconds below low_threshold only the RMS of the incoming
+        # blocks is computed until the signal returns (0 disables it)
+        self.silence_gate = silence_gate
+        self._silent_blocks = 0
+        self.silence_gated = False
+        # Cost of the full analysis per frame (moving average), used to estimate the CPU time saved
+        self._frame_cost = 0.0
+        self.gated_frames = 0
+        self.analysed_frames = 0
+        self.cpu_saved = 0.0
+        self._last_cpu_time = time.process_time()
+
+        # Output format of the data topic, can be switched live through the config topic
+        self.data_format = data_format
+        self.sequence = 0
+
+        # Device, sample rate and block size changes from the config topic. They are collected on the
+        # MQTT thread and applied by the processing loop between two batches (see reconfigure).
+        self._pending_stream_changes: Dict[str, Any] = {}
+        self._stream_changes_lock = threading.Lock()
         
+    @property
+    def analysis_rows(self) -> int:
+        """Signals analysed per frame: just the input when mono, otherwise the mid plus every channel"""
+        return 1 if self.channels == 1 else self.channels + 1
+
+    def create_band_engine(self, block_size: int) -> BandEngine:
+        """Band engine for the configured mode, the named FREQUENCY_BANDS or the filterbank bars"""
+        if self.bar_count:
+            return FilterbankEngine(block_size, self.sample_rate, self.bar_count, self.bar_scale)
+        return BandEngine(block_size, self.sample_rate)
+
+    def create_bass_analyzer(self):
+        """Decimated analyzer for the named bands below DECIMATED_MAX_FREQ and their indices, or (None, None)"""
+        if self.bar_count or not self.bass_fft_size:
+            return None, None
+        indices = [i for i, name in enumerate(BAND_NAMES) if FREQUENCY_BANDS[name][1] <= DECIMATED_MAX_FREQ]
+        if not indices:
+            return None, None
+        bands = {BAND_NAMES[i]: FREQUENCY_BANDS[BAND_NAMES[i]] for i in indices}
+        return DecimatedBandAnalyzer(self.sample_rate, bands, self.bass_fft_size, self.fft_size), np.array(indices)
+
+    def frames(self, reference_frames: int) -> int:
+        """Convert a frame count tuned for CHUNK_SIZE hops to the current hop size"""
+        return max(1, int(round(reference_frames / self.frame_scale)))
+
     def on_mqtt_connect(self, client, userdata, flags, rc, properties=None):
         """Called when connected to MQTT broker"""
         if rc == 0:
             print(f"Connected to MQTT broker at {self.mqtt_host}:{self.mqtt_port}")
-            self.mqtt_connected = True
             client.subscribe(self.mqtt_config_topic)
+            self.publisher.set_connected(True)
         else:
             print(f"Failed to connect to MQTT broker, code: {rc}")
+
+    def on_mqtt_disconnect(self, client, userdata, *args):
+        """Called when the broker connection is lost, paho reconnects with backoff"""
+        if self.publisher.connected:
+            print("Disconnected from MQTT broker, reconnecting")
+        self.publisher.set_connected(False)
             
     def on_mqtt_message(self, client, userdata, msg):
-        """Handle incoming MQTT config messages"""
+        """Handle incoming MQTT config messages, an invalid value only drops its own key"""
         try:
             config = json.loads(msg.payload.decode())
-            if 'lowThreshold' in config:
-                self.low_threshold = float(config['lowThreshold'])
-                print(f"Updated low_threshold to {self.low_threshold}")
-            if 'intensity' in config:
-                self.intensity = float(config['intensity'])
-                print(f"Updated intensity to {self.intensity}")
-            if 'enabled' in config:
-                self.enabled = bool(config['enabled'])
-                print(f"Audio visualizer {'enabled' if self.enabled else 'disabled'}")
+            if not isinstance(config, dict):
+                raise ValueError("expected a JSON object")
         except Exception as e:
             print(f"Error processing config update: {e}")
-            
+            return
+        stream_changes = {}
+        for key, value in config.items():
+            try:
+                self.apply_config_value(key, value, stream_changes)
+            except Exception as e:
+                print(f"Ignoring invalid {key} in config update: {e}")
+        if stream_changes.get('device_index', self.device_index) == self.device_index:
+            stream_changes.pop('device_index', None)
+        if stream_changes:
+            with self._stream_changes_lock:
+                self._pending_stream_changes.update(stream_changes)
+
+    def apply_config_value(self, key: str, value: Any, stream_changes: Dict[str, Any]):
+        """Apply one config key, device and frame size changes are collected in stream_changes"""
+        if key == 'lowThreshold':
+            self.low_threshold = float(value)
+            print(f"Updated low_threshold to {self.low_threshold}")
+        elif key == 'intensity':
+            self.intensity = float(value)
+            print(f"Updated intensity to {self.intensity}")
+        elif key == 'enabled':
+            self.enabled = bool(value)
+            print(f"Audio visualizer {'enabled' if self.enabled else 'disabled'}")
+        elif key == 'stats':
+            self.set_stats_enabled(bool(value))
+        elif key == 'statsInterval':
+            self.stats_interval = max(0.5, float(value))
+            print(f"Updated stats interval to {self.stats_interval}")
+        elif key in ('device_index', 'deviceIndex'):
+            # null selects the default device
+            stream_changes['device_index'] = int(value) if value is not None else None
+        elif key in STREAM_CONFIG_KEYS:
+            if value is None:
+                raise ValueError("must be a number")
+            stream_changes[STREAM_CONFIG_KEYS[key]] = int(value)
+        elif key == 'format':
+            data_format = str(value)
+            if data_format in DATA_FORMATS:
+                if data_format != self.data_format:
+                    self.data_format = data_format
+                    print(f"Switched data format to {self.data_format}")
+            else:
+                print(f"Ignoring unknown data format: {data_format}")
+
     def audio_callback(self, indata, frames, time_info, status):
         """sounddevice input stream audio callback"""
         if status:
-            pass
+            self.callback_status_count += 1
+            if getattr(status, 'input_overflow', False):
+                self.input_overflows += 1
         if self.enabled:
-            # Put first channel data copy into the queue
-            self.audio_queue.put(indata[:, 0].copy())
+            # Tag the block with the wall clock time of its first sample. PortAudio reports the ADC
+            # time on the stream clock, currentTime maps that clock to wall time. Sources without
+            # timing info (or drivers reporting 0) assume the block was captured just now.
+            adc_time = getattr(time_info, 'inputBufferAdcTime', 0.0) if time_info is not None else 0.0
+            if adc_time > 0.0:
+                capture_time = adc_time + (time.time() - time_info.currentTime)
+            else:
+                capture_time = self.clock() - frames / self.sample_rate
+            # Copy the first (or every analysed) channel straight into the preallocated ring buffer
+            self.audio_buffer.write(indata[:, 0] if self.channels == 1 else indata, capture_time)
             
     def start_audio_stream(self):
-        """Initialize and start sounddevice input stream"""
-        if self.stream:
-            try:
-                self.stream.stop()
-                self.stream.close()
-            except:
-                pass
-            self.stream = None
-            
+        """Initialize and start the audio source (a sounddevice input stream unless another source was given)"""
+        if self.source is None:
+            self.source = SoundDeviceSource(self.device_index, self.sample_rate, self.hop_size, self.channels)
         try:
-            # Print chosen device details
-            device_info = sd.query_devices(self.device_index, 'input')
-            print(f"Opening audio stream on device {self.device_index if self.device_index is not None else 'Default'}: {device_info['name']}")
+            self.source.stop()
+        except:
+            pass
             
-            self.stream = sd.InputStream(
-                device=self.device_index,
-                channels=1,
-                samplerate=SAMPLE_RATE,
-                blocksize=CHUNK_SIZE,
-                callback=self.audio_callback
-            )
-            self.stream.start()
-            print("Audio stream started successfully (sounddevice mode)")
+        try:
+            self.source.start(self.audio_callback)
         except Exception as e:
-            print(f"Error starting sounddevice audio stream: {e}")
+            print(f"Error starting audio stream: {e}")
             print("Audio visualizer running without audio input")
-            self.stream = None
             
+    def apply_pending_stream_changes(self):
+        """Apply device, sample rate and block size changes received on the config topic"""
+        with self._stream_changes_lock:
+            changes = self._pending_stream_changes
+            self._pending_stream_changes = {}
+        if changes:
+            self.reconfigure(changes)
+
+    def reconfigure(self, changes: Dict[str, Any]):
+        """Switch the input device, sample rate, block (hop) size and/or FFT size in place.
+
+        The source is stopped, everything that depends on the rate or the frame sizes is rebuilt and
+        the source is restarted, without reloading the process or reconnecting to MQTT. AGC ceilings,
+        the tempo and the rolling histories are carried over, histories are resampled to the new
+        frame rate so they keep covering the same time span. Must be called from the processing thread.
+        """
+        live = self.source is None or isinstance(self.source, SoundDeviceSource)
+        if not live:
+            ignored = [name for name in ('device_index', 'sample_rate') if name in changes]
+            if ignored:
+                print(f"Ignoring {', '.join(ignored)} change, the input is not a sound device")
+            changes = {name: value for name, value in changes.items() if name not in ignored}
+        device_index = changes.get('device_index', self.device_index)
+        sample_rate = changes.get('sample_rate', self.sample_rate)
+        hop_size = changes.get('hop_size', self.hop_size)
+        # Without overlap the FFT follows the block size, otherwise it grows to at least one block
+        default_fft_size = hop_size if self.fft_size == self.hop_size else max(self.fft_size, hop_size)
+        fft_size = changes.get('fft_size', default_fft_size)
+        if (device_index, sample_rate, hop_size, fft_size) == (self.device_index, self.sample_rate, self.hop_size, self.fft_size):
+            return
+        if fft_size < 16 or not 1 <= hop_size <= fft_size or sample_rate <= 0:
+            print(f"Ignoring invalid stream config: sample rate {sample_rate}, block size {hop_size}, fft size {fft_size}")
+            return
+        if live and sd is not None:
+            try:
+                sd.check_input_settings(device=device_index, channels=self.channels, samplerate=sample_rate)
+            except Exception as e:
+                device_name = device_index if device_index is not None else 'Default'
+                print(f"Device {device_name} rejected {sample_rate} Hz with {self.channels} channel(s), "
+                      f"keeping the current stream: {e}")
+                return
+
+        print(f"Reconfiguring audio input: device {device_index if device_index is not None else 'Default'}, "
+              f"{sample_rate} Hz, block {hop_size}, fft {fft_size}")
+        if self.source is not None:
+            try:
+                self.source.stop()
+            except Exception as e:
+                print(f"Error stopping audio stream: {e}")
+        if live:
+            self.source = SoundDeviceSource(device_index, sample_rate, hop_size, self.channels)
+        else:
+            self.source.block_size = hop_size
+
+        old_frame_rate = self.sample_rate / self.hop_size
+        rate_changed = sample_rate != self.sample_rate
+        fft_changed = fft_size != self.fft_size
+        self.device_index = device_index
+        self.sample_rate = sample_rate
+        self.hop_size = hop_size
+        self.fft_size = fft_size
+        frame_rate = sample_rate / hop_size
+
+        # Blocks still queued at the old size are dropped, the overrun counters keep counting
+        old_buffer = self.audio_buffer
+        self.audio_buffer = AudioBlockBuffer(math.ceil(MAX_BUFFERED_SECONDS * sample_rate / hop_size), hop_size,
+                                             self.channels)
+        self.audio_buffer.dropped_blocks = old_buffer.dropped_blocks
+        self.audio_buffer.overruns = old_buffer.overruns
+
+        # The newest samples stay valid as long as the rate did not change
+        old_window = self.sample_window
+        self.sample_window = SampleRingBuffer(fft_size, self.analysis_rows)
+        if not rate_changed:
+            self.sample_window.push(old_window.view())
+        if rate_changed or fft_changed:
+            self.band_engine = self.create_band_engine(fft_size)
+            self.bass_analyzer, self._bass_band_indices = self.create_bass_analyzer()
+
+        self.frame_scale = (hop_size / sample_rate) / (CHUNK_SIZE / SAMPLE_RATE)
+        self._agc_decay = 0.995 ** self.frame_scale
+        self._band_decay = 0.994 ** self.frame_scale
+        if hasattr(self, '_volume_history_for_bpm'):
+            self._volume_history_for_bpm = self._volume_history_for_bpm.resampled(self.frames(300),
+                                                                                   frame_rate / old_frame_rate)
+        self.onset_detector = self.onset_detector.resampled(frame_rate, fft_size, sample_rate)
+        self.channel_onset_detectors = [detector.resampled(frame_rate, fft_size, sample_rate)
+                                        for detector in self.channel_onset_detectors]
+        self.tempo = self.tempo.resampled(frame_rate)
+        self._silent_blocks = 0
+
+        self.start_audio_stream()
+
     def connect_mqtt(self):
         """Connect to MQTT broker"""
         try:
-            self.mqtt_client.connect(self.mqtt_host, self.mqtt_port, 60)
-            self.mqtt_client.loop_start()
+            self.publisher.connect(self.mqtt_host, self.mqtt_port, 60)
         except Exception as e:
             print(f"Error connecting to MQTT: {e}")
             sys.exit(1)
             
     def calculate_fft(self, audio_data: np.ndarray) -> np.ndarray:
-        """Perform FFT on audio data"""
-        windowed = audio_data * np.hamming(len(audio_data))
-        fft = np.fft.rfft(windowed)
-        magnitude = np.abs(fft)
-        return magnitude
+        """Perform FFT on one frame or a (frames, samples) batch of frames"""
+        if audio_data.shape[-1] != self.band_engine.block_size:
+            # Block size changed, rebuild the cached window and bins
+            self.band_engine = self.create_band_engine(audio_data.shape[-1])
+        return self.band_engine.magnitude(audio_data)
         
-    def get_frequency_band_energy(self, magnitude: np.ndarray, freq_range: tuple) -> float:
-        """Calculate energy in a specific frequency band"""
-        freqs = np.fft.rfftfreq(CHUNK_SIZE, 1.0 / SAMPLE_RATE)
-        mask = (freqs >= freq_range[0]) & (freqs <= freq_range[1])
-        if not np.any(mask):
-            return 0.0
-        # Use mean magnitude inside the band logic
-        band_energy = np.mean(magnitude[mask])
-        return float(band_energy)
+    def get_band_energies(self, magnitude: np.ndarray) -> np.ndarray:
+        """Calculate mean energy of every frequency band (ordered like BAND_NAMES) or filterbank bar"""
+        return self.band_engine.band_means(magnitude)
         
-    def process_value(self, raw_value: float, threshold: float, multiplier: float) -> float:
-        """Process value using low threshold and multiplier"""
-        if raw_value < threshold:
-            return 0.0
-        # Map values above threshold to [0.0, 1.0]
-        val = (raw_value - threshold) * multiplier
-        return float(max(0.0, min(1.0, val)))
+    def publish_frame(self, capture_time: float, intensity: float, band_values: np.ndarray, beat: bool,
+                      channels: Optional[ChannelFrame] = None):
+        """Encode one frame in the configured data format and publish it, unless the publish gate suppresses it.
+
+        capture_time is the wall clock time of the newest sample that went into the frame.
+        """
+        prof = self.profiler
+        now = self.clock()
+        values = np.concatenate(([intensity], band_values))
+        any_beat = beat
+        if channels is not None:
+            # Every channel is gated like the mid, a beat on any channel counts as a beat edge
+            values = np.vstack((values, np.column_stack((channels.intensities, channels.bands))))
+            any_beat = beat or bool(np.any(channels.beats))
+        publish = self.publish_gate.should_publish(now, values, any_beat)
+        if prof:
+            prof.lap('gate')
+        latency = max(0.0, now - capture_time)
+        bpm = self.tempo.bpm
+        next_beat = self.tempo.next_beat(capture_time)
+        if self.shm_sink is not None:
+            # Local readers always get the newest frame, writing it costs less than a gate decision saves
+            self.shm_sink.write(self.binary_frame(self.shm_sink.frames, capture_time, latency, intensity,
+                                                  band_values, beat, bpm, next_beat, channels))
+            if prof:
+                prof.lap('shm')
+        if self.recorder is not None:
+            self.recorder.write(capture_time, latency * 1000.0, intensity, band_values, beat, bpm, self.tempo.confidence,
+                                (next_beat - capture_time) * 1000.0 if next_beat is not None else math.nan,
+                                publish, channels)
+            if prof:
+                prof.lap('record')
+        if not publish:
+            return
+        self.sequence += 1
+        self.latency_stats.record('capture_to_publish', latency)
+        if self.data_format == 'json':
+            payload = encode_json_frame(capture_time, latency * 1000.0, intensity, band_values, beat, bpm,
+                                        self.tempo.confidence, next_beat, bool(self.bar_count), channels)
+        else:
+            payload = self.binary_frame(self.sequence, capture_time, latency, intensity, band_values, beat, bpm,
+                                        next_beat, channels)
+        if prof:
+            prof.lap('encode')
+        self.publisher.publish(self.mqtt_topic, payload)
+        if prof:
+            prof.lap('publish')
+
+    def binary_frame(self, sequence: int, capture_time: float, latency: float, intensity: float,
+                     band_values: np.ndarray, beat: bool, bpm: float, next_beat: Optional[float],
+                     channels: Optional[ChannelFrame]) -> bytes:
+        """Encode a frame in the binary layout, uint16 values with the binary16 data format"""
+        next_beat_ms = (next_beat - capture_time) * 1000.0 if next_beat is not None else math.nan
+        return encode_binary_frame(sequence, capture_time, latency * 1000.0, intensity, band_values, beat,
+                                   wide=self.data_format == 'binary16', bpm=bpm,
+                                   confidence=self.tempo.confidence, next_beat_ms=next_beat_ms,
+                                   bars=bool(self.bar_count), channels=channels)
+
+    def set_stats_enabled(self, enabled: bool):
+        """Turn the stage profiler and the periodic stats messages on or off"""
+        if enabled == (self.profiler is not None):
+            return
+        self.profiler = StageProfiler() if enabled else None
+        self._last_stats_time = time.monotonic()
+        print(f"Stats {'enabled' if enabled else 'disabled'}")
+
+    def collect_stats(self) -> Dict[str, Any]:
+        """Stage timings since the previous call plus the running counters"""
+        now = time.monotonic()
+        interval = now - self._last_stats_time
+        self._last_stats_time = now
+        stats = {
+            'timestamp': time.time(),
+            'interval': round(interval, 3),
+            'stages': self.profiler.summary() if self.profiler else {},
+            'latency': self.latency_summary(),
+            'counters': {
+                'dropped_blocks': self.audio_buffer.dropped_blocks,
+                'overruns': self.audio_buffer.overruns,
+                'callback_status': self.callback_status_count,
+                'input_overflows': self.input_overflows,
+                'published': self.publish_gate.published,
+                'suppressed': self.publish_gate.suppressed,
+            },
+            'power': self.power_stats(interval),
+            'mqtt': self.publisher.stats(),
+        }
+        if self.profiler:
+            self.profiler.reset()
+        self.latency_stats.reset()
+        return stats
+
+    def power_stats(self, interval: float) -> Dict[str, Any]:
+        """Capture profile, silence gating and CPU usage since the previous call"""
+        cpu_time = time.process_time()
+        stats = {
+            'profile': self.profile,
+            'sample_rate': self.sample_rate,
+            'silence_gated': self.silence_gated,
+            'analysed_frames': self.analysed_frames,
+            'gated_frames': self.gated_frames,
+            'cpu_saved_ms': round(self.cpu_saved * 1000.0, 1),
+            'cpu_percent': round(100.0 * (cpu_time - self._last_cpu_time) / interval, 1) if interval > 0 else 0.0,
+        }
+        self._last_cpu_time = cpu_time
+        self.analysed_frames = 0
+        self.gated_frames = 0
+        self.cpu_saved = 0.0
+        return stats
+
+    def latency_summary(self) -> Dict[str, float]:
+        """Capture to publish latency of the frames published since the last stats message"""
+        return self.latency_stats.summary().get('capture_to_publish', {'count': 0})
+
+    def publish_stats(self):
+        """Publish collected stats on the stats topic"""
+        stats = self.collect_stats()
+        self.publisher.publish(self.stats_topic, json.dumps(stats))
+
+    def detect_beats(self, magnitude: np.ndarray, rms: np.ndarray, capture_times: np.ndarray) -> np.ndarray:
+        """Detect onsets in a batch of frames, feed them to the tempo estimator and return the onset flags"""
+        novelty, onsets = self.onset_detector.process(magnitude, rms > self.low_threshold)
+        self.tempo.update(novelty, capture_times[onsets])
+        return onsets
         
-    def detect_beat(self, bass_energy: float) -> bool:
-        """Simple beat detection based on relative recruiting bass energy spike"""
-        if len(self.bass_history) < 5:
-            return False
-        avg_bass = float(np.mean(self.bass_history))
-        if avg_bass < 0.001:
+    def next_frames(self, blocks: np.ndarray) -> np.ndarray:
+        """Turn a (blocks, [rows,] hop_size) batch into one fft_size analysis frame (per row) per block"""
+        if len(blocks) == 1:
+            self.sample_window.push(blocks[0])
+            return self.sample_window.view()[np.newaxis]
+        # Prefix the new samples with the tail of the previous frame and cut overlapping frames from it
+        samples = np.concatenate((self.sample_window.view()[..., self.hop_size:], join_blocks(blocks)), axis=-1)
+        self.sample_window.push(samples)
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.fft_size, axis=-1)[..., ::self.hop_size, :]
+        return np.moveaxis(frames, -2, 0)
+
+    def process_blocks(self, blocks: np.ndarray, capture_time: float):
+        """Analyse a (blocks, hop_size) batch of audio and publish the newest frame.
+
+        capture_time is the wall clock time of the newest sample in the batch. While the silence
+        gate is closed the batch only goes through the cheap RMS check in skip_blocks.
+        """
+        started = time.perf_counter()
+        if self.channels > 1:
+            # Prepend the mid (mono mix) as row 0, so it goes through the same batched analysis
+            blocks = np.concatenate((np.mean(blocks, axis=1, keepdims=True), blocks), axis=1)
+        if self.silence_gate > 0.0 and self.update_silence_gate(blocks):
+            self.skip_blocks(blocks, capture_time)
+            self.gated_frames += len(blocks)
+            self.cpu_saved += max(0.0, len(blocks) * self._frame_cost - (time.perf_counter() - started))
+            return
+        self.analyse_blocks(blocks, capture_time)
+        self.analysed_frames += len(blocks)
+        cost = (time.perf_counter() - started) / len(blocks)
+        self._frame_cost = cost if self._frame_cost == 0.0 else 0.95 * self._frame_cost + 0.05 * cost
+
+    def update_silence_gate(self, blocks: np.ndarray) -> bool:
+        """Track how long the input stayed below low_threshold, returns whether analysis is gated"""
+        peak_rms = math.sqrt(float(np.max(np.mean(np.square(blocks, dtype=np.float64), axis=-1))))
+        if peak_rms >= self.low_threshold:
+            self._silent_blocks = 0
+            if self.silence_gated:
+                self.silence_gated = False
+                print("Signal returned, resuming full analysis")
             return False
-        return bool(bass_energy > (avg_bass * BEAT_THRESHOLD_MULTIPLIER))
+        self._silent_blocks += len(blocks)
+        if not self.silence_gated and self._silent_blocks * self.hop_size >= self.silence_gate * self.sample_rate:
+            self.silence_gated = True
+            print(f"Input below the noise floor for {self.silence_gate:g} s, pausing analysis")
+        return self.silence_gated
+
+    def skip_blocks(self, blocks: np.ndarray, capture_time: float):
+        """RMS-only path during silence: keep the analysis window current and publish a silent frame"""
+        # The window has to hold the latest samples when analysis resumes
+        self.sample_window.push(join_blocks(blocks))
+        if self.profiler:
+            self.profiler.lap('gated')
+        self.publish_frame(capture_time, 0.0, self._silent_frame, False, self._silent_channels)
+
+    def analyse_blocks(self, blocks: np.ndarray, capture_time: float):
+        """Full analysis of a batch: FFT, bands, AGC, beats, then publish the newest frame.
+
+        Multi-channel batches carry a row axis after the block axis (mid first, then the channels),
+        every step below works on all rows at once.
+        """
+        prof = self.profiler
+
+        # Slide the analysis window forward by one hop per block
+        frames = self.next_frames(blocks)
+
+        # Calculate FFT of all frames at once
+        magnitude = self.calculate_fft(frames)
+        if prof:
+            prof.lap('fft')
+        
+        # Calculate raw energy for each band, shape (frames, [rows,] bands) ordered like BAND_NAMES (or the bars)
+        band_energies_batch = self.get_band_energies(magnitude)
+        if self.bass_analyzer is not None:
+            # Replace the coarse full-rate bass bins with the fine decimated ones
+            band_energies_batch[..., self._bass_band_indices] = self.bass_analyzer.process(blocks)
+        band_energies_raw = band_energies_batch[-1]
+        
+        # Calculate overall raw energy as Root Mean Square (RMS)
+        rms_batch = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=-1))
+        rms_intensity = rms_batch[-1]
+        if prof:
+            prof.lap('bands')
+        
+        # Active music event adaptive scale (Dynamic Range AGC)
+        # To maintain a highly punchy, non-clipping signal, we use a true peak envelope follower.
+        # In order to avoid pinning at 100% when the music gets really loud, the peak detector
+        # tracks the maximum volume peak with an instant attack coefficient and a moderate decay.
+        # At 50fps, a decay factor of 0.993 lets the peak hold the volume ceiling across beats,
+        # decaying slowly (~2 seconds) so that the relative dynamic range is preserved.
+        # To make the visualizer highly adaptive across all music styles (metal, pop, vocal, electro),
+        # we want plenty of energetic flashing no matter what mode or volume we are on, while also
+        # gracefully dimming down and calming the general visuals when the song gets slow and calm.
+        #
+        # 1) Dynamic Ceiling Follower:
+        #    We track the local raw RMS volume peak with an instant attack and moderate decay model.
+        if not hasattr(self, '_agc_ceiling'):
+            self._agc_ceiling = 0.05
+        if not hasattr(self, '_volume_history_for_bpm'):
+            # A longer rolling window (~6 seconds) to detect if the overall song is calm or high-energy
+            self._volume_history_for_bpm = RunningStats(self.frames(300))
+        if not hasattr(self, '_beat_timestamps'):
+            self._beat_timestamps = deque(maxlen=20)
+
+        target_vols = np.maximum(rms_batch, self.low_threshold)
+        # The calm/energetic song detection follows the mid
+        mid_vols = target_vols if target_vols.ndim == 1 else target_vols[:, 0]
+        target_vol = float(mid_vols[-1])
+        self._volume_history_for_bpm.extend(mid_vols)
+
+        # Instant tracking of loud transient peaks, slow decay (decay factor 0.995) to hold
+        # reference ceiling high during normal playback (one ceiling per row)
+        self._agc_ceiling = follow_ceiling(self._agc_ceiling, target_vols, self._agc_decay)
+
+        dynamic_ceiling = self._agc_ceiling
+        
+        # Clamp ceiling to avoid extreme amplification of mic hum
+        min_ceiling = max(0.005, self.low_threshold * 1.5)
+        dynamic_ceiling = np.maximum(min_ceiling, dynamic_ceiling)
+
+        # Calculate specific individual band ceilings so that loud frequency sections
+        # don't pin all bands to 100%! Each band scales on its own dynamic range.
+        if not hasattr(self, '_band_ceilings'):
+            self._band_ceilings = np.full(self.band_engine.band_count, 0.05)
+
+        # Instant attack on rising bands, slow decay (decay factor 0.994) to hold individual band headroom high
+        self._band_ceilings = follow_ceiling(self._band_ceilings, band_energies_batch, self._band_decay)
+
+        # Clamp band ceilings to avoid extreme amplification of background noise
+        b_min_ceiling = max(0.005, self.low_threshold * 1.5)
+        b_range = np.maximum(0.002, np.maximum(self._band_ceilings, b_min_ceiling) - self.low_threshold)
+        band_attenuations = 1.0 / b_range
+        
+        # Determine how active/quiet the music is based on recent rolling data vs long-term values.
+        # 2) "Slow & Calm" Track Detection:
+        #    If the average volume level is very low relative to its noise floor, or if there's very low energy,
+        #    or if the rate of beats (BPM equivalent) is very sparse, we decrease the gain scaling.
+        avg_recent_vol = self._volume_history_for_bpm.mean if len(self._volume_history_for_bpm) > 0 else target_vol
+        
+        # Calculate active range & base attenuation
+        active_range = np.maximum(0.002, dynamic_ceiling - self.low_threshold)
+        attenuation = 1.0 / active_range
+
+        # 3) Flash-vibrancy Adaptation Factor ("Vibe Scalar"):
+        #    We want the general visual rendering output to feel highly lively (plenty of movement).
+        #    If we are playing high-intensity music, we boost the scaling to make it flash intensely.
+        #    If the song transitions to a slow/calm segment, we dynamically dial down the scale multiplier.
+        # Let's count beats in the last 5 seconds to estimate energy.
+        current_time = self.clock()
+        while self._beat_timestamps and current_time - self._beat_timestamps[0] >= 5.0:
+            self._beat_timestamps.popleft()
+        beat_count_5s = len(self._beat_timestamps)
+
+        vibe_scalar = 1.0
+        
+        # If there are very few beats/pulses detected or the average long-term volume is very low,
+        # it means the song is slow, quiet, or calm. We dim the scalar (down to 0.4x) so the LEDs calm down.
+        if len(self._volume_history_for_bpm) >= self.frames(100):
+            vol_std = self._volume_history_for_bpm.std
+            # Very quiet transitions/ambient tracks have low variance and small averages
+            if avg_recent_vol < (self.low_threshold * 1.8) or vol_std < 0.002:
+                vibe_scalar = 0.45  # Quiet/Ambient: dim down to smooth glowing visuals
+            elif beat_count_5s < 3:
+                vibe_scalar = 0.65  # Slow/Chill: mellow/controlled movement
+            elif beat_count_5s >= 8:
+                vibe_scalar = 1.25  # High-energy / Drops: super flashy, maximum activity!
+
+        # Apply vibe_scalar to final attenuation multiplier
+        scaled_intensity = self.intensity * vibe_scalar
+
+        # Apply noise-gate cutoff, scale, and dynamic attenuation to individual bands
+        # We multiply the normalized 0.0-1.0 signal by scaled_intensity to let the user scale it up/down,
+        # while applying the vibe_scalar to automatically adapt to slow/quiet blocks or boost on heavy peaks!
+        # Note: We now utilize independent dynamic band_attenuations ceilings to prevent single-frequency pinning!
+        gated = np.where(band_energies_raw < self.low_threshold, 0.0,
+                         np.clip(band_energies_raw - self.low_threshold, 0.0, 1.0))
+        band_values = np.clip(gated * band_attenuations * scaled_intensity, 0.0, 1.0)
+        
+        # Apply cutoff, scale, and dynamic attenuation to overall intensity
+        gated_intensity = np.where(rms_intensity < self.low_threshold, 0.0,
+                                   np.clip(rms_intensity - self.low_threshold, 0.0, 1.0))
+        processed_intensity = np.clip(gated_intensity * attenuation * scaled_intensity, 0.0, 1.0)
+        if prof:
+            prof.lap('agc')
+        
+        # Detect beats (spectral flux onsets over the whole spectrum, so vocal and treble heavy
+        # tracks pulse without any bass/treble style switching)
+        frame_times = capture_time - np.arange(len(frames) - 1, -1, -1) * (self.hop_size / self.sample_rate)
+        if self.channels == 1:
+            beats = self.detect_beats(magnitude, rms_batch, frame_times)
+        else:
+            beats = self.detect_beats(magnitude[:, 0], rms_batch[:, 0], frame_times)
+        self._beat_timestamps.extend([current_time] * int(np.count_nonzero(beats)))
+        # A catch-up batch only publishes its newest frame, but must not swallow beats
+        is_beat = bool(np.any(beats))
+        channel_frame = None
+        if self.channels > 1:
+            channel_beats = np.array([bool(np.any(detector.process(magnitude[:, i + 1], rms_batch[:, i + 1] > self.low_threshold)[1]))
+                                      for i, detector in enumerate(self.channel_onset_detectors)])
+            channel_frame = self.channel_frame(frames[-1], rms_intensity, processed_intensity[1:], band_values[1:], channel_beats)
+            processed_intensity, band_values = processed_intensity[0], band_values[0]
+        if prof:
+            prof.lap('beat')
         
+        # Publish to MQTT (without music style system), rate limited and change suppressed by the publish gate
+        self.publish_frame(capture_time, float(processed_intensity), band_values, is_beat, channel_frame)
+
+    def channel_frame(self, frame: np.ndarray, rms: np.ndarray, intensities: np.ndarray, band_values: np.ndarray,
+                      beats: np.ndarray) -> ChannelFrame:
+        """Per-channel output of the newest frame plus the stereo balance and width of the first two channels.
+
+        frame and rms hold the mid in row 0 followed by the channels.
+        """
+        left, right = rms[1], rms[2]
+        balance = float((right - left) / (right + left)) if right + left > 1e-9 else 0.0
+        side = math.sqrt(float(np.mean(np.square(0.5 * (frame[1] - frame[2]), dtype=np.float64))))
+        width = side / (rms[0] + side) if rms[0] + side > 1e-9 else 0.0
+        return ChannelFrame(intensities, band_values, beats, balance, float(width))
+
     def process_audio(self):
         """Main audio processing loop"""
         print("Starting audio processing...")
         
         while True:
             try:
+                self.apply_pending_stream_changes()
                 if not self.enabled:
                     time.sleep(0.1)
                     continue
                 
-                # Retrieve audio block from queue
-                try:
-                    audio_array = self.audio_queue.get(timeout=0.2)
-                except queue.Empty:
-                    # If stream is down or silent, publish zero data to keep UI alive
-                    current_time = time.time()
-                    if current_time - self.last_publish_time >= self.publish_interval:
-                        self.last_publish_time = current_time
-                        zero_data = {
-                            'timestamp': current_time,
-                            'intensity': 0.0,
-                            'bands': {band: 0.0 for band in FREQUENCY_BANDS.keys()},
-                            'beat': False
-                        }
-                        if self.mqtt_connected:
-                            self.mqtt_client.publish(self.mqtt_topic, json.dumps(zero_data))
-                    continue
-                
-                # Calculate FFT
-                magnitude = self.calculate_fft(audio_array)
-                
-                # Calculate raw energy for each band
-                band_energies_raw = {}
-                for band_name, freq_range in FREQUENCY_BANDS.items():
-                    band_energies_raw[band_name] = self.get_frequency_band_energy(magnitude, freq_range)
-                
-                # Calculate overall raw energy as Root Mean Square (RMS)
-                rms_intensity = float(np.linalg.norm(audio_array) / np.sqrt(len(audio_array)))
-                
-                # Active music event adaptive scale (Dynamic Range AGC)
-                # To maintain a highly punchy, non-clipping signal, we use a true peak envelope follower.
-                # In order to avoid pinning at 100% when the music gets really loud, the peak detector
-                # tracks the maximum volume peak with an instant attack coefficient and a moderate decay.
-                # At 50fps, a decay factor of 0.993 lets the peak hold the volume ceiling across beats,
-                # decaying slowly (~2 seconds) so that the relative dynamic range is preserved.
-                # To make the visualizer highly adaptive across all music styles (metal, pop, vocal, electro),
-                # we want plenty of energetic flashing no matter what mode or volume we are on, while also
-                # gracefully dimming down and calming the general visuals when the song gets slow and calm.
-                #
-                # 1) Dynamic Ceiling Follower:
-                #    We track the local raw RMS volume peak with an instant attack and moderate decay model.
-                if not hasattr(self, '_agc_ceiling'):
-                    self._agc_ceiling = 0.05
-                if not hasattr(self, '_volume_history_for_bpm'):
-                    # A longer rolling window (~6 seconds) to detect if the overall song is calm or high-energy
-                    self._volume_history_for_bpm = deque(maxlen=300)
-                if not hasattr(self, '_beat_timestamps'):
-                    self._beat_timestamps = deque(maxlen=20)
-
-                target_vol = max(rms_intensity, self.low_threshold)
-                self._volume_history_for_bpm.append(target_vol)
-
-                if target_vol > self._agc_ceiling:
-                    # Instant tracking of loud transient peaks
-                    self._agc_ceiling = target_vol
-                else:
-                    # Slow decay (decay factor 0.995) to hold reference ceiling high during normal playback
-                    self._agc_ceiling = max(0.005, self._agc_ceiling * 0.995 + target_vol * 0.005)
+                prof = self.profiler
+                if prof:
+                    if time.monotonic() - self._last_stats_time >= self.stats_interval:
+                        self.publish_stats()
+                    prof.start()
 
-                dynamic_ceiling = self._agc_ceiling
-                
-                # Clamp ceiling to avoid extreme amplification of mic hum
-                min_ceiling = max(0.005, self.low_threshold * 1.5)
-                dynamic_ceiling = max(min_ceiling, dynamic_ceiling)
-
-                # Calculate specific individual band ceilings so that loud frequency sections
-                # don't pin all bands to 100%! Each band scales on its own dynamic range.
-                if not hasattr(self, '_band_ceilings'):
-                    self._band_ceilings = {band: 0.05 for band in FREQUENCY_BANDS.keys()}
-
-                for band_name, energy in band_energies_raw.items():
-                    if energy > self._band_ceilings[band_name]:
-                        self._band_ceilings[band_name] = energy
-                    else:
-                        # Decay band ceilings slowly (decay factor 0.994) to hold individual band headroom high
-                        self._band_ceilings[band_name] = max(0.005, self._band_ceilings[band_name] * 0.994 + energy * 0.006)
-
-                # Clamp band ceilings to avoid extreme amplification of background noise
-                band_attenuations = {}
-                for band_name, b_ceiling in self._band_ceilings.items():
-                    b_min_ceiling = max(0.005, self.low_threshold * 1.5)
-                    b_range = max(0.002, max(b_ceiling, b_min_ceiling) - self.low_threshold)
-                    band_attenuations[band_name] = 1.0 / b_range
-                
-                # Determine how active/quiet the music is based on recent rolling data vs long-term values.
-                # 2) "Slow & Calm" Track Detection:
-                #    If the average volume level is very low relative to its noise floor, or if there's very low energy,
-                #    or if the rate of beats (BPM equivalent) is very sparse, we decrease the gain scaling.
-                avg_recent_vol = float(np.mean(self._volume_history_for_bpm)) if len(self._volume_history_for_bpm) > 0 else target_vol
-                
-                # Calculate active range & base attenuation
-                active_range = max(0.002, dynamic_ceiling - self.low_threshold)
-                attenuation = 1.0 / active_range
-
-                # 3) Flash-vibrancy Adaptation Factor ("Vibe Scalar"):
-                #    We want the general visual rendering output to feel highly lively (plenty of movement).
-                #    If we are playing high-intensity music, we boost the scaling to make it flash intensely.
-                #    If the song transitions to a slow/calm segment, we dynamically dial down the scale multiplier.
-                # Let's count beats in the last 5 seconds to estimate energy.
-                current_time = time.time()
-                recent_beats = [t for t in self._beat_timestamps if current_time - t < 5.0]
-                beat_count_5s = len(recent_beats)
-
-                vibe_scalar = 1.0
-                
-                # If there are very few beats/pulses detected or the average long-term volume is very low,
-                # it means the song is slow, quiet, or calm. We dim the scalar (down to 0.4x) so the LEDs calm down.
-                if len(self._volume_history_for_bpm) >= 100:
-                    vol_std = float(np.std(self._volume_history_for_bpm))
-                    # Very quiet transitions/ambient tracks have low variance and small averages
-                    if avg_recent_vol < (self.low_threshold * 1.8) or vol_std < 0.002:
-                        vibe_scalar = 0.45  # Quiet/Ambient: dim down to smooth glowing visuals
-                    elif beat_count_5s < 3:
-                        vibe_scalar = 0.65  # Slow/Chill: mellow/controlled movement
-                    elif beat_count_5s >= 8:
-                        vibe_scalar = 1.25  # High-energy / Drops: super flashy, maximum activity!
-
-                # Apply vibe_scalar to final attenuation multiplier
-                scaled_intensity = self.intensity * vibe_scalar
-
-                # Dynamic Style Adaptation:
-                # If a song is heavily vocal/high-end and lacks bass, we self-compensate the band ratios
-                # Calculate energy sums for Bass versus High sections
-                bass_side = band_energies_raw['sub_bass'] + band_energies_raw['bass']
-                mids_high_side = (band_energies_raw['low_mids'] + band_energies_raw['mids'] + 
-                                  band_energies_raw['high_mids'] + band_energies_raw['highs'] + 
-                                  band_energies_raw['presence'])
-                
-                # Track rolling ratio history of Bass to Highs to adapt style changes
-                if not hasattr(self, '_style_ratio_history'):
-                    self._style_ratio_history = deque(maxlen=60) # ~1.5 sec lookback
-                
-                total_energy = bass_side + mids_high_side
-                if total_energy > 0.005:
-                    current_ratio = bass_side / total_energy
-                    self._style_ratio_history.append(current_ratio)
-                
-                # If average bass energy is very low (< 12% of total spectral power),
-                # we are listening to vocal, ambient, high-end synth, or quiet transitions.
-                # In that case, we dynamically switch the beat detection to also trigger
-                # on mid/high transient frequency energy spikes! This ensures the face still
-                # flashes and pulses dynamically even when there's no boom-boom bass!
-                is_bass_heavy_style = True
-                if len(self._style_ratio_history) > 5:
-                    avg_bass_pct = float(np.mean(self._style_ratio_history))
-                    if avg_bass_pct < 0.12:
-                        is_bass_heavy_style = False
-                
-                # Track rolling bass energy (or treble energy if bass is absent) for beat detection
-                if is_bass_heavy_style:
-                    beat_energy_source = band_energies_raw['bass'] + band_energies_raw['sub_bass']
-                else:
-                    # Target voice, snare, high synths, and presence crispness to fuel flash triggers
-                    beat_energy_source = band_energies_raw['mids'] + band_energies_raw['high_mids'] + band_energies_raw['low_mids']
-                
-                self.bass_history.append(beat_energy_source)
-                
-                # Apply noise-gate cutoff, scale, and dynamic attenuation to individual bands
-                # We multiply the normalized 0.0-1.0 signal by scaled_intensity to let the user scale it up/down,
-                # while applying the vibe_scalar to automatically adapt to slow/quiet blocks or boost on heavy peaks!
-                # Note: We now utilize independent dynamic band_attenuations ceilings to prevent single-frequency pinning!
-                band_energies = {}
-                for band_name, energy in band_energies_raw.items():
-                    b_attenuation = band_attenuations[band_name]
-                    raw_val = self.process_value(energy, self.low_threshold, 1.0) * b_attenuation * scaled_intensity
-                    normalized = max(0.0, min(1.0, raw_val))
-                    band_energies[band_name] = round(normalized, 3)
-                
-                # Apply cutoff, scale, and dynamic attenuation to overall intensity
-                raw_intensity = self.process_value(rms_intensity, self.low_threshold, 1.0) * attenuation * scaled_intensity
-                processed_intensity = max(0.0, min(1.0, raw_intensity))
-                
-                # Detect beats (relative transient spike in chosen energy source)
-                is_beat = self.detect_beat(beat_energy_source)
-                if is_beat:
-                    self._beat_timestamps.append(current_time)
-                
-                # Throttle publishing or keep it paced
-                current_time = time.time()
-                if current_time - self.last_publish_time < self.publish_interval:
+                # Retrieve every pending block from the ring buffer. Normally this is a single block,
+                # when analysis fell behind the whole backlog is processed as one batch and only the
+                # newest frame gets published so the listener catches up in one step.
+                batch = self.audio_buffer.read_all(timeout=0.2)
+                if prof:
+                    prof.lap('wait')
+                if batch is None:
+                    # If stream is down or silent, zero data keeps the UI alive (the publish gate
+                    # only lets the first one and the periodic keyframes through)
+                    self.publish_frame(self.clock(), 0.0, self._silent_frame, False, self._silent_channels)
                     continue
-                self.last_publish_time = current_time
-                
-                # Prepare data payload (without music style system)
-                data = {
-                    'timestamp': float(current_time),
-                    'intensity': round(processed_intensity, 3),
-                    'bands': band_energies,
-                    'beat': bool(is_beat)
-                }
                 
-                # Publish to MQTT
-                if self.mqtt_connected:
-                    self.mqtt_client.publish(self.mqtt_topic, json.dumps(data))
+                blocks, capture_times = batch
+                self.process_blocks(blocks, capture_times[-1] + self.hop_size / self.sample_rate)
                 
             except KeyboardInterrupt:
                 print("\nShutting down...")
@@ -396,16 +2054,116 @@ class AudioVisualizer:
                 
     def cleanup(self):
         """Clean up resources"""
-        if self.stream:
+        if self.source:
             try:
-                self.stream.stop()
-                self.stream.close()
+                self.source.stop()
             except Exception as e:
                 print(f"Error closing stream: {e}")
         try:
-            self.mqtt_client.loop_stop()
+            self.publisher.stop()
         except:
             pass
+        if self.shm_sink is not None:
+            self.shm_sink.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+def create_source(spec: Optional[str], block_size: int, loop: bool, raw_format: str,
+                  sample_rate: int = SAMPLE_RATE, channels: int = 1) -> Optional[AudioSource]:
+    """Build the audio source for --input, None means live capture through sounddevice.
+
+    sample_rate and channels apply to the synthetic source, files play at their own rate and layout.
+    """
+    if spec is None or spec == 'sounddevice':
+        return None
+    if spec == 'synthetic':
+        return SyntheticSource(sample_rate, block_size, channels=channels)
+    if spec.startswith('file:'):
+        return FileSource(spec[len('file:'):], block_size, loop=loop, raw_format=raw_format)
+    raise ValueError(f"unknown input {spec}, expected sounddevice, synthetic or file:PATH")
+
+
+def run_benchmark(visualizer: AudioVisualizer, source: GeneratedSource, seconds: float):
+    """Run the full processing pipeline over `seconds` of audio as fast as possible and print a report.
+
+    MQTT is replaced by a NullMqttClient and the clock follows the sample position, so the
+    checksum of the published payloads only changes when the output of the pipeline changes.
+    """
+    sink = NullMqttClient()
+    visualizer.mqtt_client = sink
+    visualizer.publisher = CoalescingPublisher(sink)
+    visualizer.publisher.set_connected(True)
+    profiler = StageProfiler()
+    visualizer.profiler = profiler
+    sample_position = [0]
+    visualizer.clock = lambda: sample_position[0] / source.sample_rate
+
+    max_blocks = int(seconds * source.sample_rate / source.block_size)
+    frame_times = []
+    started = time.perf_counter()
+    for block in source.blocks():
+        if len(frame_times) >= max_blocks:
+            break
+        frame_start = time.perf_counter()
+        profiler.start()
+        sample_position[0] += len(block)
+        visualizer.audio_callback(block, len(block), None, None)
+        blocks, capture_times = visualizer.audio_buffer.read_all(timeout=0)
+        profiler.lap('input')
+        visualizer.process_blocks(blocks, capture_times[-1] + visualizer.hop_size / source.sample_rate)
+        frame_times.append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - started
+
+    frames = len(frame_times)
+    audio_seconds = sample_position[0] / source.sample_rate
+    print(f"Benchmark: {frames} frames ({audio_seconds:.1f} s of audio, fft {visualizer.fft_size}, hop {visualizer.hop_size}) in {elapsed:.3f} s")
+    if frames == 0:
+        return
+    print(f"  Throughput: {frames / elapsed:.1f} frames/s ({audio_seconds / elapsed:.1f}x real time)")
+    print(f"  Published: {sink.published} frames, {sink.bytes} bytes, {visualizer.publish_gate.suppressed} suppressed")
+    print(f"  Checksum: {sink.checksum:08x}")
+    if visualizer.silence_gate > 0.0:
+        print(f"  Silence gate: {visualizer.gated_frames} of {frames} frames RMS-only, "
+              f"~{visualizer.cpu_saved * 1000.0:.1f} ms CPU saved")
+    if visualizer.shm_sink is not None:
+        print(f"  Shared memory: {visualizer.shm_sink.frames} frames written to {visualizer.shm_sink.path}")
+    print(f"  {'Stage latency (us)':<20}{'p50':>10}{'p95':>10}{'p99':>10}")
+    stages = profiler.percentiles()
+    stages['total'] = np.percentile(frame_times, (50, 95, 99))
+    for stage, values in stages.items():
+        p50, p95, p99 = values * 1e6
+        print(f"    {stage:<18}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+def replay(args):
+    """--replay mode: publish a frame log to the data topic, no audio input needed"""
+    client = create_mqtt_client()
+    publisher = CoalescingPublisher(client)
+    client.on_connect = lambda client, userdata, flags, rc, properties=None: publisher.set_connected(rc == 0)
+    client.on_disconnect = lambda client, userdata, *rest: publisher.set_connected(False)
+    publisher.connect(args.mqtt_host, args.mqtt_port, 60)
+    deadline = time.monotonic() + 10.0
+    while not publisher.connected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if not publisher.connected:
+        print(f"Could not connect to MQTT broker at {args.mqtt_host}:{args.mqtt_port}")
+        publisher.stop()
+        sys.exit(1)
+    try:
+        replay_recording(args.replay, publisher, args.mqtt_topic, args.format, args.replay_speed,
+                         args.replay_all, args.loop)
+        # Let the last frames go out before disconnecting
+        deadline = time.monotonic() + 5.0
+        while publisher.stats()['queued'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+    except (OSError, ValueError) as e:
+        print(f"Error replaying {args.replay}: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.stop()
 
 
 def main():
@@ -418,26 +2176,138 @@ def main():
     parser.add_argument("--mqtt-port", type=int, default=1883, help="MQTT broker port")
     parser.add_argument("--mqtt-topic", type=str, default="protogen/audio-visualizer/data", help="MQTT topic to publish data")
     parser.add_argument("--mqtt-config-topic", type=str, default="protogen/audio-visualizer/config", help="MQTT topic to listen for configs")
+    parser.add_argument("--profile", type=str, default="default", choices=CAPTURE_PROFILES,
+                        help="Capture profile, low-power captures at 22.05 or 16 kHz and pauses analysis during silence")
+    parser.add_argument("--silence-gate", type=float, default=None,
+                        help="Seconds below --low-threshold before analysis pauses (0 disables, default: on with --profile low-power)")
+    parser.add_argument("--fft-size", type=int, default=None, help=f"FFT frame length in samples (default: {CHUNK_SIZE}, {LOW_POWER_FFT_SIZE} with --profile low-power)")
+    parser.add_argument("--hop-size", type=int, default=None, help="Samples between FFT frames (default: --fft-size, no overlap)")
+    parser.add_argument("--bands", type=int, default=None,
+                        help="Publish this many filterbank bars instead of the 7 named bands")
+    parser.add_argument("--scale", type=str, default="log", choices=FILTERBANK_SCALES,
+                        help="Frequency spacing of the filterbank bars")
+    parser.add_argument("--bass-fft-size", type=int, default=DEFAULT_BASS_FFT_SIZE,
+                        help="FFT length of the decimated sub-bass/bass analysis (0 analyses them at the full rate)")
+    parser.add_argument("--channels", type=int, default=1,
+                        help=f"Input channels to analyse separately, up to {MAX_CHANNELS} (1 analyses a mono mix)")
+    parser.add_argument("--shm-path", type=str, nargs="?", const=DEFAULT_SHM_PATH, default=None,
+                        help=f"Also write every frame to this memory-mapped file for local readers (default path: {DEFAULT_SHM_PATH})")
+    parser.add_argument("--record", type=str, metavar="PATH", default=None,
+                        help="Append every analysed frame to a frame log (see readme)")
+    parser.add_argument("--replay", type=str, metavar="PATH", default=None,
+                        help="Republish a frame log recorded with --record instead of analysing audio")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="Replay speed factor, 0 publishes as fast as possible (default: 1)")
+    parser.add_argument("--replay-all", action="store_true",
+                        help="Replay every recorded frame, not only the ones that were published")
+    parser.add_argument("--format", type=str, default="json", choices=DATA_FORMATS,
+                        help="Data topic payload format (binary formats use a fixed struct layout, see readme)")
+    parser.add_argument("--deadband", type=str, default=str(DEFAULT_DEADBAND),
+                        help="Minimum change that is published at full rate, one value or intensity followed by one per band")
+    parser.add_argument("--max-publish-rate", type=float, default=DEFAULT_MAX_PUBLISH_RATE, help="Maximum publish rate in Hz")
+    parser.add_argument("--min-publish-rate", type=float, default=DEFAULT_MIN_PUBLISH_RATE,
+                        help="Publish rate in Hz for changes smaller than the deadband")
+    parser.add_argument("--keyframe-ms", type=int, default=DEFAULT_KEYFRAME_MS,
+                        help="Publish a frame at least this often even when nothing changed")
+    parser.add_argument("--stats", action="store_true", help="Publish pipeline timing stats (can be toggled over the config topic)")
+    parser.add_argument("--stats-topic", type=str, default=DEFAULT_STATS_TOPIC, help="MQTT topic for pipeline stats")
+    parser.add_argument("--stats-interval", type=float, default=DEFAULT_STATS_INTERVAL, help="Seconds between stats messages")
+    parser.add_argument("--input", type=str, default=None,
+                        help="Audio source: sounddevice (default), synthetic or file:PATH (WAV, or raw PCM)")
+    parser.add_argument("--raw-format", type=str, default="s16le", choices=("s16le", "f32le"),
+                        help="Sample format of raw PCM input files (mono, 44.1 kHz)")
+    parser.add_argument("--loop", action="store_true", help="Loop file input")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Process the input as fast as possible without MQTT and print throughput and stage latencies")
+    parser.add_argument("--benchmark-seconds", type=float, default=60.0, help="Seconds of audio to process in benchmark mode")
     parser.add_argument("--list-devices", action="store_true", help="List all available audio input devices and exit")
     
     # Keep compatibility with --sensitivity as a fallback
     parser.add_argument("--sensitivity", type=float, default=None, help="Deprecated sensitivity multiplier")
     
     args = parser.parse_args()
+
+    low_power = args.profile == 'low-power'
+    fft_size_given = args.fft_size is not None
+    if args.fft_size is None:
+        args.fft_size = LOW_POWER_FFT_SIZE if low_power else CHUNK_SIZE
+    silence_gate = args.silence_gate if args.silence_gate is not None else (LOW_POWER_SILENCE_GATE if low_power else 0.0)
+    hop_size = args.hop_size if args.hop_size is not None else args.fft_size
+    if args.fft_size < 16 or hop_size < 1 or hop_size > args.fft_size:
+        parser.error("--hop-size must be between 1 and --fft-size, and --fft-size at least 16")
+
+    if args.bass_fft_size < 0 or (args.bass_fft_size and args.bass_fft_size < 16):
+        parser.error("--bass-fft-size must be 0 or at least 16")
+    if args.bands is not None and not 1 <= args.bands <= MAX_FILTERBANK_BARS:
+        parser.error(f"--bands must be between 1 and {MAX_FILTERBANK_BARS}")
+    if not 1 <= args.channels <= MAX_CHANNELS:
+        parser.error(f"--channels must be between 1 and {MAX_CHANNELS}")
+
+    try:
+        deadbands = parse_deadbands(args.deadband, args.bands or len(BAND_NAMES))
+    except ValueError as e:
+        parser.error(f"--deadband: {e}")
+    if args.max_publish_rate <= 0 or args.min_publish_rate <= 0 or args.keyframe_ms <= 0:
+        parser.error("publish rates and --keyframe-ms must be positive")
+    publish_gate = PublishGate(deadbands, args.max_publish_rate, args.min_publish_rate, args.keyframe_ms / 1000.0)
     
     if args.list_devices:
+        # list_devices.py does the same without loading numpy and paho first, the backend uses it directly
+        from list_devices import list_input_devices, print_devices
         try:
-            devices = sd.query_devices()
-            for i, dev in enumerate(devices):
-                if dev['max_input_channels'] > 0:
-                    print(f"Device {i}: {dev['name']}")
-                    print(f"  Sample Rate: {int(dev['default_samplerate'])} Hz")
-                    print(f"  Input Channels: {dev['max_input_channels']}")
+            if sd is None:
+                raise RuntimeError(f"sounddevice is not available: {SOUNDDEVICE_IMPORT_ERROR}")
+            print_devices(list_input_devices()[0])
         except Exception as e:
             print(f"Error listing devices: {e}")
             sys.exit(1)
         sys.exit(0)
+
+    if args.replay:
+        replay(args)
+        return
         
+    live_capture = args.input is None or args.input == 'sounddevice'
+    sample_rate = SAMPLE_RATE
+    if low_power:
+        # Only live capture depends on what the device supports
+        if live_capture and not args.benchmark:
+            sample_rate = supported_sample_rate(args.device, LOW_POWER_SAMPLE_RATES, args.channels)
+        else:
+            sample_rate = LOW_POWER_SAMPLE_RATES[0]
+        if sample_rate not in LOW_POWER_SAMPLE_RATES:
+            # LOW_POWER_FFT_SIZE only has the duration of the default FFT at the low-power rates
+            print(f"Warning: the input device supports none of {', '.join(map(str, LOW_POWER_SAMPLE_RATES))} Hz, "
+                  f"low-power captures at {sample_rate} Hz")
+            if not fft_size_given:
+                args.fft_size = CHUNK_SIZE
+                if args.hop_size is None:
+                    hop_size = args.fft_size
+
+    try:
+        source = create_source(args.input, hop_size, args.loop, args.raw_format, sample_rate, args.channels)
+    except (ValueError, OSError, EOFError, wave.Error) as e:
+        parser.error(f"--input: {e}")
+    if args.benchmark:
+        if source is None:
+            if args.input is not None:
+                parser.error("--benchmark needs --input synthetic or file:PATH")
+            source = SyntheticSource(sample_rate, hop_size, channels=args.channels)
+
+    recorder = None
+    if args.record:
+        try:
+            recorder = FrameRecorder(args.record, (args.bands or len(BAND_NAMES)) + 1, args.channels, bool(args.bands))
+        except (OSError, ValueError) as e:
+            parser.error(f"--record: {e}")
+
+    shm_sink = None
+    if args.shm_path:
+        try:
+            shm_sink = SharedFrameSink(args.shm_path)
+        except OSError as e:
+            parser.error(f"--shm-path: {e}")
+
     final_intensity = args.intensity
     if args.sensitivity is not None:
         final_intensity = args.sensitivity  # backwards-compatible mapping
@@ -449,8 +2319,33 @@ def main():
         mqtt_host=args.mqtt_host,
         mqtt_port=args.mqtt_port,
         mqtt_topic=args.mqtt_topic,
-        mqtt_config_topic=args.mqtt_config_topic
+        mqtt_config_topic=args.mqtt_config_topic,
+        fft_size=args.fft_size,
+        hop_size=hop_size,
+        data_format=args.format,
+        publish_gate=publish_gate,
+        source=source,
+        stats_topic=args.stats_topic,
+        stats_interval=args.stats_interval,
+        stats_enabled=args.stats,
+        bands=args.bands,
+        scale=args.scale,
+        bass_fft_size=args.bass_fft_size,
+        sample_rate=sample_rate,
+        profile=args.profile,
+        silence_gate=silence_gate,
+        channels=args.channels,
+        shm_sink=shm_sink,
+        recorder=recorder
     )
+
+    if args.benchmark:
+        run_benchmark(visualizer, source, args.benchmark_seconds)
+        if shm_sink is not None:
+            shm_sink.close()
+        if recorder is not None:
+            recorder.close()
+        return
     
     visualizer.connect_mqtt()
     visualizer.start_audio_stream()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Audio input device listing for the backend's device dropdown.
+
+Starts fast by only importing sounddevice (not numpy or paho) and only when the cache is stale.
+The cache is keyed by a hotplug signature built from the ALSA card list and the /dev/snd nodes,
+so plugging a USB microphone in or out invalidates it.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+# Sample rates probed for every device, the default rate of the device is always included
+PROBE_SAMPLE_RATES = (8000, 16000, 22050, 32000, 44100, 48000, 96000)
+CACHE_VERSION = 1
+DEFAULT_CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                                  "protogen", "audio-devices.json")
+HOTPLUG_SOURCES = ("/proc/asound/cards", "/proc/asound/devices")
+DEVICE_NODE_DIR = "/dev/snd"
+
+
+def hotplug_signature():
+    """Hash of the sound hardware currently present, None if it can not be determined (no ALSA)"""
+    digest = hashlib.sha1()
+    found = False
+    for path in HOTPLUG_SOURCES:
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+            found = True
+        except OSError:
+            pass
+    try:
+        digest.update("\n".join(sorted(os.listdir(DEVICE_NODE_DIR))).encode())
+        found = True
+    except OSError:
+        pass
+    if not found:
+        return None
+    # A different interpreter (venv) may come with a different PortAudio build
+    digest.update(sys.executable.encode())
+    return digest.hexdigest()
+
+
+def query_input_devices():
+    """Enumerate input devices through PortAudio, probing the supported sample rates"""
+    import sounddevice as sd
+
+    try:
+        default_input = sd.default.device[0]
+    except Exception:
+        default_input = None
+    devices = []
+    for index, dev in enumerate(sd.query_devices()):
+        channels = int(dev["max_input_channels"])
+        if channels <= 0:
+            continue
+        default_rate = int(dev["default_samplerate"])
+        rates = []
+        for rate in sorted(set(PROBE_SAMPLE_RATES) | {default_rate}):
+            try:
+                sd.check_input_settings(device=index, channels=1, samplerate=rate)
+                rates.append(rate)
+            except Exception:
+                pass
+        devices.append({
+            "index": index,
+            "name": dev["name"],
+            "channels": channels,
+            "sampleRate": default_rate,
+            "sampleRates": rates,
+            "default": index == default_input,
+        })
+    return devices
+
+
+def load_cache(path: str, signature: str):
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get("version") != CACHE_VERSION or cache.get("signature") != signature:
+        return None
+    return cache.get("devices")
+
+
+def save_cache(path: str, signature: str, devices):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write and rename, so a concurrent reader never sees a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "signature": signature, "devices": devices}, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write device cache {path}: {e}", file=sys.stderr)
+
+
+def list_input_devices(cache_path=DEFAULT_CACHE_PATH, refresh: bool = False):
+    """Return (devices, cached), using the cache while the hotplug signature is unchanged"""
+    signature = hotplug_signature() if cache_path else None
+    if signature is not None and not refresh:
+        devices = load_cache(cache_path, signature)
+        if devices is not None:
+            return devices, True
+    devices = query_input_devices()
+    if signature is not None:
+        save_cache(cache_path, signature, devices)
+    return devices, False
+
+
+def print_devices(devices):
+    """Human readable listing (the format of audio_listener.py --list-devices)"""
+    for dev in devices:
+        print(f"Device {dev['index']}: {dev['name']}")
+        print(f"  Sample Rate: {dev['sampleRate']} Hz")
+        print(f"  Input Channels: {dev['channels']}")
+        print(f"  Supported Sample Rates: {', '.join(str(rate) for rate in dev['sampleRates'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List audio input devices")
+    parser.add_argument("--json", action="store_true", help="Print the devices as JSON")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cache and query PortAudio")
+    parser.add_argument("--cache", type=str, default=DEFAULT_CACHE_PATH, help="Cache file ('' disables the cache)")
+    args = parser.parse_args()
+
+    try:
+        devices, cached = list_input_devices(args.cache, args.refresh)
+    except Exception as e:
+        if args.json:
+            print(json.dumps({"error": str(e)}))
+        else:
+            print(f"Error listing devices: {e}")
+        sys.exit(1)
+    if args.json:
+        print(json.dumps({"devices": devices, "cached": cached}))
+    else:
+        print_devices(devices)
+
+
+if __name__ == "__main__":
+    main()
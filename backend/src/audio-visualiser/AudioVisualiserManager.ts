@@ -7,8 +7,32 @@ import { SocketMessageType } from "../webserver/socket/SocketMessageType";
 const DATA_TOPIC = "protogen/audio-visualizer/data";
 const CONFIG_TOPIC = "protogen/audio-visualizer/config";
 
+// Payload format requested from the listener. Both formats are always accepted on the data topic,
+// the binary layout is documented in audio_visualizer/readme.md
+const DATA_FORMAT: AudioVisualizerDataFormat = "binary";
+const JSON_FIRST_BYTE = 0x7b; // "{"
+// Header size per binary format version, version 2 added the capture to publish latency,
+// version 3 the tempo, its confidence and the next beat prediction
+const BINARY_HEADER_SIZES: Record<number, number> = { 1: 16, 2: 20, 3: 28 };
+const BINARY_FLAG_BEAT = 0x01;
+const BINARY_FLAG_WIDE = 0x02;
+const BINARY_FLAG_BARS = 0x04;
+const BINARY_FLAG_CHANNELS = 0x08;
+const BAND_NAMES = ["sub_bass", "bass", "low_mids", "mids", "high_mids", "highs", "presence"] as const;
+
+export type AudioVisualizerDataFormat = "json" | "binary" | "binary16";
+
+export interface AudioVisualizerChannelData {
+  intensity: number;
+  bands: AudioVisualizerData["bands"];
+  beat: boolean;
+}
+
 export interface AudioVisualizerData {
+  /** Capture time of the newest audio sample in the frame (unix seconds) */
   timestamp: number;
+  /** Milliseconds between capture and publish */
+  latency?: number;
   intensity: number;
   bands: {
     sub_bass: number;
@@ -20,6 +44,18 @@ export interface AudioVisualizerData {
     presence: number;
   };
   beat: boolean;
+  /** Estimated tempo in beats per minute, 0 while unknown */
+  bpm?: number;
+  /** How periodic the recent onsets are (0-1) */
+  confidence?: number;
+  /** Predicted time of the next beat (unix seconds), null while the tempo is unknown */
+  nextBeat?: number | null;
+  /** Per input channel values when the listener analyses several channels */
+  channels?: AudioVisualizerChannelData[];
+  /** Loudness balance of the first two channels, -1 (left) to 1 (right) */
+  balance?: number;
+  /** Share of the side signal in the stereo image (0-1) */
+  width?: number;
 }
 
 export interface AudioVisualizerConfig {
@@ -35,7 +71,9 @@ export class AudioVisualiserManager {
   private _config: AudioVisualizerConfig;
   private _latestData: AudioVisualizerData | null = null;
   private _isRunning = false;
+  private _warnedAboutBars = false;
   private readonly _pythonScriptPath: string;
+  private readonly _deviceListScriptPath: string;
   private readonly _pythonExecutable: string;
 
   constructor(protogen: Protogen) {
@@ -51,6 +89,7 @@ export class AudioVisualiserManager {
     const venvPython = pathResolve("../audio_visualizer/venv/bin/python3");
     this._pythonExecutable = existsSync(venvPython) ? venvPython : "python3";
     this._pythonScriptPath = pathResolve("../audio_visualizer/audio_listener.py");
+    this._deviceListScriptPath = pathResolve("../audio_visualizer/list_devices.py");
   }
 
   public get protogen(): Protogen {
@@ -76,7 +115,15 @@ export class AudioVisualiserManager {
     // Subscribe to MQTT audio data
     this._protogen.mqttManager.subscribe(DATA_TOPIC, (topic, message) => {
       try {
-        const data = JSON.parse(message.toString()) as AudioVisualizerData;
+        const data = this.decodeData(message);
+        if (data === null) {
+          // Filterbank bars (--bands) are meant for LED bar graphs, the backend uses the named bands
+          if (!this._warnedAboutBars) {
+            this._warnedAboutBars = true;
+            this._protogen.logger.warn("AudioVisualiser", "Ignoring audio frames with filterbank bars instead of the named bands, is the listener running with --bands?");
+          }
+          return;
+        }
         //console.debug("got data:", data);
         this._latestData = data;
 
@@ -117,6 +164,7 @@ export class AudioVisualiserManager {
       "--mqtt-port", String(this._protogen.config.mqtt.port),
       "--mqtt-topic", DATA_TOPIC,
       "--mqtt-config-topic", CONFIG_TOPIC,
+      "--format", DATA_FORMAT,
     ];
 
     if (this._config.deviceIndex !== null) {
@@ -195,7 +243,6 @@ export class AudioVisualiserManager {
   }
 
   public async updateConfig(config: Partial<AudioVisualizerConfig>): Promise<void> {
-    const needsRestart = config.deviceIndex !== undefined && config.deviceIndex !== this._config.deviceIndex;
     const wasEnabled = this._config.enabled;
 
     // Update config
@@ -224,47 +271,48 @@ export class AudioVisualiserManager {
         await this.stop();
       }
     } else if (this._isRunning) {
-      // If already running, handle config changes
-      if (needsRestart) {
-        // Device change requires restart
-        await this.stop();
-        if (this._config.enabled) {
-          await this.start();
-        }
-      } else {
-        // Push live config update via MQTT
-        this._protogen.mqttManager.publish(CONFIG_TOPIC, JSON.stringify({
-          lowThreshold: this._config.lowThreshold,
-          intensity: this._config.intensity,
-          enabled: this._config.enabled,
-        }));
-      }
+      // Push live config update via MQTT, the listener switches devices in place without a restart
+      this._protogen.mqttManager.publish(CONFIG_TOPIC, JSON.stringify({
+        lowThreshold: this._config.lowThreshold,
+        intensity: this._config.intensity,
+        enabled: this._config.enabled,
+        deviceIndex: this._config.deviceIndex,
+        format: DATA_FORMAT,
+      }));
     }
   }
 
   public async listAudioDevices(): Promise<AudioDevice[]> {
     return new Promise((resolvePromise, rejectPromise) => {
-      const process = spawn(this._pythonExecutable, [this._pythonScriptPath, "--list-devices"], {
+      // list_devices.py skips the heavy imports of the listener and answers from a cache until
+      // the sound hardware changes
+      const process = spawn(this._pythonExecutable, [this._deviceListScriptPath, "--json"], {
         cwd: pathResolve("../audio_visualizer"),
       });
 
       let output = "";
+      let errorOutput = "";
 
       process.stdout?.on("data", (data: Buffer) => {
         output += data.toString();
       });
 
       process.stderr?.on("data", (data: Buffer) => {
-        output += data.toString();
+        errorOutput += data.toString();
       });
 
       process.on("exit", (code: number | null) => {
-        if (code === 0) {
-          // Parse device list from output
-          const devices = this.parseDeviceList(output);
-          resolvePromise(devices);
+        let result: DeviceListOutput;
+        try {
+          result = JSON.parse(output) as DeviceListOutput;
+        } catch (err) {
+          rejectPromise(new Error("Failed to list audio devices: " + (errorOutput.trim() || "invalid output")));
+          return;
+        }
+        if (code === 0 && result.devices) {
+          resolvePromise(result.devices);
         } else {
-          rejectPromise(new Error("Failed to list audio devices"));
+          rejectPromise(new Error("Failed to list audio devices: " + (result.error ?? "exit code " + code)));
         }
       });
 
@@ -274,40 +322,79 @@ export class AudioVisualiserManager {
     });
   }
 
-  private parseDeviceList(output: string): AudioDevice[] {
-    const devices: AudioDevice[] = [];
-    const lines = output.split("\n");
-
-    let currentDevice: Partial<AudioDevice> | null = null;
-
-    for (const line of lines) {
-      const deviceMatch = line.match(/^Device (\d+): (.+)$/);
-      if (deviceMatch) {
-        if (currentDevice && currentDevice.index !== undefined) {
-          devices.push(currentDevice as AudioDevice);
-        }
-        currentDevice = {
-          index: parseInt(deviceMatch[1]),
-          name: deviceMatch[2].trim(),
-        };
-      } else if (currentDevice) {
-        const sampleRateMatch = line.match(/Sample Rate: (\d+) Hz/);
-        if (sampleRateMatch) {
-          currentDevice.sampleRate = parseInt(sampleRateMatch[1]);
-        }
+  /** Decode a data payload, returns null for frames that carry filterbank bars instead of the named bands */
+  private decodeData(message: Buffer): AudioVisualizerData | null {
+    // JSON payloads always start with "{", binary payloads with the format version byte
+    if (message.length === 0 || message[0] === JSON_FIRST_BYTE) {
+      const data = JSON.parse(message.toString()) as AudioVisualizerData;
+      return data.bands ? data : null;
+    }
 
-        const channelsMatch = line.match(/Input Channels: (\d+)/);
-        if (channelsMatch) {
-          currentDevice.channels = parseInt(channelsMatch[1]);
-        }
-      }
+    const version = message.readUInt8(0);
+    const headerSize = BINARY_HEADER_SIZES[version];
+    if (headerSize === undefined) {
+      throw new Error("Unsupported binary audio frame version " + version);
     }
 
-    if (currentDevice && currentDevice.index !== undefined) {
-      devices.push(currentDevice as AudioDevice);
+    const flags = message.readUInt8(1);
+    const valueCount = message.readUInt8(2);
+    const wide = (flags & BINARY_FLAG_WIDE) !== 0;
+    if ((flags & BINARY_FLAG_BARS) !== 0) {
+      return null;
+    }
+    const valueSize = wide ? 2 : 1;
+    if (valueCount < BAND_NAMES.length + 1 || message.length < headerSize + valueCount * valueSize) {
+      throw new Error("Truncated binary audio frame");
     }
 
-    return devices;
+    const readValue = (index: number, start: number = headerSize): number => {
+      const offset = start + index * valueSize;
+      return wide ? message.readUInt16LE(offset) / 65535 : message.readUInt8(offset) / 255;
+    };
+    const readBands = (first: number, start: number = headerSize): AudioVisualizerData["bands"] => {
+      const bands = {} as AudioVisualizerData["bands"];
+      BAND_NAMES.forEach((name, i) => {
+        bands[name] = readValue(first + i, start);
+      });
+      return bands;
+    };
+
+    const timestamp = message.readDoubleLE(8);
+    const data: AudioVisualizerData = {
+      timestamp: timestamp,
+      latency: version >= 2 ? message.readFloatLE(16) : undefined,
+      intensity: readValue(0),
+      bands: readBands(1),
+      beat: (flags & BINARY_FLAG_BEAT) !== 0,
+    };
+    if (version >= 3) {
+      const nextBeatOffset = message.readFloatLE(24);
+      data.bpm = message.readFloatLE(20);
+      data.confidence = message.readUInt8(3) / 255;
+      data.nextBeat = Number.isNaN(nextBeatOffset) ? null : timestamp + nextBeatOffset / 1000;
+    }
+    if ((flags & BINARY_FLAG_CHANNELS) !== 0) {
+      // Channel count, beat bitmask, then intensity and bands per channel, balance and width
+      const sectionStart = headerSize + valueCount * valueSize;
+      const channelCount = message.readUInt8(sectionStart);
+      const beatMask = message.readUInt8(sectionStart + 1);
+      const start = sectionStart + 2;
+      if (message.length < start + (channelCount * valueCount + 2) * valueSize) {
+        throw new Error("Truncated binary audio frame channel section");
+      }
+      data.channels = [];
+      for (let channel = 0; channel < channelCount; channel++) {
+        const first = channel * valueCount;
+        data.channels.push({
+          intensity: readValue(first, start),
+          bands: readBands(first + 1, start),
+          beat: (beatMask & (1 << channel)) !== 0,
+        });
+      }
+      data.balance = readValue(channelCount * valueCount, start) * 2 - 1;
+      data.width = readValue(channelCount * valueCount + 1, start);
+    }
+    return data;
   }
 
   private async loadConfigFromDatabase(): Promise<void> {
@@ -352,6 +439,18 @@ export class AudioVisualiserManager {
 export interface AudioDevice {
   index: number;
   name: string;
+  /** Default sample rate of the device */
   sampleRate?: number;
+  /** Sample rates the device accepts for capture */
+  sampleRates?: number[];
   channels?: number;
+  /** Whether this is the system default input */
+  default?: boolean;
+}
+
+/** Output of list_devices.py --json */
+interface DeviceListOutput {
+  devices?: AudioDevice[];
+  cached?: boolean;
+  error?: string;
 }
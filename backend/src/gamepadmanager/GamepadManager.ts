@@ -2,7 +2,7 @@ import { uuidv7 } from "uuidv7";
 import { Protogen } from "../Protogen";
 import { KV_ActiveGamepadProfile, KV_GamepadEnablePreview, KV_GamepadType } from "../utils/KVDataStorageKeys";
 import { SocketMessageType } from "../webserver/socket/SocketMessageType";
-import { GamepadAxes, GamepadAxesMessage, GamepadButtons, GamepadButtonMessage, GamepadState, GamepadStatusMessage, GamepadActionTriggers } from "./GamepadState";
+import { GamepadAxes, GamepadAxesMessage, GamepadButtons, GamepadButtonMessage, GamepadState, GamepadStatusMessage, GamepadActionTriggers, GamepadFrame } from "./GamepadState";
 import { GamepadProfile } from "../database/models/gamepad/GamepadProfile.model";
 import { ActionType } from "../actions/ActionType";
 import { FaceRendererId } from "../visor/rendering/renderers/special/face/VisorFaceRender";
@@ -12,6 +12,20 @@ import { execAsync } from "../utils/SystemUtils";
 const TOPIC_STATUS = "protogen/gamepad/status";
 const TOPIC_BUTTON = "protogen/gamepad/button";
 const TOPIC_AXES = "protogen/gamepad/axes";
+const TOPIC_FRAME = "protogen/gamepad/frame";
+
+// Wire format the gamepad listener is configured for, the binary frame layout is documented
+// in gamepad_listener/gamepad_listener.py (FRAME_HEADER)
+const DATA_FORMAT: GamepadDataFormat = "binary";
+const FRAME_VERSION = 1;
+const FRAME_HEADER_SIZE = 16;
+const FRAME_AXIS_SIZE = 3;
+const FRAME_FLAG_KEYFRAME = 0x01;
+const FRAME_AXIS_SCALE = 32767;
+const FRAME_BUTTONS = ["A", "B", "X", "Y", "LB", "RB", "LT", "RT", "SELECT", "START", "HOME", "LS", "RS"];
+const FRAME_AXES = ["LEFT_X", "LEFT_Y", "RIGHT_X", "RIGHT_Y", "LT", "RT", "DPAD_X", "DPAD_Y"];
+
+export type GamepadDataFormat = "json" | "binary";
 
 const GAMEPAD_CONFIG_PATH = "/home/pi/protogen/gamepad_config.json";
 
@@ -50,6 +64,9 @@ export class GamepadManager {
   private _rtActive: boolean = false;
   private _dpadXActive: number = 0;
   private _dpadYActive: number = 0;
+  // Sequence number of the newest binary frame, null until the first frame after a status change
+  private _lastFrameSequence: number | null = null;
+  private _lostFrames: number = 0;
 
   private static readonly DEFAULT_BUTTONS: GamepadButtons = {
     A: false, B: false, X: false, Y: false,
@@ -81,6 +98,8 @@ export class GamepadManager {
         const data: GamepadStatusMessage = JSON.parse(message.toString());
         this._state.connected = data.connected;
         this._state.name = data.name;
+        // A (re)started listener counts its frames from 0 again
+        this._lastFrameSequence = null;
         if (!data.connected) {
           this._state.buttons = { ...GamepadManager.DEFAULT_BUTTONS };
           this._state.axes = { ...GamepadManager.DEFAULT_AXES };
@@ -95,37 +114,46 @@ export class GamepadManager {
     mqtt.subscribe(TOPIC_BUTTON, (_topic, message) => {
       try {
         const data: GamepadButtonMessage = JSON.parse(message.toString());
-        const key = data.name as keyof GamepadButtons;
-        if (key in this._state.buttons) {
-          this._state.buttons[key] = data.pressed;
-        }
         this.markConnected();
-        if (data.pressed) {
-          void this.triggerButtonAction(data.name);
-        }
+        this.handleButton(data.name, data.pressed);
       } catch (e) {
         console.error(e);
         this.protogen.logger.error("GamepadManager", "Failed to parse gamepad button message");
       }
     });
 
-    mqtt.subscribe(TOPIC_AXES, (_topic, message) => {
+    mqtt.subscribe(TOPIC_AXES, (_topic, message, packet) => {
       try {
+        if (message.length === 0) {
+          // Retained keyframe cleared by a disconnecting controller
+          return;
+        }
         const data: GamepadAxesMessage = JSON.parse(message.toString());
-        const axes = data.axes as Record<string, number>;
-        for (const [key, value] of Object.entries(axes)) {
-          if (key in this._state.axes) {
-            this._state.axes[key as keyof GamepadAxes] = value;
-          }
+        // Keyframes (retained ones arrive on every subscribe) restate the state, only live updates
+        // prove that a controller is attached
+        if (!packet.retain && !data.keyframe) {
+          this.markConnected();
         }
-        this.markConnected();
-        this.processAxesActions(axes);
+        this.handleAxes(data.axes as Record<string, number>);
       } catch (e) {
         console.error(e);
         this.protogen.logger.error("GamepadManager", "Failed to parse gamepad axes message");
       }
     });
 
+    mqtt.subscribe(TOPIC_FRAME, (_topic, message, packet) => {
+      try {
+        if (message.length === 0) {
+          // Retained keyframe cleared by a disconnecting controller
+          return;
+        }
+        this.handleFrame(this.decodeFrame(message), packet.retain);
+      } catch (e) {
+        console.error(e);
+        this.protogen.logger.error("GamepadManager", "Failed to parse gamepad frame");
+      }
+    });
+
     this.protogen.logger.info("GamepadManager", "Subscribed to gamepad MQTT topics");
 
     setInterval(() => {
@@ -170,6 +198,98 @@ export class GamepadManager {
     }
   }
 
+  private handleButton(name: string, pressed: boolean): void {
+    const key = name as keyof GamepadButtons;
+    if (key in this._state.buttons) {
+      this._state.buttons[key] = pressed;
+    }
+    if (pressed) {
+      void this.triggerButtonAction(name);
+    }
+  }
+
+  private handleAxes(axes: Record<string, number>): void {
+    for (const [key, value] of Object.entries(axes)) {
+      if (key in this._state.axes) {
+        this._state.axes[key as keyof GamepadAxes] = value;
+      }
+    }
+    this.processAxesActions(axes);
+  }
+
+  private decodeFrame(message: Buffer): GamepadFrame {
+    if (message.length < FRAME_HEADER_SIZE) {
+      throw new Error("Truncated gamepad frame");
+    }
+    const version = message.readUInt8(0);
+    if (version !== FRAME_VERSION) {
+      throw new Error("Unsupported gamepad frame version " + version);
+    }
+    const axisCount = message.readUInt8(2);
+    if (message.length < FRAME_HEADER_SIZE + axisCount * FRAME_AXIS_SIZE) {
+      throw new Error("Truncated gamepad frame");
+    }
+    const axes: Record<string, number> = {};
+    for (let i = 0; i < axisCount; i++) {
+      const offset = FRAME_HEADER_SIZE + i * FRAME_AXIS_SIZE;
+      const name = FRAME_AXES[message.readUInt8(offset)];
+      if (name !== undefined) {
+        axes[name] = Math.round(message.readInt16LE(offset + 1) / FRAME_AXIS_SCALE * 10000) / 10000;
+      }
+    }
+    return {
+      keyframe: (message.readUInt8(1) & FRAME_FLAG_KEYFRAME) !== 0,
+      sequence: message.readUInt32LE(4),
+      time: message.readUInt32LE(8),
+      buttons: message.readUInt16LE(12),
+      pressed: message.readUInt16LE(14),
+      axes: axes,
+    };
+  }
+
+  private handleFrame(frame: GamepadFrame, retained: boolean): void {
+    // Frames older than the newest one only contribute their button presses, their state is outdated
+    let stale = false;
+    if (retained) {
+      // Replayed by the broker on subscribe, its sequence number is from whenever it was published
+      this._lastFrameSequence = null;
+    } else if (!frame.keyframe && this._lastFrameSequence !== null) {
+      const distance = (frame.sequence - this._lastFrameSequence) >>> 0;
+      if (distance === 0 || distance >= 0x80000000) {
+        stale = true;
+      } else if (distance > 1) {
+        this._lostFrames += distance - 1;
+        this.protogen.logger.warn("GamepadManager", `Lost ${distance - 1} gamepad frame(s), ${this._lostFrames} in total`);
+      }
+    }
+    if (!stale && !retained) {
+      this._lastFrameSequence = frame.sequence;
+    }
+
+    // Keyframes (retained ones arrive on every subscribe) restate the state, only live frames
+    // prove that a controller is attached
+    if (!retained && !frame.keyframe) {
+      this.markConnected();
+    }
+    // Axes first, a stick click acts on the stick direction
+    if (!stale && Object.keys(frame.axes).length > 0) {
+      this.handleAxes(frame.axes);
+    }
+    FRAME_BUTTONS.forEach((name, bit) => {
+      const mask = 1 << bit;
+      const pressed = (frame.pressed & mask) !== 0;
+      if (!stale) {
+        const key = name as keyof GamepadButtons;
+        if (key in this._state.buttons) {
+          this._state.buttons[key] = (frame.buttons & mask) !== 0;
+        }
+      }
+      if (pressed) {
+        void this.triggerButtonAction(name);
+      }
+    });
+  }
+
   public get state(): Readonly<GamepadState> {
     return this._state;
   }
@@ -244,7 +364,7 @@ export class GamepadManager {
   }
 
   private async writeGamepadConfig(type: GamepadType): Promise<void> {
-    const config = { steam_controller: type === GamepadType.STEAM_CONTROLLER };
+    const config = { steam_controller: type === GamepadType.STEAM_CONTROLLER, format: DATA_FORMAT };
     await writeFile(GAMEPAD_CONFIG_PATH, JSON.stringify(config, null, 2), "utf-8");
     this.protogen.logger.info("GamepadManager", `Wrote gamepad config for type: ${type}`);
   }
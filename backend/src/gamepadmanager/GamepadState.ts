@@ -61,14 +61,27 @@ export interface GamepadAxes {
 export interface GamepadStatusMessage {
   connected: boolean;
   name: string;
+  device?: string;
 }
 
 export interface GamepadButtonMessage {
   code: string;
   name: string;
   pressed: boolean;
+  device?: string;
 }
 
 export interface GamepadAxesMessage {
   axes: Record<string, number>;
+  device?: string;
+  keyframe?: boolean;
+}
+
+export interface GamepadFrame {
+  keyframe: boolean;
+  sequence: number;
+  time: number;
+  buttons: number;
+  pressed: number;
+  axes: Record<string, number>;
 }
@@ -38,7 +38,7 @@ export class MqttManager {
     });
   }
 
-  public subscribe(topic: string, callback: (topic: string, message: Buffer) => void): void {
+  public subscribe(topic: string, callback: (topic: string, message: Buffer, packet: mqtt.IPublishPacket) => void): void {
     if (!this._client) {
       throw new Error("MQTT client not initialized");
     }
@@ -47,9 +47,9 @@ export class MqttManager {
         this._protogen.logger.error("MqttManager", "Failed to subscribe to " + topic + ": " + err.message);
       }
     });
-    this._client.on("message", (t, msg) => {
+    this._client.on("message", (t, msg, packet) => {
       if (t === topic || this._topicMatches(topic, t)) {
-        callback(t, msg);
+        callback(t, msg, packet);
       }
     });
   }
@@ -228,6 +228,9 @@ export class AudioReactiveEffect extends AbstractRgbEffect {
 
   private renderFrequencySpectrum(data: any, time: number, customWidth: number): number[] {
     const colors: number[] = [];
+    if (!data.bands) {
+      return new Array(customWidth).fill(0);
+    }
     const bands = [
       data.bands.sub_bass,
       data.bands.bass,
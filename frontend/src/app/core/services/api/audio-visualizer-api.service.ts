@@ -63,5 +63,7 @@ export interface AudioDevice {
   index: number;
   name: string;
   sampleRate?: number;
+  sampleRates?: number[];
   channels?: number;
+  default?: boolean;
 }
@@ -2,13 +2,27 @@
 """
 Gamepad Listener Service for Protogen.
 
-Listens for the primary gamepad via piborg/Gamepad library and publishes
-state changes over MQTT to be consumed by the Node.js backend GamepadManager.
+Reads every connected gamepad through the Linux joystick API (/dev/input/jsN) and
+publishes state changes over MQTT to be consumed by the Node.js backend GamepadManager.
+The main loop waits on the devices with select/epoll, so idle controllers cost no wakeups,
+and new device nodes are picked up through an inotify watch on /dev/input.
 
-Topics:
-  protogen/gamepad/status  - JSON: {"connected": bool, "name": str}
-  protogen/gamepad/button  - JSON: {"code": str, "name": str, "pressed": bool}
-  protogen/gamepad/axes    - JSON: {"axes": {name: value, ...}}
+Topics of the primary controller (js0), the one the backend follows:
+  protogen/gamepad/status  - JSON: {"connected": bool, "name": str, "device": str}
+  protogen/gamepad/button  - JSON: {"code": str, "name": str, "pressed": bool, "device": str}
+  protogen/gamepad/axes    - JSON: {"axes": {name: value, ...}, "device": str}, only the axes that changed,
+                             plus a retained keyframe with every axis while the pad is in use ("keyframe": true),
+                             cleared (empty retained payload) when the pad disconnects
+  protogen/gamepad/frame   - binary frames replacing button and axes with --format binary (layout at FRAME_HEADER),
+                             the retained keyframe is cleared like the axes one
+Further controllers publish the same messages on protogen/gamepad/jsN/{status,button,axes,frame}.
+
+Input can be recorded with --record and fed back through the same handlers with --replay (to the
+broker given with --mqtt-host/--mqtt-port), --benchmark replays a log or synthetic input without MQTT.
+
+Axis filters and per-device mappings can be tuned in the config file, e.g.
+  {"keyframe_interval": 2.0, "axes": {"LEFT_X": {"deadzone": 0.1, "step": 0.01, "threshold": 0.02}},
+   "devices": {"js1": "steam", "Xbox Wireless Controller": "xbox"}, "format": "binary"}
 """
 
 import json
@@ -17,12 +31,20 @@ import sys
 import time
 import os
 import argparse
+import ctypes
+import errno
+import fcntl
+import math
+import random
+import re
+import selectors
+import struct
 
-# Add the Gamepad submodule to the path
-sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "Gamepad"))
-import Gamepad as GamepadLib
+# Add the shared Python modules to the path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "python_common"))
 
 import paho.mqtt.client as mqtt
+from mqtt_publisher import CoalescingPublisher, NullMqttClient
 
 MQTT_HOST = "127.0.0.1"
 MQTT_PORT = 1883
@@ -30,14 +52,67 @@ MQTT_PORT = 1883
 TOPIC_STATUS = "protogen/gamepad/status"
 TOPIC_BUTTON = "protogen/gamepad/button"
 TOPIC_AXES = "protogen/gamepad/axes"
+TOPIC_FRAME = "protogen/gamepad/frame"
 
 AXIS_SEND_INTERVAL = 0.05  # 50ms throttle for joystick axes only
-JOYSTICK_NUMBER = 0
+KEYFRAME_INTERVAL = 2.0  # full axis state (retained) this long after the first change since the previous keyframe
+RECONNECT_INTERVAL = 1.0  # device scan interval without inotify, and retry delay for nodes that failed to open
+JOYSTICK_NUMBER = 0  # the primary controller, published on the topics above
+INPUT_DIR = "/dev/input"
+JOYSTICK_PATH = "/dev/input/js{}"
+JOYSTICK_NODE = re.compile(r"js(\d+)$")
+TOPIC_DEVICE_PREFIX = "protogen/gamepad/js{}"
+
+# Wire formats: JSON messages per button edge and axis update, or one binary frame per flush.
+# Binary frames are little endian: version (uint8), flags (uint8), axis entry count (uint8), reserved (uint8),
+# sequence number (uint32, per device, counts every frame), kernel timestamp of the newest event (uint32, ms),
+# button state bitmask (uint16, bits in FRAME_BUTTONS order), buttons pressed since the previous frame (uint16),
+# then per changed axis: index in FRAME_AXES (uint8), value (int16, scaled by AXIS_SCALE, triggers 0 to 1)
+DATA_FORMATS = ("json", "binary")
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<BBBxIIHH")
+FRAME_AXIS = struct.Struct("<Bh")
+FRAME_FLAG_KEYFRAME = 0x01  # every axis and the button state, retained
+FRAME_BUTTONS = ("A", "B", "X", "Y", "LB", "RB", "LT", "RT", "SELECT", "START", "HOME", "LS", "RS")
+FRAME_AXES = ("LEFT_X", "LEFT_Y", "RIGHT_X", "RIGHT_Y", "LT", "RT", "DPAD_X", "DPAD_Y")
+FRAME_BUTTON_BITS = {name: 1 << i for i, name in enumerate(FRAME_BUTTONS)}
+FRAME_AXIS_INDICES = {name: i for i, name in enumerate(FRAME_AXES)}
+
+# Event logs (--record): header, then records of offset since the start of the recording (float64, seconds),
+# kind (uint8), joystick number (uint8) and payload length (uint16), followed by the payload:
+#   EVENT_LOG_EVENTS     - the raw js_event structs of one read
+#   EVENT_LOG_CONNECT    - axis count (uint8), button count (uint8), device name (utf-8)
+#   EVENT_LOG_DISCONNECT - empty
+EVENT_LOG_MAGIC = b"PGJR"
+EVENT_LOG_VERSION = 1
+EVENT_LOG_HEADER = struct.Struct("<4sHH")
+EVENT_LOG_RECORD = struct.Struct("<dBBH")
+EVENT_LOG_DEVICE = struct.Struct("<BB")
+EVENT_LOG_EVENTS = 0
+EVENT_LOG_CONNECT = 1
+EVENT_LOG_DISCONNECT = 2
+
+# inotify (linux/inotify.h), device nodes show up with IN_CREATE and become readable with IN_ATTRIB once udev set the permissions
+INOTIFY_EVENT = struct.Struct("<iIII")  # wd, mask, cookie, len, followed by the name
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Linux joystick API (linux/joystick.h): struct js_event {u32 time_ms; s16 value; u8 type; u8 number}
+JS_EVENT = struct.Struct("<IhBB")
+JS_EVENT_BUTTON = 0x01
+JS_EVENT_AXIS = 0x02
+JS_EVENT_INIT = 0x80  # synthetic events with the initial state, sent right after opening
+JSIOCGAXES = 0x80016A11
+JSIOCGBUTTONS = 0x80016A12
+JSIOCGNAME_BASE = 0x80006A13  # | (length << 16)
+AXIS_SCALE = 32767.0
 
-# Axes that should be sent immediately (no throttle)
+# Axes that should be sent immediately (no throttle), the others are throttled
 IMMEDIATE_AXES = {"LT", "RT"}
-# Axes that are throttled
-THROTTLED_AXES = {"LEFT_X", "LEFT_Y", "RIGHT_X", "RIGHT_Y", "DPAD_X", "DPAD_Y"}
 
 # Xbox-style button name mapping (xpadneo / Xbox ONE layout)
 BUTTON_NAMES = {
@@ -97,93 +172,430 @@ STEAM_CONTROLLER_AXIS_NAMES = {
 
 STEAM_CONTROLLER_IMMEDIATE_AXES = {"LT", "RT"}
 
+# Button/axis mappings that can be selected per device
+MAPPINGS = {
+    "xbox": (BUTTON_NAMES, AXIS_NAMES, IMMEDIATE_AXES),
+    "steam": (STEAM_CONTROLLER_BUTTON_NAMES, STEAM_CONTROLLER_AXIS_NAMES, STEAM_CONTROLLER_IMMEDIATE_AXES),
+}
+
+# Axis filtering, applied to the remapped value: readings inside the deadzone are 0 (the rest is
+# rescaled to keep the full range), then they are quantized to step and only published once they
+# moved by at least threshold (rest and end positions are always published)
+DEFAULT_AXIS_FILTER = {"deadzone": 0.0, "step": 0.01, "threshold": 0.02}
+DEFAULT_AXIS_FILTERS = {
+    "LEFT_X": {"deadzone": 0.08},
+    "LEFT_Y": {"deadzone": 0.08},
+    "RIGHT_X": {"deadzone": 0.08},
+    "RIGHT_Y": {"deadzone": 0.08},
+    "LT": {"deadzone": 0.02},
+    "RT": {"deadzone": 0.02},
+}
+
 
 def load_config(path: str) -> dict:
     """Load a JSON config file and return the parsed options."""
     with open(path, "r") as f:
         raw = json.load(f)
+    keyframe_interval = float(raw.get("keyframe_interval", KEYFRAME_INTERVAL))
+    if keyframe_interval <= 0:
+        raise ValueError("keyframe_interval must be positive")
+    axes = raw.get("axes", {})
+    if not isinstance(axes, dict):
+        raise ValueError("axes must map axis names to filter settings")
+    devices = raw.get("devices", {})
+    if not isinstance(devices, dict) or any(mapping not in MAPPINGS for mapping in devices.values()):
+        raise ValueError(f"devices must map device ids (js1) or names to one of {', '.join(MAPPINGS)}")
+    data_format = raw.get("format", "json")
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(DATA_FORMATS)}")
     return {
         "steam_controller": bool(raw.get("steam_controller", False)),
+        "device_mappings": devices,
+        "data_format": data_format,
+        "axis_filters": build_axis_filters(axes),
+        "keyframe_interval": keyframe_interval,
     }
 
 
-class GamepadListener:
-    def __init__(self, debug=False, steam_controller=False):
-        self._mqtt_client = mqtt.Client(
-            mqtt.CallbackAPIVersion.VERSION2,
-            client_id="gamepad_listener",
-        )
-        self._running = True
-        self._gamepad = None
-        self._throttled_dirty = False
-        self._immediate_dirty = False
+class AxisFilter:
+    """Deadzone, quantization step and change threshold of one axis."""
+
+    def __init__(self, deadzone: float = 0.0, step: float = 0.01, threshold: float = 0.02):
+        if not 0.0 <= deadzone < 1.0 or step < 0.0 or threshold < 0.0:
+            raise ValueError("axis filters need 0 <= deadzone < 1, step >= 0 and threshold >= 0")
+        self.deadzone = deadzone
+        self.step = step
+        self.threshold = threshold
+
+    def apply(self, value: float) -> float:
+        magnitude = abs(value)
+        if magnitude <= self.deadzone:
+            return 0.0
+        value = math.copysign(min(1.0, (magnitude - self.deadzone) / (1.0 - self.deadzone)), value)
+        if self.step > 0.0:
+            value = round(value / self.step) * self.step
+        return round(value, 4) + 0.0
+
+    def changed(self, value: float, last) -> bool:
+        if last is None:
+            return True
+        if value == last:
+            return False
+        return abs(value - last) >= self.threshold or value in (0.0, 1.0, -1.0)
+
+
+def build_axis_filters(overrides: dict) -> dict:
+    """Axis filters by name: the defaults, with the settings given per axis in the config on top"""
+    filters = {}
+    for name in set(DEFAULT_AXIS_FILTERS) | set(overrides):
+        settings = {**DEFAULT_AXIS_FILTER, **DEFAULT_AXIS_FILTERS.get(name, {}), **overrides.get(name, {})}
+        filters[name] = AxisFilter(float(settings["deadzone"]), float(settings["step"]), float(settings["threshold"]))
+    return filters
+
+
+class Joystick:
+    """Non-blocking reader for a Linux joystick device node."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            self.name = self._ioctl_name()
+            self.axis_count = self._ioctl_count(JSIOCGAXES)
+            self.button_count = self._ioctl_count(JSIOCGBUTTONS)
+        except OSError:
+            os.close(self._fd)
+            raise
+        # Current state by raw index, filled by the init events and kept up to date by read_events
+        self.buttons: dict = {}
+        self.axes: dict = {}
+        # Called with the raw js_event bytes of every read (--record)
+        self.on_data = None
+
+    def _ioctl_name(self) -> str:
+        buf = bytearray(128)
+        fcntl.ioctl(self._fd, JSIOCGNAME_BASE | (len(buf) << 16), buf)
+        return buf.split(b"\0", 1)[0].decode(errors="replace") or "Generic"
+
+    def _ioctl_count(self, request: int) -> int:
+        buf = bytearray(1)
+        fcntl.ioctl(self._fd, request, buf)
+        return buf[0]
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def read_events(self) -> list:
+        """Drain the pending events as (time_ms, type, number, value) with axis values scaled to -1..1.
+
+        Raises OSError (ENODEV) once the device is unplugged.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, JS_EVENT.size * 64)
+            except BlockingIOError:
+                break
+            if not data:
+                raise OSError(errno.ENODEV, "joystick closed")
+            data = data[:len(data) - len(data) % JS_EVENT.size]
+            if self.on_data is not None:
+                self.on_data(data)
+            events.extend(self._decode(data))
+        return events
+
+    def _decode(self, data: bytes) -> list:
+        events = []
+        for time_ms, value, event_type, number in JS_EVENT.iter_unpack(data):
+            if event_type & ~JS_EVENT_INIT == JS_EVENT_AXIS:
+                value = max(-1.0, value / AXIS_SCALE)
+                self.axes[number] = value
+            elif event_type & ~JS_EVENT_INIT == JS_EVENT_BUTTON:
+                value = value != 0
+                self.buttons[number] = value
+            events.append((time_ms, event_type, number, value))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+class ReplayJoystick(Joystick):
+    """Joystick fed from an event log instead of a device node."""
+
+    def __init__(self, path: str, name: str, axis_count: int, button_count: int):
+        self.path = path
+        self.name = name
+        self.axis_count = axis_count
+        self.button_count = button_count
+        self.buttons: dict = {}
+        self.axes: dict = {}
+        self.on_data = None
+        self._pending = bytearray()
+
+    def fileno(self) -> int:
+        return -1
+
+    def feed(self, data: bytes):
+        self._pending += data
+
+    def read_events(self) -> list:
+        data = bytes(self._pending)
+        self._pending.clear()
+        return self._decode(data)
+
+    def close(self):
+        pass
+
+
+class EventRecorder:
+    """Appends the raw events of every connected joystick to an event log."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self._started = time.monotonic()
+        self._file = open(path, "wb")
+        self._file.write(EVENT_LOG_HEADER.pack(EVENT_LOG_MAGIC, EVENT_LOG_VERSION, 0))
+
+    def _write(self, kind: int, number: int, payload: bytes = b""):
+        self._file.write(EVENT_LOG_RECORD.pack(time.monotonic() - self._started, kind, number, len(payload)) + payload)
+        self.records += 1
+
+    def connect(self, number: int, gamepad: Joystick):
+        name = gamepad.name.encode()[:255]
+        self._write(EVENT_LOG_CONNECT, number, EVENT_LOG_DEVICE.pack(gamepad.axis_count, gamepad.button_count) + name)
+
+    def events(self, number: int, data: bytes):
+        self._write(EVENT_LOG_EVENTS, number, data)
+
+    def disconnect(self, number: int):
+        self._write(EVENT_LOG_DISCONNECT, number)
+
+    def close(self):
+        self._file.close()
+
+
+def load_event_log(path: str) -> list:
+    """Read an event log as a list of (offset, kind, number, payload), a record cut short by a crash is ignored"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < EVENT_LOG_HEADER.size:
+        raise ValueError(f"{path} is not an event log")
+    magic, version, _ = EVENT_LOG_HEADER.unpack_from(data)
+    if magic != EVENT_LOG_MAGIC or version != EVENT_LOG_VERSION:
+        raise ValueError(f"{path} is not a version {EVENT_LOG_VERSION} event log")
+    records = []
+    offset = EVENT_LOG_HEADER.size
+    while offset + EVENT_LOG_RECORD.size <= len(data):
+        timestamp, kind, number, length = EVENT_LOG_RECORD.unpack_from(data, offset)
+        offset += EVENT_LOG_RECORD.size
+        if offset + length > len(data):
+            break
+        records.append((timestamp, kind, number, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+def synthetic_event_log(seconds: float, rate: float = 250.0, seed: int = 1) -> list:
+    """Event log of one controller: a circling left stick, sensor noise on the right stick,
+    trigger pulls and button mashing, read rate times per second"""
+    rnd = random.Random(seed)
+    axis_count, button_count = len(AXIS_NAMES), len(BUTTON_NAMES)
+    init = b"".join(JS_EVENT.pack(0, -32767 if axis in (2, 5) else 0, JS_EVENT_AXIS | JS_EVENT_INIT, axis)
+                    for axis in range(axis_count))
+    init += b"".join(JS_EVENT.pack(0, 0, JS_EVENT_BUTTON | JS_EVENT_INIT, button) for button in range(button_count))
+    records = [
+        (0.0, EVENT_LOG_CONNECT, 0, EVENT_LOG_DEVICE.pack(axis_count, button_count) + b"Synthetic Gamepad"),
+        (0.0, EVENT_LOG_EVENTS, 0, init),
+    ]
+    reads = int(seconds * rate)
+    for i in range(1, reads + 1):
+        offset = i / rate
+        time_ms = int(offset * 1000) & 0xFFFFFFFF
+        angle = math.pi * offset
+        events = [
+            JS_EVENT.pack(time_ms, int(29000 * math.cos(angle)), JS_EVENT_AXIS, 0),
+            JS_EVENT.pack(time_ms, int(29000 * math.sin(angle)), JS_EVENT_AXIS, 1),
+            JS_EVENT.pack(time_ms, rnd.randint(-1500, 1500), JS_EVENT_AXIS, rnd.choice((3, 4))),
+        ]
+        # Right trigger pulled for the second half of every second
+        if i % int(rate / 2) == 0:
+            events.append(JS_EVENT.pack(time_ms, 32767 if (i // int(rate / 2)) % 2 else -32767, JS_EVENT_AXIS, 5))
+        # A button edge every 40 ms
+        if i % max(1, int(rate / 25)) == 0:
+            button = rnd.randrange(4)
+            events.append(JS_EVENT.pack(time_ms, 1, JS_EVENT_BUTTON, button))
+            events.append(JS_EVENT.pack(time_ms + 1, 0, JS_EVENT_BUTTON, button))
+        records.append((offset, EVENT_LOG_EVENTS, 0, b"".join(events)))
+    records.append(((reads + 1) / rate, EVENT_LOG_DISCONNECT, 0, b""))
+    return records
+
+
+class HotplugWatcher:
+    """inotify watch on the input directory, reports the names of device nodes that appeared or changed."""
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_CREATE | IN_ATTRIB | IN_MOVED_TO) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, os.strerror(err), directory)
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def read_names(self):
+        """Drain the pending events, None if the kernel queue overflowed (rescan everything)"""
+        names = set()
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                if mask & IN_Q_OVERFLOW:
+                    names = None
+                elif names is not None:
+                    names.add(data[offset:offset + length].split(b"\0", 1)[0].decode(errors="replace"))
+                offset += length
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Controller:
+    """One connected controller: its device, mapping, topics and axis filter state."""
+
+    def __init__(self, gamepad: Joystick, number: int, publisher: CoalescingPublisher, mapping: str,
+                 axis_filters: dict, keyframe_interval: float, debug: bool = False, data_format: str = "json",
+                 clock=time.monotonic):
+        self.gamepad = gamepad
+        self.number = number
+        self.device = f"js{number}"
+        self._publisher = publisher
+        # Timer clock, a replay runs the controller on the clock of the recording
+        self.clock = clock
+        if number == JOYSTICK_NUMBER:
+            self.topic_status, self.topic_button, self.topic_axes = TOPIC_STATUS, TOPIC_BUTTON, TOPIC_AXES
+            self.topic_frame = TOPIC_FRAME
+        else:
+            prefix = TOPIC_DEVICE_PREFIX.format(number)
+            self.topic_status, self.topic_button, self.topic_axes = f"{prefix}/status", f"{prefix}/button", f"{prefix}/axes"
+            self.topic_frame = f"{prefix}/frame"
+        self.mapping = mapping
+        self._button_names, self._axis_names, self._immediate_axes = MAPPINGS[mapping]
+        # Reverse map: axis name -> raw id (for debug output)
+        self._axis_names_inv = {v: k for k, v in self._axis_names.items()}
+
+        # Axes whose filtered value changed since it was last published, by raw index
+        self._pending_throttled: set = set()
+        self._pending_immediate: set = set()
+        self._published_axes: dict = {}
+        self._axis_filters = axis_filters
+        self._default_axis_filter = AxisFilter(**DEFAULT_AXIS_FILTER)
+        self._keyframe_interval = keyframe_interval
         self._last_axis_send = 0.0
         self._debug = debug
         self._debug_last_axes: dict = {}
 
-        if steam_controller:
-            print("Using Steam Controller mapping", flush=True)
-            self._button_names = STEAM_CONTROLLER_BUTTON_NAMES
-            self._axis_names = STEAM_CONTROLLER_AXIS_NAMES
-            self._immediate_axes = STEAM_CONTROLLER_IMMEDIATE_AXES
-        else:
-            self._button_names = BUTTON_NAMES
-            self._axis_names = AXIS_NAMES
-            self._immediate_axes = IMMEDIATE_AXES
+        # Binary frame state, button edges and axis updates are collected until the next flush_frame
+        self._binary = data_format == "binary"
+        self._sequence = 0
+        self._event_time_ms = 0
+        self._button_mask = 0
+        self._frame_pressed = 0
+        self._frame_axes: dict = {}
+        self._frame_dirty = False
 
-        # Reverse map: axis name -> raw id (for debug output)
-        self._axis_names_inv = {v: k for k, v in self._axis_names.items()}
+        # Timers (time.monotonic deadlines, None when not armed)
+        self._flush_deadline = None
+        self._keyframe_deadline = None
 
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        # Register handlers by raw index
+        button_indices = list(range(gamepad.button_count))
+        axis_indices = list(range(gamepad.axis_count))
 
-    def _signal_handler(self, signum, frame):
-        print("Shutdown signal received", flush=True)
-        self._running = False
+        if self._debug:
+            print(f"Detected gamepad {self.device}: {gamepad.name} ({mapping} mapping)", flush=True)
+            print(f"Available buttons: {button_indices}", flush=True)
+            for btn_idx in button_indices:
+                btn_name = self._button_names.get(btn_idx, f"UNKNOWN_{btn_idx}")
+                print(f"  Button {btn_idx}: {btn_name}", flush=True)
+            print(f"Available axes: {axis_indices}", flush=True)
+            for axis_idx in axis_indices:
+                axis_name = self._axis_names.get(axis_idx, f"UNKNOWN_{axis_idx}")
+                print(f"  Axis {axis_idx}: {axis_name}", flush=True)
 
-    def start(self):
-        self._mqtt_client.connect(MQTT_HOST, MQTT_PORT)
-        self._mqtt_client.loop_start()
-        print("Connected to MQTT broker", flush=True)
+        self._button_handlers = {
+            btn_idx: (self._on_button_pressed(btn_idx), self._on_button_released(btn_idx))
+            for btn_idx in button_indices
+        }
+        self._axis_handlers = {axis_idx: self._on_axis_moved(axis_idx) for axis_idx in axis_indices}
 
-        # Publish initial disconnected state
-        self._publish_status(False, "")
+    def start(self):
+        self.publish_status(True)
+        # The init events with the current state arrive right away, send it once they are in
+        self._keyframe_deadline = self.clock() + AXIS_SEND_INTERVAL
 
+    def close(self):
+        self.flush_frame()
+        self._button_mask = 0
+        if self._published_axes:
+            # Clear the retained keyframe, a late subscriber must not act on the last stick positions
+            # (or take it for a connected pad), and drop the updates that were not sent yet
+            if self._binary:
+                self._publisher.publish(self.topic_frame, b"", qos=0, retain=True, ordered=True)
+            else:
+                self._publisher.discard(self.topic_axes)
+                self._publisher.publish(self.topic_axes, b"", qos=0, retain=True, ordered=True)
+            self._published_axes = {}
+        self.publish_status(False)
         try:
-            self._main_loop()
-        finally:
-            self._cleanup()
+            self.gamepad.close()
+        except OSError:
+            pass
+        self._pending_throttled.clear()
+        self._pending_immediate.clear()
+        self._flush_deadline = None
+        self._keyframe_deadline = None
 
-    def _cleanup(self):
-        if self._gamepad is not None:
-            name = getattr(self._gamepad, "fullName", "Unknown")
-            self._publish_status(False, name)
-            try:
-                self._gamepad.disconnect()
-            except Exception:
-                pass
-            self._gamepad = None
-        self._mqtt_client.loop_stop()
-        self._mqtt_client.disconnect()
-
-    def _publish_status(self, connected: bool, name: str):
-        payload = json.dumps({"connected": connected, "name": name})
-        self._mqtt_client.publish(TOPIC_STATUS, payload, qos=1, retain=True)
-        print(f"Gamepad {'connected' if connected else 'disconnected'}: {name}", flush=True)
+    def publish_status(self, connected: bool):
+        payload = json.dumps({"connected": connected, "name": self.gamepad.name, "device": self.device})
+        self._publisher.publish(self.topic_status, payload, qos=1, retain=True, ordered=True)
+        print(f"Gamepad {self.device} {'connected' if connected else 'disconnected'}: {self.gamepad.name}", flush=True)
 
     def _publish_button(self, button_id: int, name: str, pressed: bool):
         if self._debug:
-            print(f"Button id={button_id} ({name}): {'pressed' if pressed else 'released'}", flush=True)
-        payload = json.dumps({"code": name, "name": name, "pressed": pressed})
-        self._mqtt_client.publish(TOPIC_BUTTON, payload, qos=1)
+            print(f"{self.device} button id={button_id} ({name}): {'pressed' if pressed else 'released'}", flush=True)
+        if self._binary:
+            bit = FRAME_BUTTON_BITS.get(name)
+            if bit is None:
+                return
+            if pressed:
+                self._button_mask |= bit
+                self._frame_pressed |= bit
+            else:
+                self._button_mask &= ~bit
+            self._frame_dirty = True
+            return
+        payload = json.dumps({"code": name, "name": name, "pressed": pressed, "device": self.device})
+        self._publisher.publish(self.topic_button, payload, qos=1, ordered=True)
 
     def _remap_axis(self, name: str, value: float) -> float:
         if name in self._immediate_axes:
             return (value + 1.0) / 2.0
         return value
 
-    def _publish_axes(self, axes: dict):
-        payload = json.dumps({"axes": axes})
+    def _publish_axes(self, axes: dict, keyframe: bool = False):
         if self._debug:
             changed = {
                 name: value for name, value in axes.items()
@@ -192,9 +604,46 @@ class GamepadListener:
             if changed:
                 # Print as "id=N (NAME): value"
                 parts = [f"id={self._axis_names_inv.get(n, '?')} ({n}): {v}" for n, v in changed.items()]
-                print(f"Axes: {', '.join(parts)}", flush=True)
+                print(f"{self.device} axes: {', '.join(parts)}", flush=True)
                 self._debug_last_axes.update(changed)
-        self._mqtt_client.publish(TOPIC_AXES, payload, qos=0)
+        if self._binary:
+            if keyframe:
+                # After the pending changes, a keyframe must not be overtaken by older state
+                self.flush_frame()
+                self._publish_frame(axes, FRAME_FLAG_KEYFRAME)
+            else:
+                self._frame_axes.update(axes)
+                self._frame_dirty = True
+            return
+        if keyframe:
+            # Retained, so late subscribers get the full state right away. Ordered like the status, so it
+            # can not overtake a disconnect
+            payload = json.dumps({"axes": axes, "device": self.device, "keyframe": True})
+            self._publisher.publish(self.topic_axes, payload, qos=0, retain=True, ordered=True)
+            return
+        # Updates carrying different axes only replace their own kind
+        payload = json.dumps({"axes": axes, "device": self.device})
+        self._publisher.publish(self.topic_axes, payload, qos=0, key=(self.topic_axes, tuple(axes)))
+
+    def flush_frame(self):
+        """Publish the button edges and axis updates collected since the last frame as one binary frame"""
+        if self._frame_dirty:
+            self._publish_frame(self._frame_axes, 0)
+            self._frame_axes = {}
+            self._frame_pressed = 0
+            self._frame_dirty = False
+
+    def _publish_frame(self, axes: dict, flags: int):
+        entries = [(FRAME_AXIS_INDICES[name], value) for name, value in axes.items() if name in FRAME_AXIS_INDICES]
+        pressed = 0 if flags & FRAME_FLAG_KEYFRAME else self._frame_pressed
+        payload = bytearray(FRAME_HEADER.pack(FRAME_VERSION, flags, len(entries), self._sequence,
+                                              self._event_time_ms, self._button_mask, pressed))
+        for index, value in entries:
+            payload += FRAME_AXIS.pack(index, int(round(max(-1.0, min(1.0, value)) * AXIS_SCALE)))
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        # Ordered, frames carry button edges and the sequence numbers let the consumer detect gaps
+        self._publisher.publish(self.topic_frame, bytes(payload), qos=0, retain=bool(flags & FRAME_FLAG_KEYFRAME),
+                                ordered=True)
 
     def _on_button_pressed(self, button_id):
         """Closure factory for button pressed events."""
@@ -210,143 +659,531 @@ class GamepadListener:
             self._publish_button(button_id, name, False)
         return handler
 
+    def _axis_filter(self, name: str) -> AxisFilter:
+        return self._axis_filters.get(name, self._default_axis_filter)
+
+    def _filtered_axis(self, name: str, value: float) -> float:
+        return self._axis_filter(name).apply(self._remap_axis(name, value))
+
     def _on_axis_moved(self, axis_id):
         """Closure factory for axis moved events."""
         name = self._axis_names.get(axis_id, str(axis_id))
         is_immediate = name in self._immediate_axes
+        axis_filter = self._axis_filter(name)
         def handler(value):
+            # Jitter inside the deadzone or below the threshold does not arm anything
+            if not axis_filter.changed(self._filtered_axis(name, value), self._published_axes.get(name)):
+                return
+            if self._keyframe_deadline is None:
+                self._keyframe_deadline = self.clock() + self._keyframe_interval
             if is_immediate:
-                self._immediate_dirty = True
+                self._pending_immediate.add(axis_id)
             else:
-                self._throttled_dirty = True
+                self._pending_throttled.add(axis_id)
+                if self._flush_deadline is None:
+                    # At most one throttled flush per AXIS_SEND_INTERVAL, right away if the last one is older
+                    self._flush_deadline = max(self.clock(), self._last_axis_send + AXIS_SEND_INTERVAL)
         return handler
 
-    def _main_loop(self):
-        while self._running:
-            if self._gamepad is None:
-                self._try_connect()
-            else:
-                self._monitor_gamepad()
+    def read(self):
+        """Dispatch the pending device events to the button and axis handlers.
 
-    def _try_connect(self):
-        """Poll for a gamepad device."""
-        available = GamepadLib.available(JOYSTICK_NUMBER)
-        if available:
-            try:
-                gamepad = GamepadLib.Gamepad(JOYSTICK_NUMBER)  # noqa: keep module-level constant for device index
-                self._gamepad = gamepad
-                name = getattr(gamepad, "fullName", "Generic")
-
-                gamepad.startBackgroundUpdates(waitForReady=True)
-
-                # Register handlers by raw index after init events have populated the maps
-                button_indices = list(gamepad.pressedMap.keys())
-                axis_indices = list(gamepad.axisMap.keys())
-
-                if self._debug:
-                    print(f"Detected gamepad: {name}", flush=True)
-                    print(f"Available buttons: {button_indices}", flush=True)
-                    for btn_idx in button_indices:
-                        btn_name = self._button_names.get(btn_idx, f"UNKNOWN_{btn_idx}")
-                        print(f"  Button {btn_idx}: {btn_name}", flush=True)
-                    print(f"Available axes: {axis_indices}", flush=True)
-                    for axis_idx in axis_indices:
-                        axis_name = self._axis_names.get(axis_idx, f"UNKNOWN_{axis_idx}")
-                        print(f"  Axis {axis_idx}: {axis_name}", flush=True)
-
-                for btn_idx in button_indices:
-                    gamepad.addButtonPressedHandler(btn_idx, self._on_button_pressed(btn_idx))
-                    gamepad.addButtonReleasedHandler(btn_idx, self._on_button_released(btn_idx))
-
-                for axis_idx in axis_indices:
-                    gamepad.addAxisMovedHandler(axis_idx, self._on_axis_moved(axis_idx))
-
-                self._publish_status(True, name)
-            except Exception as e:
-                print(f"Failed to connect to gamepad: {e}", flush=True)
-                self._gamepad = None
-                time.sleep(1)
+        Raises OSError once the device is gone.
+        """
+        initial_state = False
+        for time_ms, event_type, number, value in self.gamepad.read_events():
+            self._event_time_ms = time_ms
+            if event_type & JS_EVENT_INIT:
+                # Initial state, only recorded (like the old background reader did before handlers were added)
+                initial_state = True
+                continue
+            if event_type == JS_EVENT_BUTTON:
+                handlers = self._button_handlers.get(number)
+                if handlers is None:
+                    handlers = self._button_handlers[number] = (self._on_button_pressed(number),
+                                                                self._on_button_released(number))
+                handlers[0 if value else 1]()
+            elif event_type == JS_EVENT_AXIS:
+                handler = self._axis_handlers.get(number)
+                if handler is None:
+                    handler = self._axis_handlers[number] = self._on_axis_moved(number)
+                handler(value)
+        if initial_state:
+            # Buttons held while the pad was connected are part of the state frames report
+            self._button_mask = 0
+            for button_id, pressed in self.gamepad.buttons.items():
+                if pressed:
+                    self._button_mask |= FRAME_BUTTON_BITS.get(self._button_names.get(button_id, str(button_id)), 0)
+        if self._pending_immediate:
+            self._send_axes(self._pending_immediate)
+        self.flush_frame()
+
+    def next_deadline(self):
+        deadlines = [d for d in (self._flush_deadline, self._keyframe_deadline) if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def run_timers(self, now: float):
+        if self._flush_deadline is not None and now >= self._flush_deadline:
+            self._flush_deadline = None
+            if self._pending_throttled:
+                self._send_axes(self._pending_throttled)
+                self._last_axis_send = now
+        if self._keyframe_deadline is not None and now >= self._keyframe_deadline:
+            # Re-armed by the next change only, an idle controller causes no further wakeups
+            self._keyframe_deadline = None
+            self._send_keyframe()
+        self.flush_frame()
+
+    def _send_axes(self, pending: set):
+        """Publish the pending axes whose filtered value still differs from the published one."""
+        axes = {}
+        for axis_idx in pending:
+            if axis_idx not in self.gamepad.axes:
+                continue
+            name = self._axis_names.get(axis_idx, str(axis_idx))
+            value = self._filtered_axis(name, self.gamepad.axes[axis_idx])
+            if self._axis_filter(name).changed(value, self._published_axes.get(name)):
+                axes[name] = value
+        pending.clear()
+        if axes:
+            self._published_axes.update(axes)
+            self._publish_axes(axes)
+
+    def _send_keyframe(self):
+        """Publish the full filtered axis state."""
+        axes = {}
+        for axis_idx, value in list(self.gamepad.axes.items()):
+            name = self._axis_names.get(axis_idx, str(axis_idx))
+            axes[name] = self._filtered_axis(name, value)
+        if axes:
+            self._published_axes.update(axes)
+            self._publish_axes(axes, keyframe=True)
+
+
+class GamepadListener:
+    def __init__(self, debug=False, steam_controller=False, axis_filters=None, keyframe_interval=KEYFRAME_INTERVAL,
+                 device_mappings=None, data_format="json", record_path=None, mqtt_host=MQTT_HOST,
+                 mqtt_port=MQTT_PORT):
+        self._mqtt_client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id="gamepad_listener",
+        )
+        self._mqtt_client.on_connect = self._on_mqtt_connect
+        self._mqtt_client.on_disconnect = self._on_mqtt_disconnect
+        # Axis state is coalesced to the newest value, button and status messages stay in order
+        self._publisher = CoalescingPublisher(self._mqtt_client)
+        self._running = True
+        # Connected controllers by joystick number
+        self._controllers: dict = {}
+        self._axis_filters = axis_filters if axis_filters is not None else build_axis_filters({})
+        self._keyframe_interval = keyframe_interval
+        self._debug = debug
+        self._data_format = data_format
+        self._mqtt_host = mqtt_host
+        self._mqtt_port = mqtt_port
+        self._recorder = EventRecorder(record_path) if record_path else None
+
+        if steam_controller:
+            print("Using Steam Controller mapping", flush=True)
+        self._default_mapping = "steam" if steam_controller else "xbox"
+        # Mapping names by device id (js1) or device name
+        self._device_mappings = device_mappings or {}
+
+        # Device nodes that exist but could not be opened (yet), reported once
+        self._failed_paths: set = set()
+        self._rescan_deadline = None
+        self._selector = selectors.DefaultSelector()
+        self._hotplug = None
+
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+
+        # Signals wake the selector through this pipe, so shutdown does not wait for input
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        signal.set_wakeup_fd(self._wakeup_write)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+
+    def _signal_handler(self, signum, frame):
+        print("Shutdown signal received", flush=True)
+        self._running = False
+
+    def start(self):
+        # Connects in the background and reconnects with backoff, messages are queued meanwhile
+        self._publisher.connect(self._mqtt_host, self._mqtt_port)
+
+        # Publish initial disconnected state of the primary controller
+        payload = json.dumps({"connected": False, "name": "", "device": f"js{JOYSTICK_NUMBER}"})
+        self._publisher.publish(TOPIC_STATUS, payload, qos=1, retain=True, ordered=True)
+
+        try:
+            self._main_loop()
+        finally:
+            self._cleanup()
+
+    def _cleanup(self):
+        for number in list(self._controllers):
+            self._disconnect_gamepad(number)
+        signal.set_wakeup_fd(-1)
+        self._selector.close()
+        if self._hotplug is not None:
+            self._hotplug.close()
+        if self._recorder is not None:
+            self._recorder.close()
+            print(f"Recorded {self._recorder.records} records to {self._recorder.path}", flush=True)
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+        stats = self._publisher.stats()
+        print(f"MQTT: {stats['published']} published, {stats['coalesced']} coalesced, "
+              f"{stats['dropped']} dropped, {stats['reconnects']} reconnects", flush=True)
+        self._publisher.stop()
+
+    def _on_mqtt_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            print("Connected to MQTT broker", flush=True)
+            self._publisher.set_connected(True)
         else:
-            time.sleep(1)
+            print(f"Failed to connect to MQTT broker: {reason_code}", flush=True)
 
-    def _monitor_gamepad(self):
-        """Monitor connected gamepad, send throttled axis data, detect disconnect."""
-        gamepad = self._gamepad
+    def _on_mqtt_disconnect(self, client, userdata, flags, reason_code, properties):
+        if self._publisher.connected:
+            print(f"Disconnected from MQTT broker ({reason_code}), reconnecting", flush=True)
+        self._publisher.set_connected(False)
 
-        if not gamepad.isConnected():
-            name = getattr(gamepad, "fullName", "Unknown")
-            self._publish_status(False, name)
-            try:
-                gamepad.disconnect()
-            except Exception:
+    def _main_loop(self):
+        try:
+            self._hotplug = HotplugWatcher(INPUT_DIR)
+            self._selector.register(self._hotplug, selectors.EVENT_READ)
+        except OSError as e:
+            print(f"Hotplug notification unavailable ({e}), scanning for gamepads every {RECONNECT_INTERVAL}s",
+                  flush=True)
+        self._scan_devices()
+        while self._running:
+            timeout = self._next_timeout(time.monotonic())
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj == self._wakeup_read:
+                    self._drain_wakeup()
+                elif key.fileobj is self._hotplug:
+                    self._on_hotplug()
+                else:
+                    self._read_gamepad(key.data)
+            self._run_timers(time.monotonic())
+
+    def _next_timeout(self, now: float):
+        """Seconds until the next armed timer, None (block until input) when none is armed"""
+        deadlines = [controller.next_deadline() for controller in self._controllers.values()]
+        deadlines.append(self._rescan_deadline)
+        deadlines = [d for d in deadlines if d is not None]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now)
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_read, 64):
                 pass
-            self._gamepad = None
-            self._throttled_dirty = False
-            self._immediate_dirty = False
+        except BlockingIOError:
+            pass
+
+    def _on_hotplug(self):
+        names = self._hotplug.read_names()
+        if names is None:
+            self._scan_devices()
             return
+        numbers = [int(match.group(1)) for match in map(JOYSTICK_NODE.match, names) if match]
+        if numbers:
+            self._scan_devices(numbers)
 
-        now = time.monotonic()
-        periodic = now - self._last_axis_send >= AXIS_SEND_INTERVAL
-        send_throttled = self._throttled_dirty and periodic
-        send_immediate = self._immediate_dirty
-
-        if send_throttled or send_immediate:
-            axes = {}
-            for axis_idx in list(gamepad.axisMap.keys()):
-                try:
-                    name = self._axis_names.get(axis_idx, str(axis_idx))
-                    is_imm = name in self._immediate_axes
-                    if (is_imm and send_immediate) or (not is_imm and send_throttled):
-                        axes[name] = round(self._remap_axis(name, gamepad.axisMap[axis_idx]), 4)
-                except (KeyError, ValueError):
-                    pass
-            if axes:
-                self._publish_axes(axes)
-            if send_immediate:
-                self._immediate_dirty = False
-            if send_throttled:
-                self._throttled_dirty = False
-                self._last_axis_send = now
+    def _scan_devices(self, numbers=None):
+        """Open the joystick nodes that are not connected yet, all present ones unless numbers are given."""
+        if numbers is None:
+            self._rescan_deadline = None
+            try:
+                names = os.listdir(INPUT_DIR)
+            except OSError:
+                names = []
+            numbers = [int(match.group(1)) for match in map(JOYSTICK_NODE.match, names) if match]
+            present = {JOYSTICK_PATH.format(number) for number in numbers}
+            self._failed_paths &= present
+        failed = False
+        for number in sorted(numbers):
+            if number not in self._controllers and not self._try_connect(number):
+                failed = True
+        if (failed or self._hotplug is None) and self._rescan_deadline is None:
+            # Nodes can show up before udev made them readable, retry them without waiting for a notification
+            self._rescan_deadline = time.monotonic() + RECONNECT_INTERVAL
+
+    def _mapping_for(self, device: str, name: str) -> str:
+        return self._device_mappings.get(device) or self._device_mappings.get(name) or self._default_mapping
+
+    def _try_connect(self, number: int) -> bool:
+        """Open the joystick device, False if it is present but could not be opened."""
+        path = JOYSTICK_PATH.format(number)
+        if not os.path.exists(path):
+            return True
+        try:
+            gamepad = Joystick(path)
+        except OSError as e:
+            if path not in self._failed_paths:
+                print(f"Failed to connect to gamepad {path}: {e}", flush=True)
+                self._failed_paths.add(path)
+            return False
+        self._failed_paths.discard(path)
+        if self._recorder is not None:
+            self._recorder.connect(number, gamepad)
+            gamepad.on_data = lambda data: self._recorder.events(number, data)
+        controller = self._add_controller(number, gamepad)
+        self._selector.register(gamepad, selectors.EVENT_READ, controller)
+        return True
+
+    def _add_controller(self, number: int, gamepad: Joystick, clock=time.monotonic) -> Controller:
+        device = f"js{number}"
+        controller = Controller(gamepad, number, self._publisher, self._mapping_for(device, gamepad.name),
+                                self._axis_filters, self._keyframe_interval, self._debug, self._data_format, clock)
+        self._controllers[number] = controller
+        controller.start()
+        return controller
+
+    def _disconnect_gamepad(self, number: int):
+        controller = self._controllers.pop(number)
+        if self._recorder is not None and not isinstance(controller.gamepad, ReplayJoystick):
+            self._recorder.disconnect(number)
+        try:
+            self._selector.unregister(controller.gamepad)
+        except (KeyError, ValueError):
+            pass
+        controller.close()
+
+    def _read_gamepad(self, controller: Controller):
+        try:
+            controller.read()
+        except OSError:
+            self._disconnect_gamepad(controller.number)
 
-        # Full state broadcast every 50ms regardless of dirty flags
-        if periodic and not send_throttled:
-            axes = {}
-            for axis_idx in list(gamepad.axisMap.keys()):
-                try:
-                    name = self._axis_names.get(axis_idx, str(axis_idx))
-                    axes[name] = round(self._remap_axis(name, gamepad.axisMap[axis_idx]), 4)
-                except (KeyError, ValueError):
-                    pass
-            if axes:
-                self._publish_axes(axes)
-            self._last_axis_send = now
+    def _run_timers(self, now: float):
+        if self._rescan_deadline is not None and now >= self._rescan_deadline:
+            self._scan_devices()
+        for controller in list(self._controllers.values()):
+            controller.run_timers(now)
 
-        # Small sleep to avoid busy-waiting
-        time.sleep(0.01)
+    def replay(self, records: list, speed: float = 1.0, observer=None):
+        """Feed an event log through the controllers in place of the devices.
+
+        The controllers run on the clock of the recording, so throttling and keyframes come out as they
+        did live whatever the speed (0 replays as fast as possible). observer(step, offset, started) is
+        called after every read ("read") and timer run ("timer") with the offset in the recording and the
+        time.perf_counter() the step started at.
+        """
+        started = time.monotonic()
+        position = [0.0]
+        clock = lambda: started + position[0]
+
+        def advance(offset: float):
+            if speed > 0:
+                delay = started + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            position[0] = max(position[0], offset)
+
+        for offset, kind, number, payload in records:
+            if not self._running:
+                break
+            # Timers that expire before the next record
+            while self._controllers:
+                deadlines = [d for d in (c.next_deadline() for c in self._controllers.values()) if d is not None]
+                if not deadlines or min(deadlines) - started > offset:
+                    break
+                advance(min(deadlines) - started)
+                step_started = time.perf_counter()
+                for controller in list(self._controllers.values()):
+                    controller.run_timers(clock())
+                if observer is not None:
+                    observer("timer", position[0], step_started)
+            advance(offset)
+            if kind == EVENT_LOG_CONNECT:
+                axis_count, button_count = EVENT_LOG_DEVICE.unpack_from(payload)
+                name = payload[EVENT_LOG_DEVICE.size:].decode(errors="replace")
+                if number in self._controllers:
+                    self._disconnect_gamepad(number)
+                self._add_controller(number, ReplayJoystick(JOYSTICK_PATH.format(number), name, axis_count, button_count),
+                                     clock)
+            elif kind == EVENT_LOG_DISCONNECT:
+                if number in self._controllers:
+                    self._disconnect_gamepad(number)
+            elif kind == EVENT_LOG_EVENTS and number in self._controllers:
+                controller = self._controllers[number]
+                step_started = time.perf_counter()
+                controller.gamepad.feed(payload)
+                self._read_gamepad(controller)
+                if observer is not None:
+                    observer("read", position[0], step_started)
+        for number in list(self._controllers):
+            self._disconnect_gamepad(number)
+
+
+def percentiles(values: list, q=(50, 95, 99)) -> list:
+    """Nearest-rank percentiles, 0 for an empty list"""
+    if not values:
+        return [0.0 for _ in q]
+    ordered = sorted(values)
+    return [ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))] for p in q]
+
+
+def run_benchmark(listener: GamepadListener, records: list):
+    """Replay an event log as fast as possible through the listener and print a report.
+
+    MQTT is replaced by a NullMqttClient and the controllers follow the clock of the log, so the checksum
+    of the published payloads only changes when the output of the listener changes. Event to publish
+    latency is the processing time for messages sent right away, plus the time spent waiting for the
+    throttled flush (in recording time) for axis updates.
+    """
+    sink = NullMqttClient()
+    listener._publisher = CoalescingPublisher(sink)
+    listener._publisher.set_connected(True)
+    dispatch_times = []
+    latencies = []
+    state = {"published": 0, "waiting": None}
+
+    def observer(step, offset, step_started):
+        elapsed = time.perf_counter() - step_started
+        published = sink.published - state["published"]
+        state["published"] = sink.published
+        pending = any(controller._pending_throttled for controller in listener._controllers.values())
+        if step == "read":
+            dispatch_times.append(elapsed)
+            latencies.extend([elapsed] * published)
+            if pending and state["waiting"] is None:
+                state["waiting"] = offset
+        elif published and state["waiting"] is not None:
+            latencies.extend([offset - state["waiting"] + elapsed] * published)
+            state["waiting"] = offset if pending else None
+
+    events = sum(len(payload) // JS_EVENT.size for _, kind, _, payload in records if kind == EVENT_LOG_EVENTS)
+    devices = len({number for _, kind, number, _ in records if kind == EVENT_LOG_CONNECT})
+    duration = records[-1][0] - records[0][0] if records else 0.0
+    started = time.perf_counter()
+    listener.replay(records, speed=0, observer=observer)
+    elapsed = time.perf_counter() - started
+
+    stats = listener._publisher.stats()
+    print(f"Benchmark: {events} events ({duration:.1f} s of input, {devices} controller(s), "
+          f"{listener._data_format}) in {elapsed:.3f} s", flush=True)
+    if elapsed <= 0.0 or events == 0:
+        return
+    print(f"  Throughput: {events / elapsed:.0f} events/s ({duration / elapsed:.1f}x real time)")
+    print(f"  Published: {sink.published} messages, {sink.bytes} bytes, {stats['coalesced']} coalesced, "
+          f"{stats['dropped']} dropped")
+    for topic, count in sorted(sink.topics.items()):
+        print(f"    {topic:<30}{count:>8}")
+    print(f"  Checksum: {sink.checksum:08x}")
+    print(f"  {'Latency':<26}{'p50':>10}{'p95':>10}{'p99':>10}")
+    p50, p95, p99 = percentiles(dispatch_times)
+    print(f"    {'dispatch (us)':<24}{p50 * 1e6:>10.1f}{p95 * 1e6:>10.1f}{p99 * 1e6:>10.1f}")
+    p50, p95, p99 = percentiles(latencies)
+    print(f"    {'event to publish (ms)':<24}{p50 * 1e3:>10.2f}{p95 * 1e3:>10.2f}{p99 * 1e3:>10.2f}", flush=True)
+
+
+def run_replay(listener: GamepadListener, records: list, speed: float):
+    """--replay mode: publish a recorded session to the broker, no controller needed"""
+    listener._publisher.connect(listener._mqtt_host, listener._mqtt_port)
+    deadline = time.monotonic() + 10.0
+    while not listener._publisher.connected and time.monotonic() < deadline and listener._running:
+        time.sleep(0.05)
+    if not listener._publisher.connected:
+        print(f"Could not connect to MQTT broker at {listener._mqtt_host}:{listener._mqtt_port}", flush=True)
+        return False
+    print(f"Replaying {len(records)} records ({records[-1][0] - records[0][0]:.1f} s) at "
+          f"{'full' if speed <= 0 else f'{speed:g}x'} speed", flush=True)
+    listener.replay(records, speed)
+    # Let the last messages go out before disconnecting
+    deadline = time.monotonic() + 5.0
+    while listener._publisher.stats()["queued"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return True
 
 
 def main():
     parser = argparse.ArgumentParser(description="Gamepad Listener Service for Protogen")
     parser.add_argument("--debug", action="store_true", help="Enable debug output for buttons and axes")
     parser.add_argument("--config", metavar="PATH", help="Path to a JSON config file")
+    parser.add_argument("--keyframe-interval", type=float, default=None,
+                        help=f"Seconds between full axis state keyframes while the controller is in use (default: {KEYFRAME_INTERVAL})")
+    parser.add_argument("--format", choices=DATA_FORMATS, default=None,
+                        help="Publish JSON messages or one binary frame per flush (default: json, or the config file)")
+    parser.add_argument("--mqtt-host", type=str, default=MQTT_HOST, help="MQTT broker host")
+    parser.add_argument("--mqtt-port", type=int, default=MQTT_PORT, help="MQTT broker port")
+    parser.add_argument("--record", metavar="PATH", default=None, help="Record the raw joystick events to an event log")
+    parser.add_argument("--replay", metavar="PATH", default=None,
+                        help="Publish a recorded event log through the listener instead of reading the controllers")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="Replay speed factor, 0 replays as fast as possible (default: 1)")
+    parser.add_argument("--benchmark", metavar="PATH", nargs="?", const="", default=None,
+                        help="Replay an event log (synthetic input without one) as fast as possible without MQTT and report throughput and latency")
+    parser.add_argument("--benchmark-seconds", type=float, default=60.0, help="Seconds of synthetic input in benchmark mode")
     args = parser.parse_args()
 
     steam_controller = False
+    axis_filters = None
+    keyframe_interval = KEYFRAME_INTERVAL
+    device_mappings = None
+    data_format = "json"
     if args.config:
         try:
             cfg = load_config(args.config)
             steam_controller = cfg["steam_controller"]
+            axis_filters = cfg["axis_filters"]
+            keyframe_interval = cfg["keyframe_interval"]
+            device_mappings = cfg["device_mappings"]
+            data_format = cfg["data_format"]
         except FileNotFoundError:
             print(f"Config file at {args.config} not found, continuing with defaults", flush=True)
-        except (json.JSONDecodeError, ValueError) as e:
+        except (json.JSONDecodeError, ValueError, TypeError, KeyError) as e:
             print(f"Error loading config: {e}", flush=True)
             sys.exit(1)
 
     print("Gamepad Listener starting...", flush=True)
     if args.debug:
         print("Debug mode enabled", flush=True)
-    listener = GamepadListener(debug=args.debug, steam_controller=steam_controller)
-    listener.start()
+    if args.keyframe_interval is not None:
+        if args.keyframe_interval <= 0:
+            parser.error("--keyframe-interval must be positive")
+        keyframe_interval = args.keyframe_interval
+    if args.format is not None:
+        data_format = args.format
+
+    records = None
+    log_path = args.replay if args.replay is not None else args.benchmark
+    if log_path:
+        try:
+            records = load_event_log(log_path)
+        except (OSError, ValueError) as e:
+            print(f"Error loading event log: {e}", flush=True)
+            sys.exit(1)
+        if not records:
+            print(f"{log_path} has no records", flush=True)
+            sys.exit(1)
+    elif args.benchmark is not None:
+        records = synthetic_event_log(args.benchmark_seconds)
+
+    listener = GamepadListener(debug=args.debug, steam_controller=steam_controller,
+                               axis_filters=axis_filters, keyframe_interval=keyframe_interval,
+                               device_mappings=device_mappings, data_format=data_format,
+                               record_path=args.record if args.replay is None and args.benchmark is None else None,
+                               mqtt_host=args.mqtt_host, mqtt_port=args.mqtt_port)
+    if args.benchmark is not None:
+        try:
+            run_benchmark(listener, records)
+        finally:
+            listener._cleanup()
+    elif args.replay is not None:
+        try:
+            if not run_replay(listener, records, args.replay_speed):
+                sys.exit(1)
+        finally:
+            listener._cleanup()
+    else:
+        listener.start()
 
 
 if __name__ == "__main__":
@@ -304,7 +304,8 @@ if [[ "$IS_UPDATE" == "false" ]]; then
 fi
 
 cd /home/pi/protogen
-git submodule update --init --recursive
+# The gamepad listener used to vendor the piborg Gamepad library as a submodule, it reads the joystick devices itself now
+rm -rf /home/pi/protogen/gamepad_listener/Gamepad
 
 # Frontend
 echo Building frontend
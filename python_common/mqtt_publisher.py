@@ -0,0 +1,211 @@
+"""
+Bounded MQTT publisher shared by the Python listeners (audio visualizer, gamepad).
+
+paho buffers every publish without limit while the broker is slow or reconnecting and delivers
+the backlog in a burst afterwards. CoalescingPublisher keeps at most max_inflight messages inside
+paho and holds the rest itself:
+  - Coalesced topics (frames, axis state) have one latest-value slot each, a newer payload
+    replaces a queued one that was not sent yet and moves it to the back of the queue.
+  - Ordered messages (button events, status) go through a bounded FIFO and are never reordered,
+    the oldest is dropped when it is full.
+"""
+
+import threading
+import zlib
+from collections import deque
+from typing import Any, Dict, Hashable, Optional
+
+DEFAULT_MAX_INFLIGHT = 16
+DEFAULT_MAX_QUEUED = 256
+DEFAULT_RECONNECT_MIN_DELAY = 1
+DEFAULT_RECONNECT_MAX_DELAY = 30
+# paho.mqtt.client.MQTT_ERR_QUEUE_SIZE, paho's own queue (max_queued_messages_set) is full
+MQTT_ERR_QUEUE_SIZE = 15
+
+
+class CoalescingPublisher:
+    """Latest-value / ordered publisher in front of a paho client.
+
+    The owner reports the connection state through set_connected (from its on_connect and
+    on_disconnect callbacks), on_publish is taken over to track the in-flight window.
+    """
+
+    def __init__(self, client, max_inflight: int = DEFAULT_MAX_INFLIGHT, max_queued: int = DEFAULT_MAX_QUEUED):
+        self.client = client
+        self.max_inflight = max_inflight
+        self.connected = False
+        self.inflight = 0
+        self._latest: Dict[Hashable, tuple] = {}
+        self._ordered = deque(maxlen=max_queued)
+        # Guards the queues and counters, never held while calling into paho: paho holds its own
+        # message mutex while it calls on_publish, taking this lock there would deadlock a publish
+        self._lock = threading.Lock()
+        # Only one thread sends at a time (keeps ordered messages in order), the others leave the
+        # messages they queued to it
+        self._flushing = False
+
+        # Counters since start
+        self.published = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._was_connected = False
+
+        if hasattr(client, 'on_publish'):
+            client.on_publish = self._on_publish
+
+    def connect(self, host: str, port: int, keepalive: int = 60,
+                min_delay: int = DEFAULT_RECONNECT_MIN_DELAY, max_delay: int = DEFAULT_RECONNECT_MAX_DELAY):
+        """Connect in the background, paho retries with a doubling delay until the broker is reachable"""
+        self.client.reconnect_delay_set(min_delay, max_delay)
+        self.client.connect_async(host, port, keepalive)
+        self.client.loop_start()
+
+    def stop(self):
+        try:
+            self.client.disconnect()
+        finally:
+            self.client.loop_stop()
+
+    def set_connected(self, connected: bool):
+        """Track the broker connection, queued messages are sent once it is back"""
+        with self._lock:
+            if connected and self._was_connected and not self.connected:
+                self.reconnects += 1
+            self.connected = connected
+            self._was_connected = self._was_connected or connected
+            # paho does not report completion of QoS 0 messages that were lost with the connection
+            self.inflight = 0
+        if connected:
+            self._flush()
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False, ordered: bool = False,
+                key: Optional[Hashable] = None):
+        """Queue a message and send as much as the in-flight window allows.
+
+        Messages with ordered=False replace an unsent message with the same key (the topic unless
+        given, a topic carrying partial updates needs one key per kind of update).
+        """
+        with self._lock:
+            if ordered:
+                if len(self._ordered) == self._ordered.maxlen:
+                    self.dropped += 1
+                self._ordered.append((topic, payload, qos, retain))
+            else:
+                slot = topic if key is None else key
+                if self._latest.pop(slot, None) is not None:
+                    self.coalesced += 1
+                # (Re)inserted at the back: slots are sent oldest update first, so when partial updates
+                # of one topic overlap (keys per kind of update) the newest value of every field goes last
+                self._latest[slot] = (topic, payload, qos, retain)
+        self._flush()
+
+    def discard(self, topic: str):
+        """Drop the unsent coalesced messages of a topic, e.g. state updates of a device that went away"""
+        with self._lock:
+            for slot in [slot for slot, message in self._latest.items() if message[0] == topic]:
+                del self._latest[slot]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'connected': self.connected,
+                'published': self.published,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'reconnects': self.reconnects,
+                'inflight': self.inflight,
+                'queued': len(self._ordered) + len(self._latest),
+            }
+
+    def _next_message(self):
+        """Take the next message to send off the queues, None if nothing can be sent right now"""
+        if not self.connected or self.inflight >= self.max_inflight:
+            return None
+        # Ordered messages first, they are the ones a consumer can not recover from losing
+        if self._ordered:
+            return None, self._ordered.popleft()
+        if self._latest:
+            slot = next(iter(self._latest))
+            return slot, self._latest.pop(slot)
+        return None
+
+    def _requeue(self, slot, message):
+        if slot is None:
+            self._ordered.appendleft(message)
+        else:
+            self._latest.setdefault(slot, message)
+
+    def _flush(self):
+        with self._lock:
+            if self._flushing:
+                return
+            self._flushing = True
+        try:
+            while True:
+                with self._lock:
+                    # Checked under the lock that also clears the flag, a message queued by another
+                    # thread is either seen here or sent by that thread
+                    next_message = self._next_message()
+                    if next_message is None:
+                        self._flushing = False
+                        return
+                    self.inflight += 1
+                slot, message = next_message
+                topic, payload, qos, retain = message
+                try:
+                    info = self.client.publish(topic, payload, qos=qos, retain=retain)
+                except BaseException:
+                    # Not retried, a payload paho rejects would fail again on every flush
+                    with self._lock:
+                        self.inflight = max(0, self.inflight - 1)
+                        self.dropped += 1
+                    raise
+                with self._lock:
+                    if info is not None and info.rc != 0:
+                        if qos == 0 or info.rc == MQTT_ERR_QUEUE_SIZE:
+                            # Not connected after all (or paho's own queue is full), retry on the next flush
+                            self.inflight = max(0, self.inflight - 1)
+                            self._requeue(slot, message)
+                        else:
+                            # QoS > 0 while disconnected: paho keeps the message and sends it after the
+                            # reconnect itself, requeueing it would deliver it twice
+                            self.published += 1
+                        self._flushing = False
+                        return
+                    self.published += 1
+                    if info is None:
+                        # Clients without delivery callbacks complete immediately
+                        self.inflight = max(0, self.inflight - 1)
+        except BaseException:
+            with self._lock:
+                self._flushing = False
+            raise
+
+    def _on_publish(self, client, userdata, mid, *args):
+        with self._lock:
+            self.inflight = max(0, self.inflight - 1)
+        self._flush()
+
+
+class NullMqttClient:
+    """Stand-in for the MQTT client in benchmark mode, counts and checksums published payloads"""
+
+    def __init__(self):
+        self.published = 0
+        self.bytes = 0
+        self.checksum = 0
+        self.topics: Dict[str, int] = {}
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        data = payload.encode() if isinstance(payload, str) else payload
+        self.published += 1
+        self.bytes += len(data)
+        self.checksum = zlib.crc32(data, self.checksum)
+        self.topics[topic] = self.topics.get(topic, 0) + 1
+
+    def disconnect(self):
+        pass
+
+    def loop_stop(self):
+        pass